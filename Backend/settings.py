@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'library.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +55,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'Backend.urls'
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'Backend.urls')
 
 TEMPLATES = [
     {
@@ -77,11 +79,80 @@ WSGI_APPLICATION = 'Backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+if os.environ.get('LIBRARY_DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('LIBRARY_DB_NAME', 'library'),
+            'USER': os.environ.get('LIBRARY_DB_USER', ''),
+            'PASSWORD': os.environ.get('LIBRARY_DB_PASSWORD', ''),
+            'HOST': os.environ.get('LIBRARY_DB_HOST', ''),
+            'PORT': os.environ.get('LIBRARY_DB_PORT', ''),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('LIBRARY_DB_POOL_MAX_SIZE'):
+        # psycopg's pool replaces persistent connections; Django rejects both at once.
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'min_size': int(os.environ.get('LIBRARY_DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['LIBRARY_DB_POOL_MAX_SIZE']),
+            'timeout': 10,
+        }}
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('LIBRARY_DB_CONN_MAX_AGE', 60))
+    replica_setting = 'HOST'
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('LIBRARY_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # WAL lets readers run alongside the single writer, and IMMEDIATE transactions take the
+                # write lock up front so busy writers wait out the timeout instead of failing to upgrade.
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': float(os.environ.get('LIBRARY_SQLITE_BUSY_TIMEOUT', 20)),
+            },
+            # A file-backed test database lets concurrency tests share it across threads.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+    replica_setting = 'NAME'
+
+# Comma-separated replica hosts (PostgreSQL) or database files (SQLite, e.g. LiteFS/Litestream read copies).
+LIBRARY_DB_REPLICAS = []
+for n, replica in enumerate(filter(None, os.environ.get('LIBRARY_DB_REPLICAS', '').split(','))):
+    LIBRARY_DB_REPLICAS.append(f'replica_{n}')
+    DATABASES[f'replica_{n}'] = {**DATABASES['default'], replica_setting: replica.strip(), 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['library.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'library.cache.LRULocMemCache',
+        'LOCATION': 'library',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+if os.environ.get('LIBRARY_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['LIBRARY_REDIS_URL'],
     }
+
+LIBRARY_RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+LIBRARY_TOKEN_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
 }
 
 
@@ -128,8 +199,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'library.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'library.pagination.IdCursorPagination',
 }
 
 AUTH_USER_MODEL = 'library.CustomUser'
@@ -137,4 +209,44 @@ AUTH_USER_MODEL = 'library.CustomUser'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+LIBRARY_PREVIEWS = {
+    'WORKERS': int(os.environ.get('LIBRARY_PREVIEW_WORKERS', 2)),
+    'QUALITY': 80,
+    'VARIANTS': {'list': (200, 300), 'detail': (600, 900)},
+}
+
+LIBRARY_MEDIA = {
+    'PREFIXES': ('book_previews/',),
+    'MAX_AGE': 3600,
+    # 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) hands file transfer to the front proxy.
+    'OFFLOAD': os.environ.get('LIBRARY_MEDIA_OFFLOAD') or None,
+    'ACCEL_REDIRECT_LOCATION': '/protected-media/',
+}
+
+LIBRARY_HOLDS = {
+    'PICKUP_DAYS': int(os.environ.get('LIBRARY_HOLD_PICKUP_DAYS', 3)),
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+LIBRARY_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('LIBRARY_INSTRUMENTATION', '1') != '0',
+    'SERVER_TIMING': True,
+    'REPEATED_QUERY_THRESHOLD': 5,
+    'METRICS_ALLOWED_IPS': tuple(filter(None, os.environ.get('LIBRARY_METRICS_ALLOWED_IPS', '').split(','))),
+}
+
+# Per-request lines from library.instrumentation are logged at INFO; repeated-query warnings at WARNING.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {
+        'library.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('LIBRARY_REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 APPEND_SLASH = False
@@ -0,0 +1,8 @@
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('library.urls_async')),
+    *sync_urlpatterns,
+]
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import CustomUser, Book, AvailableBook, Borrow, Review
+from django.db.models import Q
+from .models import CustomUser, Book, AvailableBook, Borrow, Branch, DailyCirculation, Hold, Review
+from .holds import cancel_hold
+from .search import search_books
 
 # Register your models here.
 
@@ -11,15 +14,29 @@ class CustomUserAdmin(admin.ModelAdmin):
 admin.site.register(CustomUser, CustomUserAdmin)
 
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'published_date', 'genre', 'isbn', 'language')
+    list_display = ('title', 'author', 'published_date', 'genre', 'isbn', 'language', 'available_copies', 'total_copies')
     search_fields = ('title', 'author', 'isbn')
     list_filter = ('genre', 'language', 'published_date')
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        matches = search_books(Book.objects.all(), search_term).values('pk')
+        return queryset.filter(Q(pk__in=matches) | Q(isbn=search_term.strip())), False
+
 admin.site.register(Book, BookAdmin)
 
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+
+admin.site.register(Branch, BranchAdmin)
+
 class AvailableBookAdmin(admin.ModelAdmin):
-    list_display = ('book', 'location')
-    search_fields = ('book__title', 'location')
+    list_display = ('book', 'branch', 'is_checked_out')
+    list_select_related = ('book', 'branch')
+    search_fields = ('book__title', 'branch__name')
+    list_filter = ('branch',)
 
 admin.site.register(AvailableBook, AvailableBookAdmin)
 
@@ -30,6 +47,42 @@ class BorrowAdmin(admin.ModelAdmin):
 
 admin.site.register(Borrow, BorrowAdmin)
 
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'status', 'assigned_copy', 'created_at', 'expires_at')
+    list_select_related = ('book', 'user')
+    search_fields = ('user__username', 'book__title')
+    list_filter = ('status',)
+    raw_id_fields = ('book', 'user')
+    # Assignment moves through the queue; cancelling goes through cancel_hold() so the copy is released.
+    readonly_fields = ('status', 'assigned_copy', 'ready_at', 'expires_at')
+    actions = ('cancel_holds',)
+
+    @admin.action(description='Cancel selected holds')
+    def cancel_holds(self, request, queryset):
+        cancelled = sum(cancel_hold(hold_id) for hold_id in queryset.values_list('pk', flat=True))
+        self.message_user(request, f'Cancelled {cancelled} hold(s).')
+
+admin.site.register(Hold, HoldAdmin)
+
+class DailyCirculationAdmin(admin.ModelAdmin):
+    list_display = ('day', 'book', 'checkouts', 'returns', 'open_loans', 'overdue')
+    list_select_related = ('book',)
+    search_fields = ('book__title',)
+    date_hierarchy = 'day'
+    ordering = ('-day', 'book')
+
+    # Maintained by refresh_circulation; the admin only reads it.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+admin.site.register(DailyCirculation, DailyCirculationAdmin)
+
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('user', 'book', 'rating', 'comment')
     search_fields = ('user__username', 'book__title')
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import instrumentation, signals
+
+        post_migrate.connect(signals.ensure_search_index, sender=self)
+        connection_created.connect(instrumentation.install_query_hook)
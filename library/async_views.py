@@ -0,0 +1,133 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from .cache import CachedResponseMixin, entry_from_response, response_cache, response_from_entry
+from .conditional import ConditionalGetMixin, compute_validators, list_response, set_validators
+
+ASYNC_ACTIONS = ('list', 'retrieve')
+
+
+def async_read_view(viewset, actions):
+    # list/retrieve run on the event loop with the async ORM; every other action runs the
+    # regular DRF view in a worker thread.
+    sync_view = sync_to_async(viewset.as_view(actions))
+    actions = {'head': actions['get'], **actions}
+
+    async def view(request, *args, **kwargs):
+        if actions.get(request.method.lower()) not in ASYNC_ACTIONS:
+            return await sync_view(request, *args, **kwargs)
+        return await dispatch(viewset, actions, request, *args, **kwargs)
+
+    return csrf_exempt(view)
+
+
+async def dispatch(viewset, actions, request, *args, **kwargs):
+    view = viewset()
+    view.action_map = actions
+    for method, action in actions.items():
+        setattr(view, method, getattr(view, action))
+    view.args, view.kwargs = args, kwargs
+    view.headers = view.default_response_headers
+    view.format_kwarg = view.get_format_suffix(**kwargs)
+    request = view.request = view.initialize_request(request, *args, **kwargs)
+    try:
+        await authenticate(request)
+        view.initial(request, *args, **kwargs)
+        response = await cached_response(view, request)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    return rendered(view.finalize_response(request, response, *args, **kwargs))
+
+
+async def authenticate(request):
+    for authenticator in request.authenticators:
+        try:
+            if hasattr(authenticator, 'aauthenticate'):
+                user_auth = await authenticator.aauthenticate(request)
+            else:
+                user_auth = await sync_to_async(authenticator.authenticate)(request)
+        except exceptions.APIException:
+            request._not_authenticated()
+            raise
+        if user_auth is not None:
+            request._authenticator = authenticator
+            request.user, request.auth = user_auth
+            return
+    request._not_authenticated()
+
+
+async def cached_response(view, request):
+    scopes = view.get_cache_scopes() if isinstance(view, CachedResponseMixin) else None
+    if not scopes or not response_cache.config.get('ENABLED', True):
+        return await conditional_response(view, request)
+    key = await response_cache.akey(scopes, request.build_absolute_uri())
+    entry = await response_cache.aget(key)
+    if entry is not None:
+        return response_from_entry(request, entry)
+    response = await conditional_response(view, request)
+    if response.status_code == 200:
+        await response_cache.aset(key, entry_from_response(response))
+    return response
+
+
+async def conditional_response(view, request):
+    if not isinstance(view, ConditionalGetMixin):
+        if view.action == 'list':
+            return list_response(view, *await page_rows(view, request, view.filter_queryset(view.get_queryset())))
+        return await retrieve_response(view, request)
+    if view.action == 'list':
+        # As in ConditionalGetMixin.list, the validators come from the page that is served.
+        rows, page = await page_rows(view, request, view.list_queryset())
+        scopes = view.list_scopes()
+        state = view.list_state(rows, await response_cache.aversions(scopes) if scopes else [])
+    else:
+        state = await view.retrieve_state().afirst()
+        if state is None:
+            raise Http404
+        state = list(state)
+
+    etag, last_modified = compute_validators(state, request)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    if view.action == 'list':
+        response = list_response(view, rows, page)
+    else:
+        response = await retrieve_response(view, request)
+    if response.status_code == 200:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+async def page_rows(view, request, queryset):
+    if view.paginator is None:
+        return [item async for item in queryset], None
+    page = await view.paginator.apaginate_queryset(queryset, request, view)
+    return page, page
+
+
+async def retrieve_response(view, request):
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    queryset = view.filter_queryset(view.get_queryset())
+    try:
+        instance = await queryset.aget(**{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+    except queryset.model.DoesNotExist:
+        raise Http404
+    view.check_object_permissions(request, instance)
+    return Response(view.get_serializer(instance).data)
+
+
+def rendered(response):
+    # Django renders template-style responses in a worker thread; JSON rendering is cheap
+    # enough to do here and hand back a plain response.
+    if not hasattr(response, 'render'):
+        return response
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
@@ -0,0 +1,92 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import CustomUser
+
+# Enough for permissions and ownership filters; any other field is loaded lazily on first access.
+# Model.from_db() expects the values in concrete field order.
+CACHED_USER_FIELDS = [
+    field.attname for field in CustomUser._meta.concrete_fields
+    if field.attname in {'id', 'username', 'role', 'is_active', 'is_staff', 'is_superuser'}
+]
+DEFAULTS = {'ALIAS': 'default', 'TIMEOUT': 300}
+
+
+def token_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_TOKEN_CACHE', {})}
+
+
+def _cache_key(token_key):
+    # Never put the bearer secret itself into a shared cache.
+    return 'auth-token:' + hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def _forget(cache_keys):
+    cache = caches[token_cache_settings()['ALIAS']]
+    cache.delete_many(cache_keys)
+    # A request racing the write may re-cache the old row before it commits.
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def invalidate_token(token_key):
+    _forget([_cache_key(token_key)])
+
+
+def invalidate_user_tokens(user_id):
+    keys = [_cache_key(key) for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True)]
+    if keys:
+        _forget(keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        config = token_cache_settings()
+        cache = caches[config['ALIAS']]
+        values = cache.get(_cache_key(key))
+        if values is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(_cache_key(key), self.cached_values(user), config['TIMEOUT'])
+            return user, token
+        return self.from_cached_values(key, values)
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        config = token_cache_settings()
+        cache = caches[config['ALIAS']]
+        values = await cache.aget(_cache_key(key))
+        if values is None:
+            try:
+                token = await self.get_model().objects.select_related('user').aget(key=key)
+            except self.get_model().DoesNotExist:
+                raise AuthenticationFailed('Invalid token.')
+            if not token.user.is_active:
+                raise AuthenticationFailed('User inactive or deleted.')
+            await cache.aset(_cache_key(key), self.cached_values(token.user), config['TIMEOUT'])
+            return token.user, token
+        return self.from_cached_values(key, values)
+
+    def cached_values(self, user):
+        return tuple(getattr(user, field) for field in CACHED_USER_FIELDS)
+
+    def from_cached_values(self, key, values):
+        user = CustomUser.from_db(DEFAULT_DB_ALIAS, CACHED_USER_FIELDS, values)
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'], [key, user.pk])
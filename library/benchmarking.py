@@ -0,0 +1,230 @@
+import http.client
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.http.request import validate_host
+from django.test import Client
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .models import AvailableBook, Book
+from .seeding import STAFF_USERNAME, USER_PREFIX, WORDS
+
+# Relative slowdown tolerated before a run counts as a regression, and the absolute
+# floor below which latency differences are treated as noise.
+DEFAULT_THRESHOLD = 0.25
+MIN_LATENCY_DELTA_MS = 1.0
+QUERY_TOLERANCE = 0.5
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Fixture:
+    # Ids and tokens the workloads draw from; loaded from the database both drivers talk to.
+    def __init__(self):
+        self.workers = 1
+        self.staff_id = self.staff_token = None
+        self.reader_tokens = []
+        tokens = Token.objects.filter(user__username__startswith=USER_PREFIX)
+        for username, user_id, key in tokens.values_list('user__username', 'user_id', 'key'):
+            if username == STAFF_USERNAME:
+                self.staff_id, self.staff_token = user_id, key
+            else:
+                self.reader_tokens.append(key)
+        self.book_ids = list(Book.objects.values_list('id', flat=True))
+        self.free_copies = list(AvailableBook.objects.filter(is_checked_out=False).values_list('book_id', 'id'))
+        if not (self.staff_token and self.reader_tokens and self.book_ids and self.free_copies):
+            raise ValueError('No benchmark data found; run seed_library first.')
+
+
+def catalog_browse(fixture, rng, worker):
+    token = rng.choice(fixture.reader_tokens)
+    page = yield 'GET /api/books', 'GET', '/api/books?page_size=20', None, token
+    if page.get('next'):
+        yield 'GET /api/books (next page)', 'GET', urlsplit(page['next'])._replace(scheme='', netloc='').geturl(), None, token
+    yield 'GET /api/books?q=', 'GET', f'/api/books?q={rng.choice(WORDS)}', None, token
+    yield 'GET /api/books?genre=&ordering=', 'GET', '/api/books?genre=Fantasy&ordering=-average_rating', None, token
+    yield 'GET /api/books/<id>', 'GET', f'/api/books/{rng.choice(fixture.book_ids)}', None, token
+
+
+def availability(fixture, rng, worker):
+    token = rng.choice(fixture.reader_tokens)
+    book_id = rng.choice(fixture.book_ids)
+    yield 'GET /api/books/<id>/available-books', 'GET', f'/api/books/{book_id}/available-books', None, token
+
+
+def borrow_return(fixture, rng, worker):
+    # Each worker owns a disjoint slice of copies so concurrent workers never collide.
+    book_id, copy_id = rng.choice(fixture.free_copies[worker::fixture.workers] or fixture.free_copies)
+    url = f'/api/books/{book_id}/available-books/{copy_id}/borrows'
+    today = timezone.localdate()
+    borrow = yield 'POST borrows', 'POST', url, {
+        'user': fixture.staff_id, 'available_book': copy_id,
+        'borrow_date': str(today), 'return_date': str(today + timedelta(days=14)),
+    }, fixture.staff_token
+    if borrow.get('id'):
+        yield 'PATCH borrows/<id> (return)', 'PATCH', f"{url}/{borrow['id']}", {'date_returned': str(today)}, fixture.staff_token
+
+
+def review_post(fixture, rng, worker):
+    book_id = rng.choice(fixture.book_ids)
+    yield 'POST /api/books/<id>/reviews', 'POST', f'/api/books/{book_id}/reviews', {
+        'book': book_id, 'rating': rng.randint(1, 5), 'comment': ' '.join(rng.choices(WORDS, k=12)),
+    }, rng.choice(fixture.reader_tokens)
+
+
+def my_borrows(fixture, rng, worker):
+    yield 'GET /api/borrows?user=me', 'GET', '/api/borrows?user=me', None, rng.choice(fixture.reader_tokens)
+
+
+def account_summary(fixture, rng, worker):
+    yield 'GET /api/users/me/summary', 'GET', '/api/users/me/summary', None, rng.choice(fixture.reader_tokens)
+
+
+WORKLOADS = {
+    'catalog-browse': catalog_browse,
+    'availability': availability,
+    'borrow-return': borrow_return,
+    'review-post': review_post,
+    'my-borrows': my_borrows,
+    'account-summary': account_summary,
+}
+
+
+def _queries(server_timing):
+    match = SERVER_TIMING_QUERIES.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+class InProcessDriver:
+    # Runs through the full middleware and URL stack without a socket, so it is single-threaded.
+    concurrent = False
+
+    def __init__(self):
+        # Same fallback as HttpRequest.get_host() for an empty ALLOWED_HOSTS in DEBUG.
+        allowed = settings.ALLOWED_HOSTS or (['.localhost', '127.0.0.1', '[::1]'] if settings.DEBUG else [])
+        candidates = [host.lstrip('.') for host in allowed if host != '*'] + ['localhost']
+        self.client = Client(SERVER_NAME=next((host for host in candidates if validate_host(host, allowed)), 'localhost'))
+
+    def request(self, method, path, data, token):
+        response = self.client.generic(
+            method, path, json.dumps(data) if data is not None else '',
+            content_type='application/json', headers={'Authorization': f'Token {token}'},
+        )
+        body = response.json() if response.get('Content-Type', '').startswith('application/json') else {}
+        return response.status_code, body, _queries(response.get('Server-Timing'))
+
+
+class LiveDriver:
+    # One keep-alive connection per worker thread against a running server.
+    concurrent = True
+
+    def __init__(self, base_url):
+        self.target = urlsplit(base_url)
+        if self.target.scheme not in ('http', 'https') or not self.target.hostname:
+            raise ValueError('Only absolute http:// or https:// base URLs are supported.')
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            cls = http.client.HTTPSConnection if self.target.scheme == 'https' else http.client.HTTPConnection
+            self.local.connection = cls(self.target.hostname, self.target.port, timeout=30)
+        return self.local.connection
+
+    def request(self, method, path, data, token):
+        headers = {'Authorization': f'Token {token}', 'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        connection = self.connection()
+        try:
+            connection.request(method, self.target.path.rstrip('/') + path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        parsed = json.loads(content) if response.getheader('Content-Type', '').startswith('application/json') else {}
+        return response.status, parsed, _queries(response.getheader('Server-Timing'))
+
+
+def run_workload(driver, fixture, workload, iterations, concurrency, seed):
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    fixture.workers = concurrency
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        for _ in range(number, iterations, concurrency):
+            script = WORKLOADS[workload](fixture, rng, number)
+            response = None
+            while True:
+                try:
+                    label, method, path, data, token = script.send(response)
+                except StopIteration:
+                    break
+                started = time.perf_counter()
+                try:
+                    status, response, queries = driver.request(method, path, data, token)
+                except (OSError, http.client.HTTPException):
+                    status, response, queries = 599, {}, None
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    samples[label].append((elapsed, queries, status))
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(0)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank, so small runs report a latency that was actually observed.
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(samples, elapsed):
+    summary = {}
+    for label, values in samples.items():
+        latencies = sorted(value[0] for value in values)
+        queries = [value[1] for value in values if value[1] is not None]
+        summary[label] = {
+            'requests': len(values),
+            'errors': sum(1 for value in values if value[2] >= 400),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'rps': round(len(values) / elapsed, 1),
+            'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return summary
+
+
+def find_regressions(baseline, current, threshold=DEFAULT_THRESHOLD):
+    regressions = []
+    for label, before in baseline.items():
+        after = current.get(label)
+        if after is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            limit = max(before[metric] * (1 + threshold), before[metric] + MIN_LATENCY_DELTA_MS)
+            if after[metric] > limit:
+                regressions.append(f'{label}: {metric} {after[metric]:.2f} > {limit:.2f} (baseline {before[metric]:.2f})')
+        if before['queries'] is not None and after['queries'] is not None:
+            if after['queries'] > before['queries'] + QUERY_TOLERANCE:
+                regressions.append(f"{label}: {after['queries']} queries per request, baseline {before['queries']}")
+        if not before['errors'] and after['errors']:
+            regressions.append(f"{label}: {after['errors']} errors, baseline had none")
+    return regressions
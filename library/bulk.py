@@ -0,0 +1,143 @@
+import codecs
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import response_cache
+from .locks import lock_table
+from .models import AvailableBook, Book, Borrow, Branch
+from .serializers import BookImportSerializer
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_FIELDS = BookImportSerializer.Meta.fields
+CHUNK_SIZE = 1000
+
+EXPORT_DATASETS = {
+    'books': (Book.objects.all(), ['id', *IMPORT_FIELDS]),
+    'branches': (Branch.objects.all(), ['id', 'name']),
+    'copies': (
+        AvailableBook.objects.annotate(location=F('branch__name')),
+        ['id', 'book_id', 'branch_id', 'location', 'is_checked_out'],
+    ),
+    'borrows': (Borrow.objects.all(), ['id', 'user_id', 'available_book_id', 'borrow_date', 'return_date', 'date_returned']),
+}
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def detect_format(name='', content_type=''):
+    if name.endswith('.csv') or content_type.startswith('text/csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')) or content_type.startswith(('application/x-ndjson', 'application/jsonl')):
+        return 'jsonl'
+    return None
+
+
+def read_records(stream, file_format, encoding='utf-8'):
+    # Yields (row number, record) pairs; stream is a binary file-like object read line by line.
+    lines = codecs.iterdecode(stream, encoding)
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row, record in enumerate(reader, start=1):
+            yield row, {key: value for key, value in record.items() if key and value != ''}
+    elif file_format == 'jsonl':
+        for row, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield row, exc
+                continue
+            yield row, record
+    else:
+        raise BulkFormatError(f"Unsupported format '{file_format}', expected one of: {', '.join(IMPORT_FORMATS)}.")
+
+
+def import_books(records, update_existing=True, chunk_size=CHUNK_SIZE):
+    result = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        _import_chunk(chunk, update_existing, result)
+    if result['created'] or result['updated']:
+        response_cache.invalidate_all()
+    return result
+
+
+def _import_chunk(chunk, update_existing, result):
+    rows = {}
+    for row, record in chunk:
+        if not isinstance(record, dict):
+            result['errors'].append({'row': row, 'errors': {'non_field_errors': [f'Invalid record: {record}']}})
+            continue
+        serializer = BookImportSerializer(data=record)
+        if not serializer.is_valid():
+            result['errors'].append({'row': row, 'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        isbn = data.get('isbn')
+        key = isbn or ('row', row)
+        if key in rows:
+            result['errors'].append({'row': row, 'errors': {'isbn': [f'Duplicate of row {rows[key][0]}.']}})
+            continue
+        rows[key] = row, data
+
+    isbns = [data['isbn'] for _, data in rows.values() if data.get('isbn')]
+    with transaction.atomic():
+        # With other writers held off, every ISBN looked up here is still new when it is inserted.
+        lock_table(Book)
+        existing = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'id'))
+        now = timezone.now()
+        new_books, changed_books = [], defaultdict(list)
+        for _, data in rows.values():
+            book_id = existing.get(data.get('isbn'))
+            if book_id is None:
+                new_books.append(Book(**data))
+            elif update_existing:
+                # Only the columns a row supplies are written; missing ones keep their current values.
+                changed_books[tuple(sorted(data))].append(Book(id=book_id, updated_at=now, **data))
+            else:
+                result['skipped'] += 1
+        Book.objects.bulk_create(new_books)
+        for fields, books in changed_books.items():
+            Book.objects.bulk_update(books, [*fields, 'updated_at'])
+    result['created'] += len(new_books)
+    result['updated'] += sum(len(books) for books in changed_books.values())
+
+
+def export_rows(dataset, file_format, chunk_size=2000):
+    queryset, fields = EXPORT_DATASETS[dataset]
+    rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size)
+    return serialize_rows(fields, rows, file_format)
+
+
+def serialize_rows(fields, rows, file_format):
+    # Yields the encoded output piece by piece so callers can stream it.
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for values in rows:
+            yield writer.writerow(values)
+    elif file_format == 'jsonl':
+        for values in rows:
+            yield json.dumps(dict(zip(fields, values)), default=str) + '\n'
+    elif file_format == 'json':
+        separator = '{"results": ['
+        for values in rows:
+            yield separator + json.dumps(dict(zip(fields, values)), default=str)
+            separator = ', '
+        yield '{"results": []}' if separator != ', ' else ']}'
+    else:
+        raise BulkFormatError(f"Unsupported format '{file_format}', expected one of: {', '.join(IMPORT_FORMATS)}.")
+
+
+class _Echo:
+    def write(self, value):
+        return value
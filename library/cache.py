@@ -0,0 +1,186 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+from .conditional import get_validators, set_validators
+
+_stats_lock = threading.Lock()
+_evictions = {}
+
+
+class LRULocMemCache(LocMemCache):
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._name = name
+
+    def _cull(self):
+        # Entries are kept most-recently-used first, so evict from the end one at a time.
+        key, _ = self._cache.popitem()
+        self._expire_info.pop(key, None)
+        with _stats_lock:
+            _evictions[self._name] = _evictions.get(self._name, 0) + 1
+
+    @property
+    def evictions(self):
+        return _evictions.get(self._name, 0)
+
+    # The store is process memory, so the async API can run inline instead of hopping to a thread.
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version)
+
+    async def aget_many(self, keys, version=None):
+        return self.get_many(keys, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set(key, value, timeout, version)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.set_many(data, timeout, version)
+
+    async def adelete_many(self, keys, version=None):
+        self.delete_many(keys, version)
+
+
+class ResponseCache:
+    prefix = 'library:response'
+    global_scope = 'all'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'LIBRARY_RESPONSE_CACHE', {})
+
+    @property
+    def backend(self):
+        return caches[self.config.get('ALIAS', 'default')]
+
+    def _version_key(self, scope):
+        return f'{self.prefix}:version:{scope}'
+
+    def _versions(self, scopes):
+        keys = [self._version_key(scope) for scope in scopes]
+        versions = self.backend.get_many(keys)
+        missing = {key: time.time_ns() for key in keys if key not in versions}
+        if missing:
+            self.backend.set_many(missing, timeout=None)
+            versions.update(missing)
+        return [str(versions[key]) for key in keys]
+
+    async def _aversions(self, scopes):
+        keys = [self._version_key(scope) for scope in scopes]
+        versions = await self.backend.aget_many(keys)
+        missing = {key: time.time_ns() for key in keys if key not in versions}
+        if missing:
+            await self.backend.aset_many(missing, timeout=None)
+            versions.update(missing)
+        return [str(versions[key]) for key in keys]
+
+    def _key(self, url, versions):
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return f'{self.prefix}:{digest}:{"-".join(versions)}'
+
+    def versions(self, scopes):
+        return self._versions([self.global_scope, *scopes])
+
+    async def aversions(self, scopes):
+        return await self._aversions([self.global_scope, *scopes])
+
+    def key(self, scopes, url):
+        return self._key(url, self.versions(scopes))
+
+    async def akey(self, scopes, url):
+        return self._key(url, await self.aversions(scopes))
+
+    def _count(self, data):
+        with _stats_lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def get(self, key):
+        return self._count(self.backend.get(key))
+
+    async def aget(self, key):
+        return self._count(await self.backend.aget(key))
+
+    def set(self, key, data):
+        self.backend.set(key, data, timeout=self.config.get('TIMEOUT', 300))
+
+    async def aset(self, key, data):
+        await self.backend.aset(key, data, timeout=self.config.get('TIMEOUT', 300))
+
+    def invalidate(self, *scopes):
+        # Bump now so this transaction's own reads miss, and again after commit so
+        # nothing cached by concurrent readers in between survives.
+        self._bump(scopes)
+        transaction.on_commit(lambda: self._bump(scopes))
+
+    def invalidate_all(self):
+        self.invalidate(self.global_scope)
+
+    def _bump(self, scopes):
+        # Fresh versions are timestamps, so a version key lost to eviction can never
+        # come back with a value that matches entries cached before it was lost.
+        self.backend.set_many({self._version_key(scope): time.time_ns() for scope in scopes}, timeout=None)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': getattr(self.backend, 'evictions', None),
+        }
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    def get_cache_scopes(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        scopes = self.get_cache_scopes()
+        if not scopes or not response_cache.config.get('ENABLED', True):
+            return handler(request, *args, **kwargs)
+        key = response_cache.key(scopes, request.build_absolute_uri())
+        entry = response_cache.get(key)
+        if entry is not None:
+            return response_from_entry(request, entry)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, entry_from_response(response))
+        return response
+
+
+def response_from_entry(request, entry):
+    not_modified = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+    if not_modified is not None:
+        return not_modified
+    response = Response(entry['data'])
+    if entry['etag']:
+        set_validators(response, entry['etag'], entry['last_modified'])
+    return response
+
+
+def entry_from_response(response):
+    etag, last_modified = get_validators(response)
+    return {'data': response.data, 'etag': etag, 'last_modified': last_modified}
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from .models import Borrow, CirculationWatermark, DailyCirculation, StaleCirculation
+
+ONE_DAY = timedelta(days=1)
+METRICS = ('checkouts', 'returns', 'open_loans', 'overdue')
+
+
+def days_between(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += ONE_DAY
+
+
+def compute_snapshots(start, end, book_ids=None):
+    # A single pass over the loans touching [start, end]; open and overdue counts are as of the end of each day.
+    borrows = Borrow.objects.filter(
+        Q(date_returned__isnull=True) | Q(date_returned__gte=start), borrow_date__lte=end,
+    )
+    if book_ids is not None:
+        borrows = borrows.filter(available_book__book_id__in=book_ids)
+    counts = defaultdict(lambda: [0, 0, 0, 0])
+    rows = borrows.values_list('available_book__book_id', 'borrow_date', 'return_date', 'date_returned')
+    for book_id, borrowed, due, returned in rows.iterator(chunk_size=2000):
+        if borrowed >= start:
+            counts[book_id, borrowed][0] += 1
+        if returned is not None and returned <= end:
+            counts[book_id, returned][1] += 1
+        last_open = end if returned is None else min(returned - ONE_DAY, end)
+        for day in days_between(max(borrowed, start), last_open):
+            counts[book_id, day][2] += 1
+            if due < day:
+                counts[book_id, day][3] += 1
+    return counts
+
+
+def _replace(start, end, counts, book_ids=None):
+    stale = DailyCirculation.objects.filter(day__range=(start, end))
+    if book_ids is not None:
+        stale = stale.filter(book_id__in=book_ids)
+    stale.delete()
+    DailyCirculation.objects.bulk_create(
+        (
+            DailyCirculation(book_id=book_id, day=day, **dict(zip(METRICS, values)))
+            for (book_id, day), values in counts.items()
+        ),
+        batch_size=2000,
+    )
+    return len(counts)
+
+
+@transaction.atomic
+def refresh_snapshots(through=None, since=None):
+    # New days are computed for every book; loans changed since the watermark only re-derive their own
+    # books, from their checkout day on, along with the books and days left stale by moved or deleted loans.
+    through = through or timezone.localdate()
+    mark = CirculationWatermark.objects.select_for_update().first()
+    latest = Borrow.objects.aggregate(latest=Max('updated_at'))['latest']
+    written = 0
+    if mark is None or since is not None:
+        start = since or Borrow.objects.aggregate(first=Min('borrow_date'))['first'] or through
+        if mark is not None:
+            start = min(start, mark.day + ONE_DAY)
+        written += _replace(start, through, compute_snapshots(start, through))
+        StaleCirculation.objects.filter(day__gte=start).delete()
+    else:
+        changed = Borrow.objects.filter(updated_at__lte=latest) if latest else Borrow.objects.none()
+        if mark.borrows_updated_at is not None:
+            changed = changed.filter(updated_at__gt=mark.borrows_updated_at)
+        stale = list(StaleCirculation.objects.values_list('id', 'book_id', 'day'))
+        days = [day for *_, day in stale] + [changed.aggregate(first=Min('borrow_date'))['first']]
+        first_day = min(filter(None, days), default=None)
+        if first_day is not None and first_day <= mark.day:
+            book_ids = {*changed.values_list('available_book__book_id', flat=True), *(book_id for _, book_id, _ in stale)}
+            written += _replace(first_day, mark.day, compute_snapshots(first_day, mark.day, book_ids), book_ids)
+        if stale:
+            StaleCirculation.objects.filter(pk__lte=max(pk for pk, *_ in stale)).delete()
+        if mark.day < through:
+            written += _replace(mark.day + ONE_DAY, through, compute_snapshots(mark.day + ONE_DAY, through))
+        through = max(through, mark.day)
+
+    mark = mark or CirculationWatermark()
+    mark.day, mark.borrows_updated_at = through, latest
+    mark.save()
+    return written
+
+
+def raw_counts(day):
+    # The same metrics straight from Borrow for one day, computed independently of compute_snapshots().
+    is_open = Q(borrow_date__lte=day) & (Q(date_returned__isnull=True) | Q(date_returned__gt=day))
+    rows = (
+        Borrow.objects.filter(Q(borrow_date=day) | Q(date_returned=day) | is_open)
+        .values('available_book__book_id')
+        .annotate(
+            checkouts=Count('id', filter=Q(borrow_date=day)),
+            returns=Count('id', filter=Q(date_returned=day)),
+            open_loans=Count('id', filter=is_open),
+            overdue=Count('id', filter=is_open & Q(return_date__lt=day)),
+        )
+        .values_list('available_book__book_id', *METRICS)
+    )
+    return {book_id: tuple(values) for book_id, *values in rows}
+
+
+def find_mismatches(start, end):
+    for day in days_between(start, end):
+        snapshots = {
+            book_id: tuple(values)
+            for book_id, *values in DailyCirculation.objects.filter(day=day).values_list('book_id', *METRICS)
+        }
+        raw = raw_counts(day)
+        for book_id in sorted(snapshots.keys() | raw.keys()):
+            expected = raw.get(book_id, (0, 0, 0, 0))
+            actual = snapshots.get(book_id, (0, 0, 0, 0))
+            if expected != actual:
+                yield day, book_id, expected, actual
@@ -0,0 +1,84 @@
+import hashlib
+
+from django.db.models import F
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    version_fields = ('updated_at',)
+
+    def list_queryset(self):
+        # Each row carries its version columns, so the page fetched for the response is all the validators need.
+        return self.filter_queryset(self.get_queryset()).annotate(
+            **{f'version_{n}': F(field) for n, field in enumerate(self.version_fields)}
+        )
+
+    def list_state(self, rows, scope_versions):
+        # The page's rows and whether another page follows, plus the cache-scope versions, which move with
+        # every write to the scope; the rest of the result set is never aggregated.
+        state = [*scope_versions, getattr(self.paginator, 'has_next', None)]
+        for row in rows:
+            state += [row.pk, *(getattr(row, f'version_{n}') for n in range(len(self.version_fields)))]
+        return state
+
+    def list_scopes(self):
+        get_cache_scopes = getattr(self, 'get_cache_scopes', None)
+        return (get_cache_scopes() if get_cache_scopes else None) or []
+
+    def retrieve_state(self):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_queryset().filter(**{self.lookup_field: lookup}).values_list(*self.version_fields)
+
+    def list(self, request, *args, **kwargs):
+        from .cache import response_cache
+
+        queryset = self.list_queryset()
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        scopes = self.list_scopes()
+        state = self.list_state(rows, response_cache.versions(scopes) if scopes else [])
+        return self.conditional_response(lambda request: list_response(self, rows, page), state, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        state = self.retrieve_state().first()
+        if state is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(super().retrieve, list(state), request, *args, **kwargs)
+
+    def conditional_response(self, handler, state, request, *args, **kwargs):
+        etag, last_modified = compute_validators(state, request)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+def list_response(view, rows, page):
+    serializer = view.get_serializer(rows, many=True)
+    if page is None:
+        return Response(serializer.data)
+    return view.get_paginated_response(serializer.data)
+
+
+def compute_validators(state, request):
+    timestamps = [value for value in state if hasattr(value, 'timestamp')]
+    last_modified = int(max(timestamps).timestamp()) if timestamps else None
+    fingerprint = repr((state, request.get_full_path(), request.accepted_media_type))
+    return f'"{hashlib.sha256(fingerprint.encode()).hexdigest()[:32]}"', last_modified
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def get_validators(response):
+    last_modified = response.get('Last-Modified')
+    return response.get('ETag'), parse_http_date_safe(last_modified) if last_modified else None
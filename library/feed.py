@@ -0,0 +1,232 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+from .locks import lock_table
+from .models import AvailabilityEvent, AvailableBook, Book, normalize_branch_name
+
+DEFAULTS = {
+    'BACKEND': 'library.feed.LocalBroker',
+    'QUEUE_SIZE': 1000,
+    # Subscribers also re-read the event table this often, which picks up events written by other
+    # processes when the broker is process-local, and doubles as the keep-alive interval.
+    'POLL_INTERVAL': 15,
+    # A reconnect that missed more than this many events is told to reload instead of replaying them.
+    'CATCH_UP_LIMIT': 1000,
+    'RETRY_MS': 3000,
+}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def feed_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_AVAILABILITY_FEED', {})}
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = feed_settings()
+            _broker = import_string(config['BACKEND'])(config)
+        return _broker
+
+
+def event_payload(event):
+    return {
+        'id': event.pk,
+        'type': event.kind,
+        'book': event.book_id,
+        'copy': event.copy_id,
+        'location': event.location,
+        'copy_is_available': event.copy_is_available,
+        'available_copies': event.available_copies,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def _record(events):
+    # Resuming from an id assumes ids become visible in order, so an event id is handed out only once every
+    # earlier event has committed.
+    with transaction.atomic(savepoint=False):
+        lock_table(AvailabilityEvent)
+        AvailabilityEvent.objects.bulk_create(events)
+    transaction.on_commit(lambda: get_broker().publish([event_payload(event) for event in events]))
+
+
+def record_copy_events(kind, copy_ids):
+    rows = AvailableBook.objects.filter(pk__in=copy_ids).values_list(
+        'id', 'book_id', 'branch__name', 'is_checked_out', 'book__available_copies',
+    )
+    _record([
+        AvailabilityEvent(
+            kind=kind, copy_id=copy_id, book_id=book_id, location=location,
+            copy_is_available=not checked_out, available_copies=available_copies,
+        )
+        for copy_id, book_id, location, checked_out, available_copies in rows
+    ])
+
+
+def record_copy_removed(copy):
+    available_copies = Book.objects.filter(pk=copy.book_id).values_list('available_copies', flat=True).first()
+    _record([AvailabilityEvent(
+        kind=AvailabilityEvent.COPY_REMOVED, copy_id=copy.pk, book_id=copy.book_id, location=copy.location,
+        copy_is_available=False, available_copies=available_copies or 0,
+    )])
+
+
+class Subscription:
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def deliver(self, payloads):
+        for payload in payloads:
+            try:
+                self.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # The stream notices and re-reads the event table instead.
+                self.overflowed = True
+                return
+
+
+class LocalBroker:
+    # Fans events out to the subscribers in this process. Publishing happens in whatever thread
+    # committed the write; each subscriber's queue is fed on its own event loop.
+    def __init__(self, config):
+        self.queue_size = config['QUEUE_SIZE']
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def publish(self, payloads):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, payloads)
+            except RuntimeError:
+                self._discard(subscription)
+
+    @contextmanager
+    def subscribe(self):
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._discard(subscription)
+
+    def _discard(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class EventFilter:
+    def __init__(self, books=None, locations=None):
+        self.books = books
+        self.locations = locations
+
+    @classmethod
+    def from_query(cls, query):
+        books = {int(book) for value in query.getlist('book') for book in value.split(',') if book}
+        locations = {
+            normalize_branch_name(location) for value in query.getlist('location') for location in value.split(',')
+        } - {''}
+        return cls(books or None, locations or None)
+
+    def matches(self, payload):
+        return (
+            (self.books is None or payload['book'] in self.books)
+            and (self.locations is None or payload['location'] in self.locations)
+        )
+
+    def queryset(self, after_id):
+        events = AvailabilityEvent.objects.filter(pk__gt=after_id).order_by('pk')
+        if self.books is not None:
+            events = events.filter(book_id__in=self.books)
+        if self.locations is not None:
+            events = events.filter(location__in=self.locations)
+        return events
+
+
+def format_event(payload):
+    return f"id: {payload['id']}\nevent: availability\ndata: {json.dumps(payload)}\n\n"
+
+
+async def _events_after(event_filter, after_id, limit):
+    return [event_payload(event) async for event in event_filter.queryset(after_id)[:limit]]
+
+
+async def _latest_id():
+    latest = await AvailabilityEvent.objects.order_by('-pk').values_list('pk', flat=True).afirst()
+    return latest or 0
+
+
+async def event_stream(event_filter, last_id=None):
+    config = feed_settings()
+    # Subscribe before reading the table so nothing committed in between is lost; duplicates
+    # are dropped by id.
+    with get_broker().subscribe() as subscription:
+        if last_id is None:
+            # An id with no data is not dispatched, but it gives the client a cursor to reconnect with.
+            last_id = await _latest_id()
+            yield f"retry: {config['RETRY_MS']}\nid: {last_id}\n\n"
+        else:
+            yield f"retry: {config['RETRY_MS']}\n\n"
+            missed = await _events_after(event_filter, last_id, config['CATCH_UP_LIMIT'] + 1)
+            bounds = await AvailabilityEvent.objects.aaggregate(oldest=Min('pk'), latest=Max('pk'))
+            oldest, latest = bounds['oldest'] or 0, bounds['latest'] or 0
+            # Too far behind, or the events right after the cursor were pruned (ids can restart once
+            # the table is empty, so a cursor past the newest event is stale too).
+            if len(missed) > config['CATCH_UP_LIMIT'] or oldest > last_id + 1 or latest < last_id:
+                last_id = latest
+                yield f'id: {last_id}\nevent: reset\ndata: {{}}\n\n'
+                missed = []
+            for payload in missed:
+                yield format_event(payload)
+                last_id = payload['id']
+
+        while True:
+            try:
+                payloads = [await asyncio.wait_for(subscription.queue.get(), config['POLL_INTERVAL'])]
+            except asyncio.TimeoutError:
+                payloads = None
+            if payloads is None or subscription.overflowed:
+                subscription.overflowed = False
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                payloads = await _events_after(event_filter, last_id, config['CATCH_UP_LIMIT'])
+                if not payloads:
+                    yield ': keep-alive\n\n'
+                    continue
+            for payload in payloads:
+                if payload['id'] <= last_id or not event_filter.matches(payload):
+                    continue
+                yield format_event(payload)
+                last_id = payload['id']
+
+
+async def availability_events(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    # EventSource sends Last-Event-ID on reconnect; first connections can pass it as a parameter.
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        event_filter = EventFilter.from_query(request.GET)
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return HttpResponseBadRequest('book and Last-Event-ID must be integers.')
+    response = StreamingHttpResponse(event_stream(event_filter, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
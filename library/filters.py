@@ -0,0 +1,104 @@
+from datetime import date
+
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import Branch, normalize_branch_name
+from .search import search_books
+
+
+def search_query(request):
+    return request.query_params.get(BookSearchFilter.search_param, '').strip()
+
+
+def boolean_param(params, name):
+    value = params[name].lower()
+    if value not in ('true', 'false'):
+        raise ValidationError({name: 'Must be true or false.'})
+    return value == 'true'
+
+
+class BookSearchFilter(BaseFilterBackend):
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        query = search_query(request)
+        if not query:
+            return queryset
+        return search_books(queryset, query).order_by('-search_rank', 'id')
+
+
+class BookFilter(BaseFilterBackend):
+    exact_params = ('genre', 'language', 'author')
+    date_params = {
+        'published_after': 'published_date__gte',
+        'published_before': 'published_date__lte',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        filters = {name: params[name] for name in self.exact_params if name in params}
+
+        for name, lookup in self.date_params.items():
+            if name in params:
+                value = parse_date(params[name])
+                if value is None:
+                    raise ValidationError({name: 'Enter a date in YYYY-MM-DD format.'})
+                filters[lookup] = value
+
+        if 'min_rating' in params:
+            try:
+                filters['average_rating__gte'] = float(params['min_rating'])
+            except ValueError:
+                raise ValidationError({'min_rating': 'Must be a number.'})
+
+        if 'is_available' in params:
+            filters['available_copies__gt' if boolean_param(params, 'is_available') else 'available_copies'] = 0
+
+        return queryset.filter(**filters)
+
+
+class CopyFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if 'location' in params:
+            # Resolved in a subquery so the copy lookup stays on copy_book_branch_idx.
+            names = {normalize_branch_name(name) for name in params['location'].split(',')} - {''}
+            queryset = queryset.filter(branch__in=Branch.objects.filter(name__in=names).values('pk'))
+        if 'branch' in params:
+            try:
+                queryset = queryset.filter(branch_id__in=[int(pk) for pk in params['branch'].split(',')])
+            except ValueError:
+                raise ValidationError({'branch': 'Must be a comma-separated list of ids.'})
+        if 'available' in params:
+            queryset = queryset.filter(is_checked_out=not boolean_param(params, 'available'))
+        return queryset
+
+
+class BookOrderingFilter(OrderingFilter):
+    # The cursor carries the next page's first ordering value, and a NULL there cannot be compared against,
+    # so nullable columns sort on a non-null stand-in; books without a date sort as the oldest.
+    sort_keys = {
+        'published_date': Coalesce('published_date', Value(date.min)),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        if self.ordering_param not in request.query_params and search_query(request):
+            return ('-search_rank', 'id')
+        ordering = tuple(
+            f'{field}_sort' if field.lstrip('-') in self.sort_keys else field
+            for field in super().get_ordering(request, queryset, view) or ()
+        )
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering += ('id',)
+        return ordering
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        sorted_on = {field.lstrip('-') for field in ordering}
+        return queryset.annotate(**{
+            f'{name}_sort': expression for name, expression in self.sort_keys.items() if f'{name}_sort' in sorted_on
+        }).order_by(*ordering)
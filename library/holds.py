@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .cache import response_cache
+from .feed import record_copy_events
+from .models import AvailabilityEvent, AvailableBook, Book, Hold
+
+DEFAULTS = {
+    'PICKUP_DAYS': 3,
+    'SWEEP_BATCH_SIZE': 500,
+}
+
+
+def holds_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_HOLDS', {})}
+
+
+def _assign(copy_id, book_id, pickup_until):
+    # Claim the copy, then move the head of the queue to READY with a conditional update; a holder
+    # taken by a concurrent assignment fails the status check and the next one in line is tried.
+    claimed = False
+    while True:
+        head = Hold.objects.filter(book_id=book_id).queue().values_list('id', 'user_id').first()
+        if head is None:
+            if claimed:
+                AvailableBook.objects.filter(pk=copy_id).update(is_checked_out=False, updated_at=Now())
+            return None
+        if not claimed:
+            if not AvailableBook.objects.filter(pk=copy_id).check_out():
+                return None
+            claimed = True
+        hold_id, user_id = head
+        assigned = Hold.objects.filter(pk=hold_id, status=Hold.WAITING).update(
+            status=Hold.READY, assigned_copy_id=copy_id, ready_at=Now(), expires_at=pickup_until, updated_at=Now(),
+        )
+        if assigned:
+            return hold_id, copy_id, book_id, user_id
+
+
+def assign_copies(copy_ids):
+    # Hands each free copy among copy_ids to the oldest waiting hold on its book. The caller refreshes
+    # the book counters; returns (hold_id, copy_id, book_id, user_id) for every assignment.
+    queued = (
+        Hold.objects.queue()
+        .filter(book__available_books__in=copy_ids, book__available_books__is_checked_out=False)
+        .order_by()
+        .values_list('book__available_books', 'book_id')
+        .distinct()
+    )
+    pickup_until = timezone.now() + timedelta(days=holds_settings()['PICKUP_DAYS'])
+    assigned = []
+    for copy_id, book_id in list(queued):
+        with transaction.atomic():
+            hold = _assign(copy_id, book_id, pickup_until)
+        if hold is not None:
+            assigned.append(hold)
+    return assigned
+
+
+def invalidate_assignments(assigned, book_ids=()):
+    book_ids = {*book_ids, *(book_id for _, _, book_id, _ in assigned)}
+    response_cache.invalidate(
+        'books', *(f'book:{book_id}' for book_id in book_ids), *(f'user:{user_id}' for *_, user_id in assigned),
+    )
+
+
+@transaction.atomic
+def release_copies(copy_ids):
+    # Copies whose ready hold ended go to the next hold in line, or back on the shelf.
+    AvailableBook.objects.filter(pk__in=copy_ids).refresh_checked_out()
+    assigned = assign_copies(copy_ids)
+    book_ids = set(AvailableBook.objects.filter(pk__in=copy_ids).values_list('book_id', flat=True))
+    Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+    invalidate_assignments(assigned, book_ids)
+    # A copy handed straight to the next hold stays unavailable, so only those back on the shelf are announced.
+    reassigned = {copy_id for _, copy_id, _, _ in assigned}
+    freed = AvailableBook.objects.filter(pk__in=set(copy_ids) - reassigned, is_checked_out=False)
+    record_copy_events(AvailabilityEvent.RETURNED, freed.values('pk'))
+    return assigned
+
+
+@transaction.atomic
+def cancel_hold(hold_id):
+    # Each transition is a conditional update, so a hold assigned or picked up meanwhile is seen as such.
+    ready = Hold.objects.filter(pk=hold_id, status=Hold.READY)
+    copy_id = ready.values_list('assigned_copy_id', flat=True).first()
+    if ready.update(status=Hold.CANCELLED, updated_at=Now()):
+        if copy_id is not None:
+            release_copies([copy_id])
+        return True
+    return bool(Hold.objects.filter(pk=hold_id, status=Hold.WAITING).update(status=Hold.CANCELLED, updated_at=Now()))
+
+
+def expire_holds(now=None, batch_size=None):
+    now = now or timezone.now()
+    batch_size = batch_size or holds_settings()['SWEEP_BATCH_SIZE']
+    expired = Hold.objects.filter(status=Hold.WAITING, expires_at__lt=now).update(
+        status=Hold.EXPIRED, updated_at=Now(),
+    )
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Hold.objects.filter(status=Hold.READY, expires_at__lt=now)
+                .order_by('expires_at')
+                .values_list('id', 'assigned_copy_id')[:batch_size]
+            )
+            if not batch:
+                return expired
+            # Guarded on status, so a hold picked up while the batch was read keeps its loan.
+            released = Hold.objects.filter(pk__in=[hold_id for hold_id, _ in batch], status=Hold.READY)
+            copy_ids = set(released.values_list('assigned_copy_id', flat=True)) - {None}
+            expired += released.update(status=Hold.EXPIRED, updated_at=Now())
+            release_copies(copy_ids)
@@ -0,0 +1,258 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('library.instrumentation')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    # A statement template run this many times in one request is reported as a likely N+1.
+    'REPEATED_QUERY_THRESHOLD': 5,
+    # Addresses that may scrape /api/metrics without a staff login. Behind a proxy every request arrives from
+    # the proxy's address, so this stays empty unless the scraper's address can be told apart.
+    'METRICS_ALLOWED_IPS': (),
+}
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = ContextVar('library_request_metrics', default=None)
+
+
+def instrumentation_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_INSTRUMENTATION', {})}
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'sql_time', 'serializer_time', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.statements = {}
+
+    def repeated_queries(self, threshold):
+        # Statements arrive with placeholders, so the SQL text already is the normalized template.
+        return sorted(
+            ((sql, count) for sql, count in self.statements.items() if count >= threshold),
+            key=lambda item: -item[1],
+        )
+
+
+@contextmanager
+def measure():
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_time += time.perf_counter() - started
+        metrics.queries += 1
+        metrics.statements[sql] = metrics.statements.get(sql, 0) + 1
+
+
+def install_query_hook(sender, connection, **kwargs):
+    # Installed once per connection and a no-op outside instrumented requests; the context
+    # variable follows requests into sync_to_async worker threads.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@lru_cache(maxsize=1024)
+def route_label(route):
+    # Router-generated regex routes read like path converters: api/books/<pk>.
+    return re.sub(r'\(\?P<(\w+)>[^)]*\)', r'<\1>', route).replace('^', '').rstrip('$')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class MetricsRegistry:
+    counters = {
+        'library_http_sql_seconds_total': 'Time spent in SQL.',
+        'library_http_serializer_seconds_total': 'Time spent in DRF serializers, including the queries they trigger.',
+        'library_http_response_bytes_total': 'Bytes in non-streaming response bodies.',
+        'library_http_repeated_query_requests_total': 'Requests that repeated a statement template (likely N+1).',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+            self._responses = {}
+
+    def observe(self, method, route, status, duration, metrics, size, repeated):
+        with self._lock:
+            series = self._routes.get((method, route))
+            if series is None:
+                series = self._routes[(method, route)] = {
+                    'duration': _Histogram(DURATION_BUCKETS),
+                    'queries': _Histogram(QUERY_BUCKETS),
+                    **dict.fromkeys(self.counters, 0),
+                }
+            series['duration'].observe(duration)
+            series['queries'].observe(metrics.queries)
+            series['library_http_sql_seconds_total'] += metrics.sql_time
+            series['library_http_serializer_seconds_total'] += metrics.serializer_time
+            series['library_http_response_bytes_total'] += size
+            series['library_http_repeated_query_requests_total'] += bool(repeated)
+            self._responses[(method, route, status)] = self._responses.get((method, route, status), 0) + 1
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            responses = sorted(self._responses.items())
+        lines = [
+            '# HELP library_http_responses_total Responses by route and status code.',
+            '# TYPE library_http_responses_total counter',
+            *(
+                f'library_http_responses_total{{{_labels(method=method, route=route, status=status)}}} {count}'
+                for (method, route, status), count in responses
+            ),
+        ]
+        for name, kind, help_text in (
+            ('library_http_request_duration_seconds', 'duration', 'Time from the first middleware to the response.'),
+            ('library_http_request_queries', 'queries', 'Database queries per request.'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (method, route), series in routes:
+                lines.extend(series[kind].samples(name, _labels(method=method, route=route)))
+        for name, help_text in self.counters.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [
+                f'{name}{{{_labels(method=method, route=route)}}} {series[name]}' for (method, route), series in routes
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = instrumentation_settings()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        with measure() as metrics:
+            response = self.get_response(request)
+        return self.finish(request, response, metrics, config)
+
+    async def __acall__(self, request):
+        config = instrumentation_settings()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+        with measure() as metrics:
+            response = await self.get_response(request)
+        return self.finish(request, response, metrics, config)
+
+    def finish(self, request, response, metrics, config):
+        # Streaming bodies are produced after this returns, so their queries and size are not counted.
+        duration = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        route = route_label(match.route) if match else '<unmatched>'
+        size = 0 if response.streaming else len(response.content)
+        repeated = metrics.repeated_queries(config['REPEATED_QUERY_THRESHOLD'])
+        metrics_registry.observe(request.method, route, response.status_code, duration, metrics, size, repeated)
+
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = (
+                f'db;dur={metrics.sql_time * 1000:.2f};desc="{metrics.queries} queries", '
+                f'serializer;dur={metrics.serializer_time * 1000:.2f}, total;dur={duration * 1000:.2f}'
+            )
+        if logger.isEnabledFor(logging.INFO):
+            fields = {
+                'method': request.method, 'route': route, 'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2), 'queries': metrics.queries,
+                'sql_ms': round(metrics.sql_time * 1000, 2), 'serializer_ms': round(metrics.serializer_time * 1000, 2),
+                'bytes': size, 'repeated_queries': len(repeated),
+            }
+            logger.info(' '.join(f'{name}={value}' for name, value in fields.items()), extra={'request_metrics': fields})
+        for sql, count in repeated:
+            logger.warning(
+                'Repeated query on %s %s (%d times, likely N+1): %s', request.method, route, count, sql[:300],
+                extra={'route': route, 'count': count},
+            )
+        return response
+
+
+class TimedSerializerMixin:
+    # Times the top-level serializer only, so nested serializers are not counted twice.
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = _current.get()
+        if metrics is None:
+            return serializer
+        to_representation = serializer.to_representation
+
+        def timed_to_representation(instance):
+            started = time.perf_counter()
+            try:
+                return to_representation(instance)
+            finally:
+                metrics.serializer_time += time.perf_counter() - started
+
+        serializer.to_representation = timed_to_representation
+        return serializer
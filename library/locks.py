@@ -0,0 +1,11 @@
+from django.db import connections, router
+
+
+def lock_table(model):
+    # Holds off other writers to the model's table until the surrounding transaction ends. SQLite needs
+    # nothing here: its transactions take the database write lock up front (transaction_mode IMMEDIATE).
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
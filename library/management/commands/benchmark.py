@@ -0,0 +1,85 @@
+import json
+import platform
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from library.benchmarking import (
+    DEFAULT_THRESHOLD, WORKLOADS, Fixture, InProcessDriver, LiveDriver, find_regressions, run_workload, summarize,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run scripted API workloads against data from seed_library, in-process or against a live server, '
+        'report latency percentiles, throughput and queries per request, and compare with a saved baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workload', choices=WORKLOADS, nargs='+', default=list(WORKLOADS))
+        parser.add_argument('--iterations', type=int, default=200, help='Script runs per workload.')
+        parser.add_argument(
+            '--live', metavar='BASE_URL',
+            help='Send requests to a running server, e.g. http://127.0.0.1:8000, that uses this database.',
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel clients (live mode only).')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results as a JSON baseline.')
+        parser.add_argument('--baseline', metavar='PATH', help='Fail if the results regress against this baseline.')
+        parser.add_argument(
+            '--threshold', type=float, default=DEFAULT_THRESHOLD,
+            help='Tolerated relative p50/p95 slowdown against the baseline (default %(default)s).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fixture = Fixture()
+            driver = LiveDriver(options['live']) if options['live'] else InProcessDriver()
+        except ValueError as error:
+            raise CommandError(error)
+        if options['concurrency'] > 1 and not driver.concurrent:
+            raise CommandError('--concurrency needs --live; in-process runs are single-threaded.')
+
+        results = {}
+        self.stdout.write(
+            f"{'endpoint':44} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>7}"
+        )
+        for workload in options['workload']:
+            samples, elapsed = run_workload(
+                driver, fixture, workload, options['iterations'], options['concurrency'], options['seed'],
+            )
+            for label, row in summarize(samples, elapsed).items():
+                results[f'{workload}: {label}'] = row
+                queries = '-' if row['queries'] is None else f"{row['queries']:.2f}"
+                self.stdout.write(
+                    f"{label[:44]:44} {row['requests']:>6} {row['errors']:>4} {row['p50_ms']:>8.2f} "
+                    f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['rps']:>8.1f} {queries:>7}"
+                )
+
+        mode = options['live'] or 'in-process'
+        if options['save_baseline']:
+            Path(options['save_baseline']).write_text(json.dumps({
+                'mode': mode,
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'concurrency': options['concurrency'],
+                'endpoints': results,
+            }, indent=2) + '\n')
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}.")
+
+        if options['baseline']:
+            try:
+                baseline = json.loads(Path(options['baseline']).read_text())
+                endpoints = baseline['endpoints']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f'Cannot read baseline: {error}')
+            if baseline.get('mode') != mode:
+                self.stderr.write(f"Warning: the baseline was recorded against {baseline.get('mode')}, not {mode}.")
+            regressions = find_regressions(endpoints, results, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
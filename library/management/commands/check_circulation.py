@@ -0,0 +1,30 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.circulation import find_mismatches
+from library.models import CirculationWatermark
+
+
+class Command(BaseCommand):
+    help = 'Compare the daily circulation snapshots against the Borrow table for a range of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First day to check (default: 30 days before --until).')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day to check (default: the last refreshed day).')
+        parser.add_argument('--show', type=int, default=20, help='Print at most this many mismatches.')
+
+    def handle(self, *args, **options):
+        mark = CirculationWatermark.objects.first()
+        until = options['until'] or (mark.day if mark else None)
+        if until is None:
+            raise CommandError('No snapshots yet; run refresh_circulation first.')
+        since = options['since'] or until - timedelta(days=30)
+        mismatches = 0
+        for day, book_id, expected, actual in find_mismatches(since, until):
+            if mismatches < options['show']:
+                self.stderr.write(f'{day} book {book_id}: Borrow has {expected}, snapshot has {actual}.')
+            mismatches += 1
+        if mismatches:
+            raise CommandError(f'{mismatches} snapshot rows between {since} and {until} do not match the Borrow table.')
+        self.stdout.write(self.style.SUCCESS(f'Snapshots from {since} to {until} match the Borrow table.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from library.holds import expire_holds, holds_settings
+
+
+class Command(BaseCommand):
+    help = 'Expire holds past their pickup deadline or wanted-until date and pass their copies down the queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=holds_settings()['SWEEP_BATCH_SIZE'],
+            help='Ready holds released per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        expired = expire_holds(batch_size=options['batch_size'])
+        self.stdout.write(f'Expired {expired} holds.')
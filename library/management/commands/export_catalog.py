@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from library.bulk import EXPORT_DATASETS, IMPORT_FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream books, copies or borrows to a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=EXPORT_DATASETS)
+        parser.add_argument('--format', choices=IMPORT_FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write; defaults to stdout.')
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            for chunk in export_rows(options['dataset'], options['format']):
+                output.write(chunk)
+        finally:
+            if output is not self.stdout:
+                output.close()
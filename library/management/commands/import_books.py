@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.bulk import CHUNK_SIZE, IMPORT_FORMATS, detect_format, import_books, read_records
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV or JSONL file, creating new titles and updating existing ones by ISBN.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' to read from stdin.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Input format; detected from the file name by default.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument(
+            '--skip-existing', action='store_true',
+            help='Leave books whose ISBN already exists untouched instead of updating them.',
+        )
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot detect the input format, pass --format.')
+        if options['path'] == '-':
+            stream = sys.stdin.buffer
+        else:
+            try:
+                stream = open(options['path'], 'rb')
+            except OSError as exc:
+                raise CommandError(exc)
+        with stream:
+            result = import_books(
+                read_records(stream, file_format),
+                update_existing=not options['skip_existing'],
+                chunk_size=options['chunk_size'],
+            )
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(
+            f"Created {result['created']}, updated {result['updated']}, skipped {result['skipped']} books; "
+            f"{len(result['errors'])} rows had errors."
+        )
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent keep-alive GET requests to a running server and report throughput and latency, '
+        'e.g. to compare the WSGI and ASGI deployments.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Absolute URLs to request, round-robin.')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 1000])
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each concurrency level.')
+        parser.add_argument('--token', help='Send this API token with every request.')
+
+    def handle(self, *args, **options):
+        targets = [urlsplit(url) for url in options['urls']]
+        if any(target.scheme != 'http' or not target.hostname for target in targets):
+            raise CommandError('Only absolute http:// URLs are supported.')
+        if len({target.netloc for target in targets}) > 1:
+            raise CommandError('All URLs must point at the same server.')
+
+        self.stdout.write(f"{'conns':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for concurrency in options['concurrency']:
+            latencies, errors, elapsed = asyncio.run(
+                self.run_level(targets, concurrency, options['duration'], options['token'])
+            )
+            latencies.sort()
+            if not latencies:
+                self.stdout.write(f'{concurrency:>6} {"-":>9} {"-":>8} {"-":>8} {"-":>8} {errors:>7}')
+                continue
+            p50, p95, p99 = (latencies[min(int(len(latencies) * q), len(latencies) - 1)] for q in (0.5, 0.95, 0.99))
+            self.stdout.write(
+                f'{concurrency:>6} {len(latencies) / elapsed:>9.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>7}'
+            )
+
+    async def run_level(self, targets, concurrency, duration, token):
+        latencies, errors = [], 0
+        deadline = time.perf_counter() + duration
+
+        async def client(number):
+            nonlocal errors
+            reader = writer = None
+            sent = number
+            while time.perf_counter() < deadline:
+                target = targets[sent % len(targets)]
+                sent += 1
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(target.hostname, target.port or 80)
+                    started = time.perf_counter()
+                    writer.write(self.request_bytes(target, token))
+                    status, keep_alive = await self.read_response(reader)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if status >= 400:
+                        errors += 1
+                    if not keep_alive:
+                        writer.close()
+                        writer = None
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    if writer is not None:
+                        writer.close()
+                    writer = None
+                    await asyncio.sleep(0.01)
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    def request_bytes(self, target, token):
+        path = target.path + (f'?{target.query}' if target.query else '')
+        headers = [f'GET {path or "/"} HTTP/1.1', f'Host: {target.netloc}', 'Accept: application/json']
+        if token:
+            headers.append(f'Authorization: Token {token}')
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+    async def read_response(self, reader):
+        status_line = await reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        length, chunked, keep_alive = None, False, True
+        while (line := await reader.readuntil(b'\r\n')) != b'\r\n':
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                keep_alive = value != 'close'
+        if chunked:
+            while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+                await reader.readexactly(size + 2)
+            await reader.readuntil(b'\r\n')
+        elif length is not None:
+            await reader.readexactly(length)
+        else:
+            await reader.read()
+            keep_alive = False
+        return status, keep_alive
@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from library.cache import response_cache
+from library.models import Book
+from library.previews import PREVIEW_DIR, generate_variants, preview_digest, preview_name, preview_settings, preview_storage
+
+
+class Command(BaseCommand):
+    help = 'Move book previews to content-addressed WebP files, generate missing variants and delete orphaned files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gc', action='store_true', help='Also delete preview files no book refers to.')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Only delete orphans older than this many seconds, so in-flight uploads are kept.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything.')
+
+    def handle(self, *args, **options):
+        storage = preview_storage()
+        changed = 0
+        books = Book.objects.exclude(preview_image='').exclude(preview_image__isnull=True)
+        for book_id, name, preview_hash in books.values_list('id', 'preview_image', 'preview_hash').iterator():
+            digest = preview_digest(name)
+            if digest and digest == preview_hash:
+                continue
+            if not storage.exists(name):
+                self.stderr.write(f'Book {book_id}: {name} is missing.')
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Would process {name} for book {book_id}.')
+                continue
+            if not digest:
+                with storage.open(name) as original:
+                    name = storage.save(name, original)
+            digest = generate_variants(name)
+            Book.objects.filter(pk=book_id).update(preview_image=name, preview_hash=digest, updated_at=Now())
+            changed += 1
+        if changed:
+            response_cache.invalidate_all()
+        self.stdout.write(f'Processed previews for {changed} books.')
+
+        if options['gc']:
+            cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+            orphans = sorted(
+                name for name in set(self.stored_files(storage)) - self.referenced_files()
+                if storage.get_modified_time(name) <= cutoff
+            )
+            for name in orphans:
+                if options['dry_run']:
+                    self.stdout.write(f'Would delete {name}.')
+                else:
+                    storage.delete(name)
+            self.stdout.write(f"{'Found' if options['dry_run'] else 'Deleted'} {len(orphans)} orphaned preview files.")
+
+    def stored_files(self, storage, path=PREVIEW_DIR):
+        if not storage.exists(path):
+            return
+        directories, files = storage.listdir(path)
+        for name in files:
+            yield f'{path}/{name}'
+        for directory in directories:
+            yield from self.stored_files(storage, f'{path}/{directory}')
+
+    def referenced_files(self):
+        referenced = set()
+        variants = preview_settings()['VARIANTS']
+        for name in Book.objects.exclude(preview_image='').values_list('preview_image', flat=True).iterator():
+            if not name:
+                continue
+            referenced.add(name)
+            digest = preview_digest(name)
+            if digest:
+                referenced.update(preview_name(digest, variant) for variant in variants)
+        return referenced
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from library.models import AvailabilityEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete availability feed events older than the retention window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Days of events to keep (default: 30).')
+
+    def handle(self, *args, **options):
+        # Clients resuming from a pruned cursor are sent a reset event and reload instead.
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = AvailabilityEvent.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(f'Deleted {deleted} availability events older than {cutoff:%Y-%m-%d %H:%M}.')
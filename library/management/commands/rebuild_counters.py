@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+
+from library.cache import response_cache
+from library.models import AvailableBook, Book
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized availability counters from loans and holds and verify them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only check the counters and exit with an error if any are out of date.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            with transaction.atomic():
+                copies = AvailableBook.objects.all().refresh_checked_out()
+                books = Book.objects.all().refresh_copy_counts()
+                response_cache.invalidate_all()
+            self.stdout.write(f'Rebuilt counters for {copies} copies and {books} books.')
+
+        stale_copies = AvailableBook.objects.with_checkout_status().exclude(is_checked_out=F('is_claimed'))
+        stale_books = Book.objects.with_copy_counts().filter(
+            ~Q(total_copies=F('counted_total_copies')) | ~Q(available_copies=F('counted_available_copies'))
+        )
+        stale_copy_count = stale_copies.count()
+        stale_book_count = stale_books.count()
+        if stale_copy_count or stale_book_count:
+            raise CommandError(
+                f'{stale_copy_count} copies and {stale_book_count} books have out of date counters.'
+            )
+        self.stdout.write(self.style.SUCCESS('All availability counters match the loans and holds.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library.cache import response_cache
+from library.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating statistics on every book from the Review table.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            books = Book.objects.all().refresh_ratings()
+            response_cache.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f'Recomputed rating statistics for {books} books.'))
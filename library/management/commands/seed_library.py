@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.models import CustomUser
+from library.seeding import BENCHMARK_PASSWORD, STAFF_USERNAME, seed_library
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a reproducible synthetic library for benchmarking: popularity-skewed '
+        'loans and reviews, a few open and overdue loans, and API tokens for every generated user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=10_000)
+        parser.add_argument('--copies', type=int, default=3, help='Copies per book.')
+        parser.add_argument('--borrows', type=int, default=100_000)
+        parser.add_argument('--reviews', type=int, default=50_000)
+        parser.add_argument('--users', type=int, default=2_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(username=STAFF_USERNAME).exists():
+            raise CommandError('This database is already seeded; seed a fresh database instead.')
+        counts = seed_library(
+            options['books'], options['copies'], options['borrows'], options['reviews'], options['users'],
+            seed=options['seed'],
+        )
+        self.stdout.write(', '.join(f'{count} {name.replace("_", " ")}' for name, count in counts.items()))
+        self.stdout.write(f'Generated users log in as {STAFF_USERNAME} or bench-reader-N with password {BENCHMARK_PASSWORD!r}.')
@@ -0,0 +1,125 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .previews import preview_digest
+
+DEFAULTS = {
+    'PREFIXES': ('book_previews/',),
+    'MAX_AGE': 3600,
+    'OFFLOAD': None,
+    'ACCEL_REDIRECT_LOCATION': '/protected-media/',
+}
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_MEDIA', {})}
+
+
+class _RangeFile:
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _byte_range(request, size, etag, last_modified):
+    header = request.headers.get('Range')
+    if not header:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # Multiple or malformed ranges are answered with the whole file.
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+@require_safe
+def serve_media(request, path):
+    config = media_settings()
+    path = posixpath.normpath(path).lstrip('/')
+    if not path.startswith(tuple(config['PREFIXES'])):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    # Content-addressed files never change, so their name is a strong validator.
+    immutable = preview_digest(path, variants=True) is not None
+    if immutable:
+        etag = quote_etag(posixpath.splitext(posixpath.basename(path))[0])
+    else:
+        etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, config, path, full_path, stat.st_size, etag, last_modified)
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    response['Cache-Control'] = (
+        f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable else f"public, max-age={config['MAX_AGE']}"
+    )
+    return response
+
+
+def _file_response(request, config, path, full_path, size, etag, last_modified):
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if config['OFFLOAD'] == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = config['ACCEL_REDIRECT_LOCATION'].rstrip('/') + '/' + path
+        return response
+    if config['OFFLOAD'] == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+
+    byte_range = _byte_range(request, size, etag, last_modified)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        # The plain file object lets the WSGI server use sendfile().
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(_RangeFile(open(full_path, 'rb'), start, end - start + 1), content_type=content_type)
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:18
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    AvailableBook = apps.get_model('library', 'AvailableBook')
+    Borrow = apps.get_model('library', 'Borrow')
+
+    open_borrows = Borrow.objects.filter(available_book=OuterRef('pk'), date_returned__isnull=True)
+    AvailableBook.objects.update(is_checked_out=Exists(open_borrows))
+
+    def count_copies(condition):
+        counts = (
+            AvailableBook.objects.filter(condition, book=OuterRef('pk'))
+            .order_by().values('book').annotate(n=Count('pk')).values('n')
+        )
+        return Coalesce(Subquery(counts), 0)
+
+    Book.objects.update(
+        total_copies=count_copies(Q()),
+        available_copies=count_copies(Q(is_checked_out=False)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_remove_customuser_profile_picture_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availablebook',
+            name='is_checked_out',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:18
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def close_duplicate_open_borrows(apps, schema_editor):
+    Borrow = apps.get_model('library', 'Borrow')
+
+    # The earliest open loan of a double-booked copy stands; later ones are closed on their own borrow date.
+    open_borrows = Borrow.objects.filter(date_returned__isnull=True)
+    duplicated = open_borrows.order_by().values('available_book').annotate(open=Count('id')).filter(open__gt=1)
+    for copy_id in duplicated.values_list('available_book', flat=True):
+        copy_borrows = open_borrows.filter(available_book=copy_id)
+        kept = copy_borrows.order_by('borrow_date', 'id').values_list('id', flat=True).first()
+        copy_borrows.exclude(pk=kept).update(date_returned=F('borrow_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_availability_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_borrows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='borrow',
+            constraint=models.UniqueConstraint(condition=models.Q(('date_returned__isnull', True)), fields=('available_book',), name='unique_open_borrow_per_copy'),
+        ),
+    ]
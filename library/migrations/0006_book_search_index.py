@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:31
+
+import django.db.models.deletion
+import library.search
+from django.db import migrations, models
+
+from library.search import drop_search_index, install_search_index, rebuild_search_index
+
+
+def create_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+    rebuild_search_index(schema_editor.connection)
+
+
+def remove_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_unique_open_borrow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchIndex',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='library.book')),
+                ('document', library.search.FullTextField(db_column='library_book_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'library_book_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_index, remove_index),
+    ]
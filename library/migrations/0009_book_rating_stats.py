@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:39
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_ratings(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Review = apps.get_model('library', 'Review')
+
+    def count_reviews(**filters):
+        reviews = Review.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+        return Coalesce(Subquery(reviews.annotate(n=Count('pk')).values('n')), 0)
+
+    averages = Review.objects.filter(book=OuterRef('pk')).order_by().values('book').annotate(a=Avg('rating'))
+    Book.objects.update(
+        review_count=count_reviews(),
+        average_rating=Coalesce(Subquery(averages.values('a')), Value(0.0)),
+        **{f'rating_{r}_count': count_reviews(rating=r) for r in range(1, 6)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_updated_at_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='average_rating',
+            field=models.FloatField(db_index=True, default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:46
+
+import library.previews
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='preview_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='preview_image',
+            field=models.ImageField(blank=True, null=True, storage=library.previews.preview_storage, upload_to='book_previews/'),
+        ),
+    ]
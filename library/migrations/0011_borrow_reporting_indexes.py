@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_book_preview_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['date_returned', 'return_date'], name='borrow_returned_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['user', 'date_returned'], name='borrow_user_returned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['borrow_date', 'available_book'], name='borrow_date_copy_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_borrow_reporting_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('borrows_updated_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('open_loans', models.PositiveIntegerField(default=0)),
+                ('overdue', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='borrow',
+            index=models.Index(fields=['updated_at'], name='borrow_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailycirculation',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_circulation', to='library.book'),
+        ),
+        migrations.AddIndex(
+            model_name='dailycirculation',
+            index=models.Index(fields=['day', 'book'], name='circulation_day_book_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycirculation',
+            constraint=models.UniqueConstraint(fields=('book', 'day'), name='unique_daily_circulation'),
+        ),
+    ]
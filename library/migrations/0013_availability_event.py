@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_daily_circulation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('borrowed', 'Borrowed'), ('returned', 'Returned'), ('copy_added', 'Copy added'), ('copy_removed', 'Copy removed')], max_length=16)),
+                ('book_id', models.BigIntegerField()),
+                ('copy_id', models.BigIntegerField()),
+                ('location', models.CharField(max_length=255)),
+                ('copy_is_available', models.BooleanField()),
+                ('available_copies', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book_id', 'id'], name='availability_event_book_idx')],
+            },
+        ),
+    ]
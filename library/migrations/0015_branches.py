@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def locations_to_branches(apps, schema_editor):
+    Branch = apps.get_model('library', 'Branch')
+    AvailableBook = apps.get_model('library', 'AvailableBook')
+
+    # Locations differing only in surrounding or repeated whitespace share a branch; one UPDATE per spelling.
+    locations = AvailableBook.objects.order_by().values_list('location', flat=True).distinct()
+    names = {location: ' '.join(location.split()) or 'Unassigned' for location in locations}
+    Branch.objects.bulk_create([Branch(name=name) for name in sorted(set(names.values()))])
+    branches = dict(Branch.objects.values_list('name', 'id'))
+    for location, name in names.items():
+        AvailableBook.objects.filter(location=location).update(branch_id=branches[name])
+
+
+def branches_to_locations(apps, schema_editor):
+    AvailableBook = apps.get_model('library', 'AvailableBook')
+    Branch = apps.get_model('library', 'Branch')
+
+    for branch_id, name in Branch.objects.values_list('id', 'name'):
+        AvailableBook.objects.filter(branch_id=branch_id).update(location=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='availablebook',
+            name='branch',
+            field=models.ForeignKey(
+                db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                related_name='copies', to='library.branch',
+            ),
+        ),
+        migrations.AlterField(
+            model_name='availablebook',
+            name='location',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(locations_to_branches, branches_to_locations),
+        migrations.AlterField(
+            model_name='availablebook',
+            name='branch',
+            field=models.ForeignKey(
+                db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                related_name='copies', to='library.branch',
+            ),
+        ),
+        migrations.RemoveField(
+            model_name='availablebook',
+            name='location',
+        ),
+        migrations.AddIndex(
+            model_name='availablebook',
+            index=models.Index(fields=['book', 'branch'], name='copy_book_branch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availablebook',
+            index=models.Index(fields=['branch', 'book', 'is_checked_out'], name='copy_branch_inventory_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_stale_circulation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,8 +1,16 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import (
+    Avg, Case, Count, Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Now
+from django.db.models.lookups import GreaterThan
 from django.utils import timezone
 
+from .previews import preview_storage
+from .search import FullTextField
+
 
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
@@ -12,7 +20,94 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=5, choices=ROLE_CHOICES, default='user')
 
 
-class Book(models.Model):
+class DenormalizedFieldsMixin:
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+def _count_copies(copies):
+    counts = copies.filter(book=OuterRef('pk')).order_by().values('book').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts), 0)
+
+
+RATINGS = range(1, 6)
+
+
+def rating_field(rating):
+    return f'rating_{rating}_count'
+
+
+def _count_reviews(**filters):
+    reviews = Review.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+    return Coalesce(Subquery(reviews.annotate(n=Count('pk')).values('n')), 0)
+
+
+class BookQuerySet(models.QuerySet):
+    def with_copy_counts(self):
+        copies = AvailableBook.objects.with_checkout_status()
+        return self.annotate(
+            counted_total_copies=_count_copies(copies),
+            counted_available_copies=_count_copies(copies.filter(is_claimed=False)),
+        )
+
+    def refresh_copy_counts(self):
+        return self.update(
+            total_copies=_count_copies(AvailableBook.objects.all()),
+            available_copies=_count_copies(AvailableBook.objects.filter(is_checked_out=False)),
+            updated_at=Now(),
+        )
+
+    def apply_review(self, rating, delta):
+        # One UPDATE that reads the old counters, so concurrent reviews never lose increments.
+        count = F('review_count') + delta
+        total = sum((F(rating_field(r)) * r for r in RATINGS), Value(rating * delta))
+        return self.update(
+            review_count=count,
+            average_rating=Case(
+                When(GreaterThan(count, 0), then=Cast(total, FloatField()) / count),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+            updated_at=Now(),
+            **{rating_field(rating): F(rating_field(rating)) + delta},
+        )
+
+    def refresh_ratings(self):
+        averages = Review.objects.filter(book=OuterRef('pk')).order_by().values('book').annotate(a=Avg('rating'))
+        return self.update(
+            review_count=_count_reviews(),
+            average_rating=Coalesce(Subquery(averages.values('a')), Value(0.0)),
+            updated_at=Now(),
+            **{rating_field(r): _count_reviews(rating=r) for r in RATINGS},
+        )
+
+
+def _is_claimed():
+    # A copy is out while it has an open loan or sits on the hold shelf for someone.
+    open_borrows = Borrow.objects.filter(available_book=OuterRef('pk'), date_returned__isnull=True)
+    ready_holds = Hold.objects.filter(assigned_copy=OuterRef('pk'), status=Hold.READY)
+    return ExpressionWrapper(Q(Exists(open_borrows)) | Q(Exists(ready_holds)), output_field=models.BooleanField())
+
+
+class AvailableBookQuerySet(models.QuerySet):
+    def with_checkout_status(self):
+        return self.annotate(is_claimed=_is_claimed())
+
+    def check_out(self):
+        return self.filter(is_checked_out=False).update(is_checked_out=True, updated_at=Now())
+
+    def refresh_checked_out(self):
+        return self.update(is_checked_out=_is_claimed(), updated_at=Now())
+
+
+class Book(DenormalizedFieldsMixin, models.Model):
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     published_date = models.DateField(null=True, blank=True)
@@ -20,11 +115,101 @@ class Book(models.Model):
     isbn = models.CharField(max_length=13, unique=True, blank=True, null=True)
     description = models.TextField(blank=True)
     language = models.CharField(max_length=50, blank=True)
-    preview_image = models.ImageField(upload_to='book_previews/', null=True, blank=True)
+    preview_image = models.ImageField(upload_to='book_previews/', storage=preview_storage, null=True, blank=True)
+    preview_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    total_copies = models.PositiveIntegerField(default=0, editable=False)
+    available_copies = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0.0, editable=False, db_index=True)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
+    denormalized_fields = (
+        'total_copies', 'available_copies', 'review_count', 'average_rating',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count', 'preview_hash',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['title'], name='book_title_idx'),
+            models.Index(fields=['author', 'published_date'], name='book_author_published_idx'),
+            models.Index(fields=['genre', 'language', 'published_date'], name='book_genre_lang_pub_idx'),
+            models.Index(fields=['genre', 'published_date'], name='book_genre_published_idx'),
+            models.Index(fields=['language', 'published_date'], name='book_language_published_idx'),
+            models.Index(fields=['published_date'], name='book_published_idx'),
+        ]
+
+    @property
+    def is_available(self):
+        return self.available_copies > 0
+
+    @property
+    def rating_histogram(self):
+        return {str(r): getattr(self, rating_field(r)) for r in RATINGS}
+
+class BookSearchIndex(models.Model):
+    book = models.OneToOneField(
+        Book, primary_key=True, db_column='rowid', related_name='search_index', on_delete=models.DO_NOTHING
+    )
+    document = FullTextField(db_column='library_book_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'library_book_fts'
+
+def normalize_branch_name(name):
+    return ' '.join(name.split())
+
+
+class BranchQuerySet(models.QuerySet):
+    def resolve(self, names):
+        # Maps location strings to branches in at most three queries, creating the missing ones.
+        wanted = {name: normalize_branch_name(name) for name in names}
+        found = {branch.name: branch for branch in self.filter(name__in=set(wanted.values()))}
+        missing = set(wanted.values()) - set(found)
+        if missing:
+            self.bulk_create([Branch(name=name) for name in sorted(missing)], ignore_conflicts=True)
+            found.update((branch.name, branch) for branch in self.filter(name__in=missing))
+        return {name: found[normalized] for name, normalized in wanted.items()}
+
+class Branch(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BranchQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
 
-class AvailableBook(models.Model):
+class AvailableBook(DenormalizedFieldsMixin, models.Model):
     book = models.ForeignKey(Book, related_name="available_books", on_delete=models.CASCADE)
-    location = models.CharField(max_length=255)
+    # Indexed through copy_branch_inventory_idx, which leads with the branch.
+    branch = models.ForeignKey(Branch, related_name="copies", on_delete=models.PROTECT, db_index=False)
+    is_checked_out = models.BooleanField(default=False, editable=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AvailableBookQuerySet.as_manager()
+    denormalized_fields = ('is_checked_out',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'branch'], name='copy_book_branch_idx'),
+            models.Index(fields=['branch', 'book', 'is_checked_out'], name='copy_branch_inventory_idx'),
+        ]
+
+    @property
+    def location(self):
+        return self.branch.name
+
+    @property
+    def copy_is_available(self):
+        return not self.is_checked_out
 
 class Borrow(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -32,9 +217,131 @@ class Borrow(models.Model):
     borrow_date = models.DateField(default=timezone.now)
     return_date = models.DateField()
     date_returned = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['available_book'],
+                condition=models.Q(date_returned__isnull=True),
+                name='unique_open_borrow_per_copy',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date_returned', 'return_date'], name='borrow_returned_due_idx'),
+            models.Index(fields=['user', 'date_returned'], name='borrow_user_returned_idx'),
+            models.Index(fields=['borrow_date', 'available_book'], name='borrow_date_copy_idx'),
+            models.Index(fields=['updated_at'], name='borrow_updated_idx'),
+        ]
+
+class HoldQuerySet(models.QuerySet):
+    def queue(self):
+        # A waiting hold past its wanted-until date is passed over even before expire_holds() marks it.
+        wanted = Q(expires_at__isnull=True) | Q(expires_at__gt=Now())
+        return self.filter(wanted, status=Hold.WAITING).order_by('created_at', 'id')
+
+    def fulfill(self):
+        return self.update(status=Hold.FULFILLED, updated_at=Now())
+
+class Hold(models.Model):
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = (
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    )
+    ACTIVE = (WAITING, READY)
+    book = models.ForeignKey(Book, related_name="holds", on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="holds", on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    assigned_copy = models.ForeignKey(
+        AvailableBook, related_name="holds", null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    # Pickup deadline once ready; while waiting, an optional date after which the hold is no longer wanted.
+    expires_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'user'], condition=models.Q(status__in=('waiting', 'ready')),
+                name='unique_active_hold_per_user',
+            ),
+            models.UniqueConstraint(
+                fields=['assigned_copy'], condition=models.Q(status='ready'), name='unique_ready_hold_per_copy',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['book', 'status', 'created_at'], name='hold_queue_idx'),
+            models.Index(fields=['status', 'expires_at'], name='hold_status_expires_idx'),
+        ]
+
+class DailyCirculation(models.Model):
+    # One row per book per day with any activity or open loans; a missing row means all zeros.
+    book = models.ForeignKey(Book, related_name="daily_circulation", on_delete=models.CASCADE)
+    day = models.DateField()
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    open_loans = models.PositiveIntegerField(default=0)
+    overdue = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='unique_daily_circulation'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'book'], name='circulation_day_book_idx'),
+        ]
+
+class CirculationWatermark(models.Model):
+    # Single row: the last day refreshed and the newest Borrow.updated_at folded into the snapshots.
+    day = models.DateField()
+    borrows_updated_at = models.DateTimeField(null=True)
+
+class StaleCirculation(models.Model):
+    # A book and day whose snapshots still count a loan that was since moved, re-dated or deleted; the next
+    # refresh recomputes the book from that day on. Unconstrained, so a marker may outlive its book.
+    book = models.ForeignKey(Book, related_name="+", on_delete=models.DO_NOTHING, db_constraint=False)
+    day = models.DateField()
+
+class AvailabilityEvent(models.Model):
+    BORROWED = 'borrowed'
+    RETURNED = 'returned'
+    COPY_ADDED = 'copy_added'
+    COPY_REMOVED = 'copy_removed'
+    KIND_CHOICES = (
+        (BORROWED, 'Borrowed'),
+        (RETURNED, 'Returned'),
+        (COPY_ADDED, 'Copy added'),
+        (COPY_REMOVED, 'Copy removed'),
+    )
+    # Append-only change feed; plain ids so the history outlives deleted books and copies.
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    book_id = models.BigIntegerField()
+    copy_id = models.BigIntegerField()
+    location = models.CharField(max_length=255)
+    copy_is_available = models.BooleanField()
+    available_copies = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book_id', 'id'], name='availability_event_book_idx'),
+        ]
 
 class Review(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="reviews", on_delete=models.CASCADE)
     book = models.ForeignKey(Book, related_name="reviews", on_delete=models.CASCADE)
     rating = models.PositiveIntegerField(choices=[(i, str(i)) for i in range(1, 6)])
     comment = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,17 @@
+from asgiref.sync import sync_to_async
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+
+class BookCursorPagination(IdCursorPagination):
+    # For rows grouped per book, which carry the book id instead of their own.
+    ordering = 'book'
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .instrumentation import instrumentation_settings
+
 class IsStaffOrReadOnly(permissions.BasePermission):
 
     def has_permission(self, request, view):
@@ -15,3 +17,15 @@ class IsStaffOrReadOnlyExceptReviewPost(permissions.BasePermission):
         if request.method == 'POST':
             return request.user and request.user.is_authenticated
         return request.user and request.user.is_authenticated and request.user.role == 'staff'
+
+class IsStaff(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        return request.user and request.user.is_authenticated and request.user.role == 'staff'
+
+class CanScrapeMetrics(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in instrumentation_settings()['METRICS_ALLOWED_IPS']:
+            return True
+        return request.user and request.user.is_authenticated and request.user.role == 'staff'
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+PREVIEW_DIR = 'book_previews'
+PREVIEW_NAME = re.compile(rf'^{PREVIEW_DIR}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{64}})(?P<variant>-[a-z]+)?\.webp$')
+DEFAULTS = {
+    'WORKERS': 2,
+    'QUALITY': 80,
+    'VARIANTS': {'list': (200, 300), 'detail': (600, 900)},
+}
+
+logger = logging.getLogger(__name__)
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def preview_settings():
+    return {**DEFAULTS, **getattr(settings, 'LIBRARY_PREVIEWS', {})}
+
+
+def preview_name(digest, variant=None):
+    suffix = f'-{variant}' if variant else ''
+    return f'{PREVIEW_DIR}/{digest[:2]}/{digest}{suffix}.webp'
+
+
+def preview_digest(name, variants=False):
+    match = PREVIEW_NAME.match(name or '')
+    if match is None or (match['variant'] and not variants):
+        return None
+    return match['digest']
+
+
+def encode_webp(image, size=None):
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    if size:
+        image.thumbnail(size, Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, 'WEBP', quality=preview_settings()['QUALITY'], method=4)
+    return output.getvalue()
+
+
+class PreviewStorage(FileSystemStorage):
+    # Uploads are stored once per distinct content, re-encoded to WebP under their SHA-256.
+    def save(self, name, content, max_length=None):
+        content.seek(0)
+        data = content.read()
+        name = preview_name(hashlib.sha256(data).hexdigest())
+        if not self.exists(name):
+            with Image.open(BytesIO(data)) as image:
+                self._save(name, ContentFile(encode_webp(image)))
+        return name
+
+
+def preview_storage():
+    return PreviewStorage()
+
+
+def generate_variants(name):
+    storage = preview_storage()
+    digest = preview_digest(name)
+    missing = {
+        variant: size for variant, size in preview_settings()['VARIANTS'].items()
+        if not storage.exists(preview_name(digest, variant))
+    }
+    if missing:
+        with storage.open(name) as original, Image.open(original) as image:
+            image.load()
+            for variant, size in missing.items():
+                storage._save(preview_name(digest, variant), ContentFile(encode_webp(image, size)))
+    return digest
+
+
+def _process(book_id, name):
+    from .cache import response_cache
+    from .models import Book
+
+    digest = generate_variants(name)
+    if Book.objects.filter(pk=book_id, preview_image=name).update(preview_hash=digest, updated_at=Now()):
+        response_cache.invalidate('books', f'book:{book_id}')
+
+
+def _run_in_worker(book_id, name):
+    try:
+        _process(book_id, name)
+    except Exception:
+        logger.exception('Could not generate preview variants for book %s', book_id)
+    finally:
+        connection.close()
+
+
+def schedule_variants(book_id, name):
+    global _executor
+    workers = preview_settings()['WORKERS']
+    if not workers:
+        _process(book_id, name)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='book-previews')
+    _executor.submit(_run_in_worker, book_id, name)
+
+
+def variant_urls(book):
+    if not book.preview_image:
+        return None
+    storage = book.preview_image.storage
+    if book.preview_hash and preview_digest(book.preview_image.name) == book.preview_hash:
+        urls = {variant: storage.url(preview_name(book.preview_hash, variant)) for variant in preview_settings()['VARIANTS']}
+    else:
+        # Variants are still being generated, or the file predates the pipeline.
+        urls = dict.fromkeys(preview_settings()['VARIANTS'], book.preview_image.url)
+    return {**urls, 'original': book.preview_image.url}
@@ -0,0 +1,105 @@
+from django.db.models import Count, F, Q, Sum
+
+from .models import AvailableBook, Borrow, DailyCirculation
+
+
+def _borrowed_between(params, prefix=''):
+    condition = Q()
+    if params.get('since'):
+        condition &= Q(**{f'{prefix}borrow_date__gte': params['since']})
+    if params.get('until'):
+        condition &= Q(**{f'{prefix}borrow_date__lte': params['until']})
+    return condition
+
+
+def overdue(params):
+    # Served by borrow_returned_due_idx: date_returned IS NULL, then a range on return_date.
+    fields = [
+        'id', 'user_id', 'user__username', 'available_book_id', 'available_book__book_id',
+        'available_book__book__title', 'available_book__branch__name', 'borrow_date', 'return_date',
+    ]
+    rows = (
+        Borrow.objects.filter(_borrowed_between(params), date_returned__isnull=True, return_date__lt=params['as_of'])
+        .order_by('return_date', 'id')
+        .values_list(*fields)
+    )
+    as_of = params['as_of']
+    return [*fields, 'days_overdue'], ((*row, (as_of - row[-1]).days) for row in rows.iterator(chunk_size=2000))
+
+
+def loans_per_user(params):
+    open_loans = Q(date_returned__isnull=True)
+    fields = ['user_id', 'user__username', 'loans', 'open_loans', 'overdue_loans', 'returned_late']
+    rows = (
+        Borrow.objects.filter(_borrowed_between(params))
+        .values('user_id', 'user__username')
+        .annotate(
+            loans=Count('id'),
+            open_loans=Count('id', filter=open_loans),
+            overdue_loans=Count('id', filter=open_loans & Q(return_date__lt=params['as_of'])),
+            returned_late=Count('id', filter=Q(date_returned__gt=F('return_date'))),
+        )
+        .order_by('-loans', 'user_id')
+        .values_list(*fields)
+    )
+    return fields, rows.iterator(chunk_size=2000)
+
+
+def _snapshot_days(params):
+    condition = Q()
+    if params.get('since'):
+        condition &= Q(day__gte=params['since'])
+    if params.get('until'):
+        condition &= Q(day__lte=params['until'])
+    return condition
+
+
+def most_borrowed(params):
+    # Read from the daily snapshots, so loans since the last refresh_circulation run are not counted.
+    fields = ['book_id', 'book__title', 'book__author', 'loans']
+    rows = (
+        DailyCirculation.objects.filter(_snapshot_days(params), checkouts__gt=0)
+        .values('book_id', 'book__title', 'book__author')
+        .annotate(loans=Sum('checkouts'))
+        .order_by('-loans', 'book_id')
+        .values_list(*fields)[:params['limit']]
+    )
+    return ['book_id', 'title', 'author', 'loans'], rows.iterator(chunk_size=2000)
+
+
+def daily_circulation(params):
+    fields = ['day', 'checkouts', 'returns', 'open_loans', 'overdue']
+    rows = (
+        DailyCirculation.objects.filter(_snapshot_days(params))
+        .values('day')
+        .annotate(**{metric: Sum(metric) for metric in fields[1:]})
+        .order_by('day')
+        .values_list(*fields)
+    )
+    return fields, rows.iterator(chunk_size=2000)
+
+
+def utilization(params):
+    fields = ['location', 'copies', 'checked_out', 'loans']
+    rows = (
+        AvailableBook.objects.values(location=F('branch__name'))
+        .annotate(
+            copies=Count('id', distinct=True),
+            checked_out=Count('id', filter=Q(is_checked_out=True), distinct=True),
+            loans=Count('borrows', filter=_borrowed_between(params, prefix='borrows__')),
+        )
+        .order_by('location')
+        .values_list(*fields)
+    )
+    return [*fields, 'checked_out_ratio'], (
+        (*row, round(row[2] / row[1], 4) if row[1] else 0.0) for row in rows.iterator(chunk_size=2000)
+    )
+
+
+REPORTS = {
+    'overdue': overdue,
+    'loans-per-user': loans_per_user,
+    'most-borrowed': most_borrowed,
+    'utilization': utilization,
+    'daily-circulation': daily_circulation,
+}
@@ -0,0 +1,139 @@
+import re
+
+from django.db import connections, models
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS library_book_fts USING fts5(
+        title, author, description, genre,
+        content='library_book', content_rowid='id', prefix='2 3 4'
+    )
+    """,
+    "INSERT INTO library_book_fts(library_book_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 2.0)')",
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_insert AFTER INSERT ON library_book BEGIN
+        INSERT INTO library_book_fts(rowid, title, author, description, genre)
+        VALUES (new.id, new.title, new.author, new.description, new.genre);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_delete AFTER DELETE ON library_book BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description, genre)
+        VALUES ('delete', old.id, old.title, old.author, old.description, old.genre);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_update
+    AFTER UPDATE OF title, author, description, genre ON library_book BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description, genre)
+        VALUES ('delete', old.id, old.title, old.author, old.description, old.genre);
+        INSERT INTO library_book_fts(rowid, title, author, description, genre)
+        VALUES (new.id, new.title, new.author, new.description, new.genre);
+    END
+    """,
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS library_book_fts_insert',
+    'DROP TRIGGER IF EXISTS library_book_fts_delete',
+    'DROP TRIGGER IF EXISTS library_book_fts_update',
+    'DROP TABLE IF EXISTS library_book_fts',
+]
+
+POSTGRES_INDEX = [
+    """
+    CREATE OR REPLACE FUNCTION library_book_document(title text, author text, description text, genre text)
+    RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+        SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(author, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(genre, '')), 'C')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'D')
+    $$
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS library_book_document_idx ON library_book
+    USING gin (library_book_document(title, author, description, genre))
+    """,
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS library_book_document_idx',
+    'DROP FUNCTION IF EXISTS library_book_document(text, text, text, text)',
+]
+
+POSTGRES_DOCUMENT = (
+    'library_book_document("library_book"."title", "library_book"."author", '
+    '"library_book"."description", "library_book"."genre")'
+)
+POSTGRES_MATCH = f'SELECT "library_book"."id" FROM "library_book" WHERE {POSTGRES_DOCUMENT} @@ to_tsquery(\'english\', %s)'
+POSTGRES_RANK = f'ts_rank({POSTGRES_DOCUMENT}, to_tsquery(\'english\', %s))'
+
+
+class FullTextField(models.TextField):
+    pass
+
+
+@FullTextField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install_search_index(connection):
+    if connection.vendor == 'sqlite':
+        _execute(connection, SQLITE_INDEX)
+    elif connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_INDEX)
+
+
+def drop_search_index(connection):
+    if connection.vendor == 'sqlite':
+        _execute(connection, SQLITE_DROP)
+    elif connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_DROP)
+
+
+def rebuild_search_index(connection):
+    if connection.vendor == 'sqlite':
+        _execute(connection, ["INSERT INTO library_book_fts(library_book_fts) VALUES ('rebuild')"])
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_books(queryset, query):
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'sqlite':
+        match = ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        return queryset.filter(search_index__document__match=match).annotate(search_rank=-F('search_index__rank'))
+
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+        return queryset.filter(id__in=RawSQL(POSTGRES_MATCH, (tsquery,))).annotate(
+            search_rank=RawSQL(POSTGRES_RANK, (tsquery,), output_field=FloatField())
+        )
+
+    condition = Q()
+    for term in terms:
+        condition &= (
+            Q(title__icontains=term) | Q(author__icontains=term)
+            | Q(description__icontains=term) | Q(genre__icontains=term)
+        )
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
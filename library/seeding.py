@@ -0,0 +1,116 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .cache import response_cache
+from .models import AvailableBook, Book, Borrow, Branch, CustomUser, Review
+
+USER_PREFIX = 'bench-'
+STAFF_USERNAME = 'bench-staff'
+BENCHMARK_PASSWORD = 'bench-password'
+WORDS = (
+    'river night garden winter empire shadow glass ocean silver storm crown forest machine letter '
+    'city stone dragon mirror summer island secret fire memory engine harbor wolf lantern voyage'
+).split()
+GENRES = ['Fantasy', 'Mystery', 'History', 'Poetry', 'Science fiction', 'Romance', 'Biography']
+LANGUAGES = ['en'] * 8 + ['fr', 'es']
+BRANCHES = ['Main', 'North', 'South', 'East', 'West', 'Harbor']
+RATING_WEIGHTS = [5, 8, 17, 35, 35]
+LOAN_DAYS = 14
+HISTORY_DAYS = 2 * 365
+
+
+def popularity(count, rng, skew=1.1):
+    # Zipf-like: a few titles get most of the loans and reviews, as in real circulation data.
+    # Returned as cumulative weights so every draw is a bisect.
+    weights = [1 / (rank + 1) ** skew for rank in range(count)]
+    rng.shuffle(weights)
+    return list(accumulate(weights))
+
+
+@transaction.atomic
+def seed_library(books, copies, borrows, reviews, users, seed=42):
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    password = make_password(BENCHMARK_PASSWORD)
+    staff = CustomUser.objects.create(username=STAFF_USERNAME, password=password, role='staff')
+    readers = CustomUser.objects.bulk_create(
+        (CustomUser(username=f'{USER_PREFIX}reader-{n}', password=password) for n in range(users)), batch_size=5000,
+    )
+    Token.objects.bulk_create(
+        (Token(key=Token.generate_key(), user=user) for user in [staff, *readers]), batch_size=5000,
+    )
+
+    catalog = Book.objects.bulk_create(
+        (
+            Book(
+                title=' '.join(rng.choices(WORDS, k=rng.randint(2, 4))).title(),
+                author=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+                genre=rng.choice(GENRES),
+                language=rng.choice(LANGUAGES),
+                published_date=today - timedelta(days=rng.randrange(80 * 365)),
+                description=' '.join(rng.choices(WORDS, k=rng.randint(20, 60))),
+            )
+            for _ in range(books)
+        ),
+        batch_size=5000,
+    )
+    branches = list(Branch.objects.resolve(BRANCHES).values())
+    shelf = AvailableBook.objects.bulk_create(
+        (AvailableBook(book=book, branch=rng.choice(branches)) for book in catalog for _ in range(copies)),
+        batch_size=5000,
+    )
+
+    # Readers are skewed too: a core of regulars accounts for most activity.
+    reader_weights = popularity(len(readers), rng, skew=0.8)
+    book_weights = popularity(len(catalog), rng)
+    open_copies = set()
+
+    def loan():
+        copy = shelf[rng.choices(range(len(catalog)), cum_weights=book_weights)[0] * copies + rng.randrange(copies)]
+        borrowed = today - timedelta(days=int(rng.triangular(0, HISTORY_DAYS, 0)))
+        due = borrowed + timedelta(days=LOAN_DAYS)
+        kept = max(1, int(rng.gauss(LOAN_DAYS - 3, 6)))
+        returned = borrowed + timedelta(days=kept)
+        if returned >= today:
+            if copy.pk in open_copies:
+                returned = today
+            else:
+                open_copies.add(copy.pk)
+                returned = None
+        return Borrow(
+            user=rng.choices(readers, cum_weights=reader_weights)[0], available_book=copy,
+            borrow_date=borrowed, return_date=due, date_returned=returned,
+        )
+
+    if readers and shelf:
+        Borrow.objects.bulk_create((loan() for _ in range(borrows)), batch_size=5000)
+    if readers and catalog:
+        Review.objects.bulk_create(
+            (
+                Review(
+                    user=rng.choices(readers, cum_weights=reader_weights)[0],
+                    book=rng.choices(catalog, cum_weights=book_weights)[0],
+                    rating=rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0],
+                    comment=' '.join(rng.choices(WORDS, k=rng.randint(0, 30))),
+                )
+                for _ in range(reviews)
+            ),
+            batch_size=5000,
+        )
+
+    # Bulk inserts skip the signals that maintain these.
+    AvailableBook.objects.all().refresh_checked_out()
+    Book.objects.all().refresh_copy_counts()
+    Book.objects.all().refresh_ratings()
+    response_cache.invalidate_all()
+    return {
+        'users': len(readers) + 1, 'books': len(catalog), 'copies': len(shelf),
+        'borrows': borrows if readers and shelf else 0, 'open_loans': len(open_copies),
+        'reviews': reviews if readers and catalog else 0,
+    }
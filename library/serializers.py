@@ -1,9 +1,49 @@
 from django.contrib.auth.hashers import make_password
-from rest_framework import serializers
-from .models import Book, Borrow, AvailableBook, Review, CustomUser
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from rest_framework import permissions, serializers
+from .cache import response_cache
+from .exceptions import Conflict
+from .feed import record_copy_events
+from .holds import assign_copies, invalidate_assignments
+from .models import AvailabilityEvent, Book, Borrow, AvailableBook, Branch, Hold, Review, CustomUser, normalize_branch_name
+from .previews import variant_urls
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+def _requested_names(kwargs, param):
+    request = kwargs.get('context', {}).get('request')
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None
+    requested = request.query_params.get(param)
+    if requested is None:
+        return None
+    return {name.strip() for name in requested.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = _requested_names(kwargs, 'fields')
+        if keep:
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class ExpandableFieldsMixin:
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = _requested_names(kwargs, 'expand')
+        if expand is None:
+            return
+        for name in self.expandable_fields:
+            if name in self.fields and name not in expand:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class CustomUserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
 
     class Meta:
@@ -31,46 +71,134 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return CustomUser.objects.create_user(**validated_data)
 
 
-class BookSerializer(serializers.ModelSerializer):
-    is_available = serializers.SerializerMethodField()
+class BookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    is_available = serializers.BooleanField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    preview_images = serializers.SerializerMethodField()
 
     class Meta:
         model = Book
         fields = [
             'id', 'title', 'author', 'published_date',
             'genre', 'isbn', 'description', 'language',
-            'preview_image', 'is_available',
+            'preview_image', 'preview_images', 'is_available', 'total_copies', 'available_copies',
+            'average_rating', 'review_count', 'rating_histogram',
         ]
 
-    def get_is_available(self, obj):
-        return any(
-            not ab.borrows.filter(date_returned__isnull=True).exists()
-            for ab in obj.available_books.all()
-        )
+    def get_preview_images(self, book):
+        urls = variant_urls(book)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {variant: request.build_absolute_uri(url) for variant, url in urls.items()}
+
+
+class BookImportSerializer(serializers.ModelSerializer):
+    # ISBN conflicts are resolved per chunk by the importer, not one query per row.
+    isbn = serializers.CharField(max_length=13, allow_blank=True, allow_null=True, required=False)
 
+    class Meta:
+        model = Book
+        fields = ['title', 'author', 'published_date', 'genre', 'isbn', 'description', 'language']
+
+    def validate_isbn(self, value):
+        return value or None
 
-class AvailableBookReadSerializer(serializers.ModelSerializer):
+
+class AvailableBookReadSerializer(SparseFieldsetMixin, ExpandableFieldsMixin, serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
-    copy_is_available = serializers.SerializerMethodField()
+    location = serializers.CharField(source='branch.name', read_only=True)
+    copy_is_available = serializers.BooleanField(read_only=True)
+    expandable_fields = ('book',)
 
     class Meta:
         model = AvailableBook
-        fields = ['id', 'book', 'location', 'copy_is_available']
+        fields = ['id', 'book', 'branch', 'location', 'copy_is_available']
 
-    def get_copy_is_available(self, obj):
-        return not obj.borrows.filter(date_returned__isnull=True).exists()
 
 class AvailableBookWriteSerializer(serializers.ModelSerializer):
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
+    location = serializers.CharField(source='branch.name', max_length=255)
 
     class Meta:
         model = AvailableBook
-        fields = ['id', 'book', 'location']
+        fields = ['id', 'book', 'branch', 'location']
+        read_only_fields = ['branch']
+
+    def with_branch(self, validated_data):
+        if 'branch' in validated_data:
+            name = validated_data.pop('branch')['name']
+            validated_data['branch'] = Branch.objects.resolve([name])[name]
+        return validated_data
 
+    @transaction.atomic
+    def create(self, validated_data):
+        return super().create(self.with_branch(validated_data))
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        return super().update(instance, self.with_branch(validated_data))
 
-class BorrowReadSerializer(serializers.ModelSerializer):
+
+class AvailableBookListSerializer(serializers.ListSerializer):
+    @transaction.atomic
+    def create(self, validated_data):
+        # bulk_create skips the post_save signals, so refresh counters, cached responses and the feed here.
+        branches = Branch.objects.resolve({item['branch']['name'] for item in validated_data})
+        copies = AvailableBook.objects.bulk_create(
+            AvailableBook(**{**item, 'branch': branches[item['branch']['name']]}) for item in validated_data
+        )
+        book_ids = {copy.book_id for copy in copies}
+        holders = {user_id for *_, user_id in assign_copies([copy.pk for copy in copies])}
+        Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+        response_cache.invalidate(
+            'books', *(f'book:{book_id}' for book_id in book_ids), *(f'user:{user_id}' for user_id in holders),
+        )
+        record_copy_events(AvailabilityEvent.COPY_ADDED, [copy.pk for copy in copies])
+        return copies
+
+class AvailableBookBatchWriteSerializer(serializers.ModelSerializer):
+    book = serializers.PrimaryKeyRelatedField(read_only=True)
+    location = serializers.CharField(source='branch.name', max_length=255)
+
+    class Meta:
+        model = AvailableBook
+        fields = ['id', 'book', 'branch', 'location']
+        read_only_fields = ['branch']
+        list_serializer_class = AvailableBookListSerializer
+
+
+class BranchSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=255)
+    total_copies = serializers.IntegerField(read_only=True)
+    available_copies = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Branch
+        fields = ['id', 'name', 'total_copies', 'available_copies']
+
+    def validate_name(self, value):
+        # Checked after normalizing, so 'Main' and ' Main ' count as the same branch.
+        value = normalize_branch_name(value)
+        if not value:
+            raise serializers.ValidationError('This field may not be blank.')
+        if Branch.objects.filter(name=value).exclude(pk=getattr(self.instance, 'pk', None)).exists():
+            raise serializers.ValidationError('A branch with this name already exists.')
+        return value
+
+
+class BranchInventorySerializer(serializers.Serializer):
+    book = serializers.IntegerField()
+    title = serializers.CharField()
+    author = serializers.CharField()
+    copies = serializers.IntegerField()
+    available_copies = serializers.IntegerField()
+
+
+class BorrowReadSerializer(SparseFieldsetMixin, ExpandableFieldsMixin, serializers.ModelSerializer):
     user = CustomUserSerializer(read_only=True)
     available_book = AvailableBookReadSerializer(read_only=True)
+    expandable_fields = ('user', 'available_book')
 
     class Meta:
         model = Borrow
@@ -84,20 +212,163 @@ class BorrowWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Borrow
         fields = ['id', 'user', 'available_book', 'borrow_date', 'return_date', 'date_returned']
+        validators = []
+
+    def check_out(self, available_book, user):
+        if AvailableBook.objects.filter(pk=available_book.pk).check_out():
+            Hold.objects.filter(book_id=available_book.book_id, user=user, status=Hold.WAITING).fulfill()
+            return
+        # A copy on the hold shelf is already marked out; only its holder can borrow it.
+        if not Hold.objects.filter(assigned_copy=available_book, user=user, status=Hold.READY).fulfill():
+            raise Conflict('This book is currently borrowed.')
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                if validated_data.get('date_returned') is None:
+                    self.check_out(validated_data['available_book'], validated_data['user'])
+                return super().create(validated_data)
+        except IntegrityError:
+            raise Conflict('This book is currently borrowed.')
+
+    def update(self, instance, validated_data):
+        available_book = validated_data.get('available_book', instance.available_book)
+        is_open = validated_data.get('date_returned', instance.date_returned) is None
+        was_open = instance.date_returned is None and instance.available_book_id == available_book.pk
+        try:
+            with transaction.atomic():
+                if is_open and not was_open:
+                    self.check_out(available_book, validated_data.get('user', instance.user))
+                return super().update(instance, validated_data)
+        except IntegrityError:
+            raise Conflict('This book is currently borrowed.')
+
+
+class BorrowReturnSerializer(serializers.Serializer):
+    borrows = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+    date_returned = serializers.DateField(required=False)
+
+    def create(self, validated_data):
+        ids = validated_data['borrows']
+        date_returned = validated_data.get('date_returned') or timezone.localdate()
+        with transaction.atomic():
+            found = {
+                borrow_id: (returned, copy_id, book_id, user_id)
+                for borrow_id, returned, copy_id, book_id, user_id in Borrow.objects.select_for_update()
+                .filter(pk__in=ids)
+                .values_list('id', 'date_returned', 'available_book_id', 'available_book__book_id', 'user_id')
+            }
+            results, returning = [], {}
+            for borrow_id in ids:
+                if borrow_id not in found:
+                    results.append({'id': borrow_id, 'error': 'Not found.'})
+                elif borrow_id in returning:
+                    results.append({'id': borrow_id, 'error': 'Listed more than once.'})
+                elif found[borrow_id][0] is not None:
+                    results.append({'id': borrow_id, 'error': 'Already returned.'})
+                else:
+                    returning[borrow_id] = found[borrow_id]
+                    results.append({'id': borrow_id, 'date_returned': date_returned})
+            if returning:
+                # Queryset updates skip the post_save signals, so refresh counters, cached responses and the feed here.
+                copy_ids = {copy_id for _, copy_id, _, _ in returning.values()}
+                book_ids = {book_id for _, _, book_id, _ in returning.values()}
+                user_ids = {user_id for _, _, _, user_id in returning.values()}
+                Borrow.objects.filter(pk__in=returning).update(date_returned=date_returned, updated_at=Now())
+                AvailableBook.objects.filter(pk__in=copy_ids).refresh_checked_out()
+                # Returned copies go to the oldest waiting hold before the counters are refreshed.
+                user_ids.update(user_id for *_, user_id in assign_copies(copy_ids))
+                Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+                response_cache.invalidate(
+                    'books', *(f'book:{book_id}' for book_id in book_ids), *(f'user:{user_id}' for user_id in user_ids),
+                )
+                record_copy_events(AvailabilityEvent.RETURNED, copy_ids)
+        return results
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book = serializers.PrimaryKeyRelatedField(read_only=True)
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = Hold
+        fields = ['id', 'book', 'user', 'status', 'assigned_copy', 'created_at', 'ready_at', 'expires_at']
+        read_only_fields = ['status', 'assigned_copy', 'ready_at']
+
+    def validate_expires_at(self, value):
+        if value is not None and value <= timezone.now():
+            raise serializers.ValidationError('Must be in the future.')
+        return value
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                hold = super().create(validated_data)
+                # Normally every copy is out; one that is free goes straight to the queue.
+                free_copies = AvailableBook.objects.filter(book_id=hold.book_id, is_checked_out=False).values('pk')
+                assigned = assign_copies(free_copies)
+                if assigned:
+                    Book.objects.filter(pk=hold.book_id).refresh_copy_counts()
+        except IntegrityError:
+            raise Conflict('You already have an active hold on this book.')
+        if assigned:
+            invalidate_assignments(assigned)
+            hold.refresh_from_db()
+        return hold
+
+
+class BookReferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'author']
+
+
+class LoanSummarySerializer(serializers.ModelSerializer):
+    book = BookReferenceSerializer(source='available_book.book', read_only=True)
+    location = serializers.CharField(source='available_book.branch.name', read_only=True)
+    is_overdue = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Borrow
+        fields = ['id', 'book', 'available_book', 'location', 'borrow_date', 'return_date', 'date_returned', 'is_overdue']
+
+    def get_is_overdue(self, borrow):
+        return borrow.date_returned is None and borrow.return_date < self.context['today']
+
+
+class ReviewSummarySerializer(serializers.ModelSerializer):
+    book = BookReferenceSerializer(read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ['id', 'book', 'rating', 'comment', 'updated_at']
+
+
+class AccountSummarySerializer(serializers.Serializer):
+    user = CustomUserSerializer(read_only=True)
+    open_loans = LoanSummarySerializer(many=True, read_only=True)
+    overdue_count = serializers.IntegerField(read_only=True)
+    recent_loans = LoanSummarySerializer(many=True, read_only=True)
+    reviews = ReviewSummarySerializer(many=True, read_only=True)
+
+
+class ReportParamsSerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    as_of = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=10_000, default=100)
 
     def validate(self, data):
-        if self.context['request'].method == 'POST':
-            if Borrow.objects.filter(
-                available_book=data['available_book'],
-                date_returned__isnull=True
-            ).exists():
-                raise serializers.ValidationError('This book is currently borrowed.')
+        if data.get('since') and data.get('until') and data['since'] > data['until']:
+            raise serializers.ValidationError('since must not be after until.')
+        data.setdefault('as_of', timezone.localdate())
         return data
 
 
-class ReviewReadSerializer(serializers.ModelSerializer):
+class ReviewReadSerializer(SparseFieldsetMixin, ExpandableFieldsMixin, serializers.ModelSerializer):
     user = CustomUserSerializer(read_only=True)
     book = BookSerializer(read_only=True)
+    expandable_fields = ('user', 'book')
 
     class Meta:
         model = Review
@@ -108,3 +379,11 @@ class ReviewWriteSerializer(serializers.ModelSerializer):
         model = Review
         fields = ['book', 'rating', 'comment']
 
+    @transaction.atomic
+    def create(self, validated_data):
+        return super().create(validated_data)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        return super().update(instance, validated_data)
+
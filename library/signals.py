@@ -0,0 +1,261 @@
+from django.db import connections, transaction
+from django.db.models import Min
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .cache import response_cache
+from .feed import record_copy_events, record_copy_removed
+from .holds import assign_copies, invalidate_assignments, release_copies
+from .models import (
+    AvailabilityEvent, AvailableBook, Book, Borrow, Branch, CustomUser, Hold, Review, StaleCirculation,
+)
+from .previews import preview_digest, schedule_variants
+from .search import install_search_index
+
+
+def _previous_value(sender, instance, *fields):
+    if instance._state.adding:
+        return None
+    values = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    if values is None or len(fields) > 1:
+        return values
+    return values[0]
+
+
+@receiver(pre_save, sender=AvailableBook)
+def remember_previous_book(sender, instance, **kwargs):
+    instance._previous_book_id = _previous_value(sender, instance, 'book_id')
+
+
+@receiver(pre_save, sender=Borrow)
+def remember_previous_copy(sender, instance, **kwargs):
+    previous = _previous_value(
+        sender, instance, 'available_book_id', 'date_returned', 'available_book__book_id', 'borrow_date',
+    ) or (None, None, None, None)
+    instance._previous_available_book_id, instance._previous_date_returned, *instance._previous_counted_as = previous
+
+
+@receiver(pre_save, sender=Hold)
+def remember_previous_assignment(sender, instance, **kwargs):
+    instance._previous_assignment = _previous_value(sender, instance, 'status', 'assigned_copy_id')
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = _previous_value(sender, instance, 'book_id', 'rating')
+
+
+@receiver(post_save, sender=AvailableBook)
+@receiver(post_delete, sender=AvailableBook)
+def refresh_book_copy_counts(sender, instance, **kwargs):
+    book_ids = {instance.book_id, getattr(instance, '_previous_book_id', None)} - {None}
+    Book.objects.filter(pk__in=book_ids).refresh_copy_counts()
+
+
+@receiver(post_save, sender=Borrow)
+@receiver(post_delete, sender=Borrow)
+def refresh_copy_checkout(sender, instance, **kwargs):
+    copy_ids = {instance.available_book_id, getattr(instance, '_previous_available_book_id', None)} - {None}
+    AvailableBook.objects.filter(pk__in=copy_ids).refresh_checked_out()
+    Book.objects.filter(available_books__in=copy_ids).refresh_copy_counts()
+
+
+@receiver(post_save, sender=Borrow)
+def mark_recounted_loan(sender, instance, created, **kwargs):
+    if created:
+        return
+    book_id, borrow_date = instance._previous_counted_as
+    if borrow_date == instance.borrow_date and (
+        instance._previous_available_book_id == instance.available_book_id or book_id == instance.available_book.book_id
+    ):
+        return
+    StaleCirculation.objects.create(book_id=book_id, day=borrow_date)
+
+
+@receiver(post_delete, sender=Borrow)
+def mark_deleted_loan(sender, instance, **kwargs):
+    book_id = AvailableBook.objects.filter(pk=instance.available_book_id).values_list('book_id', flat=True).first()
+    if book_id is not None:
+        StaleCirculation.objects.create(book_id=book_id, day=instance.borrow_date)
+
+
+@receiver(post_save, sender=AvailableBook)
+def mark_moved_copy_loans(sender, instance, created, **kwargs):
+    # The loans themselves are unchanged, so both books are recounted from the copy's first loan.
+    if created or instance._previous_book_id == instance.book_id:
+        return
+    first_day = instance.borrows.aggregate(first=Min('borrow_date'))['first']
+    if first_day is not None:
+        StaleCirculation.objects.bulk_create(
+            StaleCirculation(book_id=book_id, day=first_day) for book_id in (instance._previous_book_id, instance.book_id)
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_book_ratings(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous == (instance.book_id, instance.rating):
+        return
+    if previous is not None:
+        book_id, rating = previous
+        Book.objects.filter(pk=book_id).apply_review(rating, -1)
+    Book.objects.filter(pk=instance.book_id).apply_review(instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_book_rating(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.book_id).apply_review(instance.rating, -1)
+
+
+@receiver(post_save, sender=Book)
+def schedule_preview_variants(sender, instance, **kwargs):
+    name = instance.preview_image.name
+    digest = preview_digest(name)
+    if digest and digest != instance.preview_hash:
+        transaction.on_commit(lambda: schedule_variants(instance.pk, name))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_responses(sender, instance, **kwargs):
+    response_cache.invalidate('books', f'book:{instance.pk}')
+
+
+@receiver(post_save, sender=AvailableBook)
+@receiver(post_delete, sender=AvailableBook)
+def invalidate_copy_responses(sender, instance, **kwargs):
+    book_ids = {instance.book_id, getattr(instance, '_previous_book_id', None)} - {None}
+    response_cache.invalidate('books', *(f'book:{book_id}' for book_id in book_ids))
+
+
+@receiver(post_save, sender=Branch)
+def invalidate_branch_responses(sender, instance, created, **kwargs):
+    # Branch names are embedded in every cached copy listing; renames are rare enough to drop them all.
+    if not created:
+        response_cache.invalidate_all()
+
+
+@receiver(post_save, sender=Borrow)
+@receiver(post_delete, sender=Borrow)
+def invalidate_borrow_responses(sender, instance, **kwargs):
+    copy_ids = {instance.available_book_id, getattr(instance, '_previous_available_book_id', None)} - {None}
+    book_ids = AvailableBook.objects.filter(pk__in=copy_ids).values_list('book_id', flat=True)
+    response_cache.invalidate('books', f'user:{instance.user_id}', *(f'book:{book_id}' for book_id in book_ids))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_responses(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    book_ids = {instance.book_id, previous[0] if previous else None} - {None}
+    response_cache.invalidate(
+        'books', f'user:{instance.user_id}',
+        *(scope for book_id in book_ids for scope in (f'book:{book_id}', f'book:{book_id}:reviews')),
+    )
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_responses(sender, instance, **kwargs):
+    response_cache.invalidate('users', f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_cached_credentials(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def _assign_freed_copies(copy_ids):
+    assigned = assign_copies(copy_ids)
+    if assigned:
+        Book.objects.filter(pk__in={book_id for _, _, book_id, _ in assigned}).refresh_copy_counts()
+        invalidate_assignments(assigned)
+
+
+@receiver(post_save, sender=Borrow)
+def assign_returned_copy(sender, instance, created, **kwargs):
+    if created:
+        return
+    freed = set()
+    if instance.date_returned is not None and instance._previous_date_returned is None:
+        freed.add(instance.available_book_id)
+    if instance._previous_available_book_id != instance.available_book_id and instance._previous_date_returned is None:
+        freed.add(instance._previous_available_book_id)
+    if freed:
+        _assign_freed_copies(freed)
+
+
+@receiver(post_delete, sender=Borrow)
+def assign_copy_of_deleted_borrow(sender, instance, **kwargs):
+    if instance.date_returned is None:
+        _assign_freed_copies([instance.available_book_id])
+
+
+@receiver(post_save, sender=AvailableBook)
+def assign_added_copy(sender, instance, created, **kwargs):
+    if created:
+        _assign_freed_copies([instance.pk])
+
+
+@receiver(pre_delete, sender=AvailableBook)
+def requeue_holds_for_deleted_copy(sender, instance, **kwargs):
+    # The hold keeps its place in line and waits for the next copy.
+    Hold.objects.filter(assigned_copy=instance, status=Hold.READY).update(
+        status=Hold.WAITING, assigned_copy=None, ready_at=None, expires_at=None, updated_at=Now(),
+    )
+
+
+# cancel_hold() and expire_holds() release copies themselves; these catch holds edited or deleted directly,
+# including when their user or book is deleted.
+@receiver(post_save, sender=Hold)
+def release_reassigned_hold_copy(sender, instance, created, **kwargs):
+    status, copy_id = instance._previous_assignment or (None, None)
+    if status == Hold.READY and copy_id is not None and (instance.status, instance.assigned_copy_id) != (status, copy_id):
+        release_copies([copy_id])
+
+
+@receiver(post_delete, sender=Hold)
+def release_deleted_hold_copy(sender, instance, **kwargs):
+    if instance.status == Hold.READY and instance.assigned_copy_id is not None:
+        release_copies([instance.assigned_copy_id])
+
+
+# Registered after the counter and hold receivers above, so events carry the refreshed availability.
+@receiver(post_save, sender=Borrow)
+def record_borrow_event(sender, instance, created, **kwargs):
+    if created and instance.date_returned is None:
+        record_copy_events(AvailabilityEvent.BORROWED, [instance.available_book_id])
+    elif not created and instance.date_returned is not None and instance._previous_date_returned is None:
+        record_copy_events(AvailabilityEvent.RETURNED, [instance.available_book_id])
+
+
+@receiver(post_delete, sender=Borrow)
+def record_open_borrow_deleted(sender, instance, **kwargs):
+    if instance.date_returned is None:
+        record_copy_events(AvailabilityEvent.RETURNED, [instance.available_book_id])
+
+
+@receiver(post_save, sender=AvailableBook)
+def record_copy_added(sender, instance, created, **kwargs):
+    if created:
+        record_copy_events(AvailabilityEvent.COPY_ADDED, [instance.pk])
+
+
+@receiver(post_delete, sender=AvailableBook)
+def record_copy_deleted(sender, instance, **kwargs):
+    record_copy_removed(instance)
+
+
+def ensure_search_index(sender, using, **kwargs):
+    # SQLite drops triggers when a migration rebuilds library_book, so reinstall them.
+    install_search_index(connections[using])
@@ -0,0 +1,295 @@
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import CachedTokenAuthentication
+from .circulation import refresh_snapshots
+from .instrumentation import InstrumentationMiddleware, measure
+from .models import AvailableBook, Book, Borrow, Branch, CustomUser
+from .seeding import WORDS
+from .views import BookViewSet
+
+run_benchmarks = skipUnless(os.environ.get('LIBRARY_BENCHMARKS'), 'set LIBRARY_BENCHMARKS=1 to run benchmarks')
+
+
+def timed(callable_, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        callable_()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+@run_benchmarks
+class SearchBenchmark(TestCase):
+    books = int(os.environ.get('LIBRARY_BENCHMARK_BOOKS', 100_000))
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        Book.objects.bulk_create(
+            (
+                Book(
+                    title=' '.join(rng.choices(WORDS, k=3)).title(),
+                    author=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+                    genre=rng.choice(['Fantasy', 'Mystery', 'History', 'Poetry']),
+                    description=' '.join(rng.choices(WORDS, k=40)),
+                )
+                for _ in range(cls.books)
+            ),
+            batch_size=5000,
+        )
+
+    def test_search_latency(self):
+        client = APIClient()
+        print(f'\nSearch over {self.books} books (ms, median / p95):')
+        for query in ('dragon', 'silver storm', 'lant', 'fantasy harbor wolf'):
+            median, p95 = timed(lambda: client.get('/api/books', {'q': query}), repeat=20)
+            print(f'  q={query!r:24} {median:8.2f} / {p95:8.2f}')
+        median, p95 = timed(lambda: Book.objects.filter(description__icontains='lant').count(), repeat=20)
+        print(f'  {"icontains scan, for scale":26} {median:8.2f} / {p95:8.2f}')
+
+
+@run_benchmarks
+class TokenAuthenticationBenchmark(TestCase):
+    requests = 500
+
+    def test_queries_per_authenticated_request(self):
+        user = CustomUser.objects.create_user(username='reader', password='pw')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        Book.objects.create(title='Emma', author='Austen')
+        print(f'\nGET /api/books with a token, {self.requests} requests (served from the response cache):')
+        for authentication in (TokenAuthentication, CachedTokenAuthentication):
+            cache.clear()
+            with mock.patch.object(BookViewSet, 'authentication_classes', [authentication]):
+                client.get('/api/books')
+                with CaptureQueriesContext(connection) as queries:
+                    median, p95 = timed(lambda: client.get('/api/books'), repeat=self.requests)
+            print(
+                f'  {authentication.__name__:28} {len(queries) / self.requests:.2f} queries/request, '
+                f'{median:.3f} / {p95:.3f} ms median / p95'
+            )
+
+
+@run_benchmarks
+class InstrumentationOverheadBenchmark(TestCase):
+    requests = 1000
+
+    def test_request_overhead(self):
+        books = Book.objects.bulk_create(Book(title=f'Book {n}', author='Anonymous') for n in range(50))
+        client = APIClient()
+        cases = [
+            ('cached list', '/api/books', {}),
+            ('uncached list', '/api/books', {'LIBRARY_RESPONSE_CACHE': {'ENABLED': False}}),
+            ('uncached detail', f'/api/books/{books[0].id}', {'LIBRARY_RESPONSE_CACHE': {'ENABLED': False}}),
+        ]
+        print(f'\nInstrumentation overhead, {self.requests} requests each (ms, median / p95):')
+        for label, url, overrides in cases:
+            results = {}
+            for enabled in (False, True):
+                with override_settings(LIBRARY_INSTRUMENTATION={'ENABLED': enabled}, **overrides):
+                    cache.clear()
+                    client.get(url)
+                    results[enabled] = timed(lambda: client.get(url), repeat=self.requests)
+            overhead = (results[True][0] - results[False][0]) * 1000
+            print(
+                f'  {label:16} off {results[False][0]:.3f} / {results[False][1]:.3f}  '
+                f'on {results[True][0]:.3f} / {results[True][1]:.3f}  ({overhead:+.0f} us median)'
+            )
+
+        # End-to-end differences are within run-to-run noise, so also time the middleware and query hook alone.
+        request = RequestFactory().get('/api/books')
+        request.resolver_match = resolve('/api/books')
+        response = HttpResponse(b'x' * 4096)
+        middleware = InstrumentationMiddleware(lambda request: response)
+        median, _ = timed(lambda: middleware(request), repeat=self.requests)
+        print(f'  middleware alone {median * 1000:.1f} us per request')
+        with connection.cursor() as cursor:
+            plain, _ = timed(lambda: cursor.execute('SELECT 1'), repeat=self.requests)
+            with measure():
+                hooked, _ = timed(lambda: cursor.execute('SELECT 1'), repeat=self.requests)
+        print(f'  query hook       {(hooked - plain) * 1000:+.1f} us per query')
+
+
+@run_benchmarks
+class CheckoutThroughputBenchmark(TransactionTestCase):
+    threads = 8
+    copies = 10
+    attempts_per_copy = 4
+
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+        shelf = Branch.objects.create(name='Main')
+        self.copy_ids = [AvailableBook.objects.create(book=self.book, branch=shelf).id for _ in range(self.copies)]
+
+    def attempt_checkout(self, copy_id):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        try:
+            return client.post(f'/api/books/{self.book.id}/available-books/{copy_id}/borrows', {
+                'user': self.staff.id, 'available_book': copy_id,
+                'borrow_date': date.today(), 'return_date': date.today() + timedelta(days=7),
+            }).status_code
+        finally:
+            connection.close()
+
+    def test_contended_checkouts(self):
+        attempts = [copy_id for copy_id in self.copy_ids for _ in range(self.attempts_per_copy)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            statuses = list(pool.map(self.attempt_checkout, attempts))
+        elapsed = time.perf_counter() - started
+        self.assertEqual(statuses.count(201), self.copies)
+        print(f'\n{len(attempts)} checkout attempts, {len(attempts) / elapsed:.1f} checkouts/sec')
+
+
+@run_benchmarks
+class DatabaseConcurrencyBenchmark(TransactionTestCase):
+    writers = 8
+    readers = 8
+    duration = float(os.environ.get('LIBRARY_BENCHMARK_SECONDS', 5))
+    sqlite_profiles = {
+        'rollback journal, deferred transactions': ({}, 'DELETE'),
+        'WAL, synchronous=NORMAL, busy timeout, IMMEDIATE': (None, 'WAL'),
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+        shelf = Branch.objects.create(name='Main')
+        self.copies = [AvailableBook.objects.create(book=self.book, branch=shelf) for _ in range(self.writers)]
+
+    def write(self, client, copy):
+        url = f'/api/books/{self.book.id}/available-books/{copy.id}/borrows'
+        response = client.post(url, {
+            'user': self.staff.id, 'available_book': copy.id,
+            'borrow_date': date.today(), 'return_date': date.today() + timedelta(days=7),
+        })
+        if response.status_code == 201:
+            client.patch(f"{url}/{response.data['id']}", {'date_returned': date.today()})
+
+    def read(self, client, _):
+        client.get(f'/api/books/{self.book.id}/available-books')
+        client.get('/api/borrows', {'user': 'me'})
+
+    def run_workload(self):
+        counts = {'writes': 0, 'reads': 0, 'lock errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + self.duration
+
+        def worker(operation, kind, copy):
+            client = APIClient()
+            client.force_authenticate(self.staff)
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        operation(client, copy)
+                        outcome = kind
+                    except OperationalError:
+                        outcome = 'lock errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        jobs = [(self.write, 'writes', copy) for copy in self.copies] + [(self.read, 'reads', None)] * self.readers
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            list(pool.map(lambda job: worker(*job), jobs))
+        return counts
+
+    def report(self, profile, counts):
+        print(
+            f'  {profile:52} {counts["writes"] / self.duration:8.1f} borrow+return/s '
+            f'{counts["reads"] / self.duration:8.1f} reads/s {counts["lock errors"]:6} lock errors'
+        )
+
+    def test_parallel_borrow_return_writers_and_readers(self):
+        print(f'\n{self.writers} writers, {self.readers} readers for {self.duration:.0f}s on {connection.vendor}:')
+        if connection.vendor != 'sqlite':
+            self.report(connection.settings_dict['ENGINE'].rsplit('.', 1)[-1], self.run_workload())
+            return
+        configured = connections.settings['default']
+        for profile, (options, journal_mode) in self.sqlite_profiles.items():
+            with mock.patch.dict(configured, {'OPTIONS': configured['OPTIONS'] if options is None else options}):
+                connection.close()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+                self.report(profile, self.run_workload())
+        connection.close()
+
+
+@run_benchmarks
+class ReportingBenchmark(TestCase):
+    borrows = int(os.environ.get('LIBRARY_BENCHMARK_BORROWS', 1_000_000))
+    users = 5_000
+    copies = 20_000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        cls.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f'reader{n}', password='!') for n in range(cls.users)
+        )
+        books = Book.objects.bulk_create(
+            (Book(title=' '.join(rng.choices(WORDS, k=3)).title(), author='Anonymous') for _ in range(cls.copies // 4)),
+            batch_size=5000,
+        )
+        branches = Branch.objects.bulk_create(Branch(name=f'Branch {n}') for n in range(12))
+        copies = AvailableBook.objects.bulk_create(
+            (AvailableBook(book=rng.choice(books), branch=rng.choice(branches)) for _ in range(cls.copies)),
+            batch_size=5000,
+        )
+        today = date.today()
+
+        def borrow(n):
+            borrowed = today - timedelta(days=rng.randrange(3 * 365))
+            due = borrowed + timedelta(days=14)
+            # Every copy has at most one open loan; everything else is returned, some late.
+            returned = None if n < len(copies) // 5 else borrowed + timedelta(days=rng.randrange(1, 25))
+            return Borrow(
+                user=rng.choice(users), available_book=copies[n % len(copies)],
+                borrow_date=borrowed, return_date=due, date_returned=returned,
+            )
+
+        Borrow.objects.bulk_create((borrow(n) for n in range(cls.borrows)), batch_size=10_000)
+        refresh_snapshots()
+
+    def test_report_latency(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        since = (date.today() - timedelta(days=90)).isoformat()
+        cases = [
+            ('overdue', {}),
+            ('overdue.csv', {}),
+            ('loans-per-user', {'since': since}),
+            ('most-borrowed', {}),
+            ('most-borrowed', {'since': since}),
+            ('utilization', {'since': since}),
+        ]
+        print(f'\nReports over {self.borrows} borrows (ms, median / p95, full streamed body):')
+        for path, params in cases:
+            median, p95 = timed(lambda: b''.join(client.get(f'/api/reports/{path}', params).streaming_content), repeat=5)
+            label = path + ('?' + '&'.join(f'{k}={v}' for k, v in params.items()) if params else '')
+            print(f'  {label:40} {median:10.2f} / {p95:10.2f}')
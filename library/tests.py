@@ -1,3 +1,1822 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .cache import response_cache
+from .circulation import refresh_snapshots
+from .feed import EventFilter, event_stream
+from .holds import cancel_hold
+from .instrumentation import measure, metrics_registry
+from .models import (
+    AvailabilityEvent, Book, AvailableBook, Borrow, Branch, DailyCirculation, Hold, Review, CustomUser, StaleCirculation,
+)
+from .routers import ReplicaRouter
+
+
+def shelf(name):
+    return Branch.objects.resolve([name])[name]
+
+
+def create_books(count, copies=2):
+    books = Book.objects.bulk_create(
+        Book(title=f'Book {i}', author=f'Author {i % 10}', isbn=f'{i:013d}') for i in range(count)
+    )
+    shelves = [shelf(f'Shelf {n}') for n in range(copies)]
+    copies = AvailableBook.objects.bulk_create(
+        AvailableBook(book=book, branch=branch) for book in books for branch in shelves
+    )
+    Book.objects.refresh_copy_counts()
+    return books, copies
+
+
+class AvailabilityQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='reader', password='pw')
+
+    def borrow(self, copy, returned=False):
+        return Borrow.objects.create(
+            user=self.user,
+            available_book=copy,
+            return_date=date.today() + timedelta(days=14),
+            date_returned=date.today() if returned else None,
+        )
+
+    def test_book_list_query_count_is_constant(self):
+        for count in (10, 100, 1000):
+            with self.subTest(count=count):
+                Book.objects.all().delete()
+                create_books(count)
+                with self.assertNumQueries(1):
+                    response = self.client.get('/api/books', {'page_size': count})
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_available_book_list_query_count_is_constant(self):
+        for count in (10, 100, 1000):
+            with self.subTest(count=count):
+                Book.objects.all().delete()
+                create_books(count)
+                with self.assertNumQueries(1):
+                    response = self.client.get('/api/available-books', {'page_size': count})
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_availability_reflects_open_borrows(self):
+        books, copies = create_books(2, copies=1)
+        self.borrow(copies[0])
+        self.borrow(copies[1], returned=True)
+
+        response = self.client.get('/api/books')
+        availability = {item['id']: item['is_available'] for item in response.data['results']}
+        self.assertEqual(availability, {books[0].id: False, books[1].id: True})
+
+        response = self.client.get(f'/api/books/{books[0].id}/available-books')
+        self.assertFalse(response.data['results'][0]['copy_is_available'])
+        self.assertFalse(response.data['results'][0]['book']['is_available'])
+
+
+class AvailabilityCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.client.force_authenticate(self.staff)
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+
+    def add_copy(self, location='Main'):
+        response = self.client.post(
+            f'/api/books/{self.book.id}/available-books', {'book': self.book.id, 'location': location}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def borrow(self, copy_id):
+        response = self.client.post(
+            f'/api/books/{self.book.id}/available-books/{copy_id}/borrows',
+            {
+                'user': self.staff.id, 'available_book': copy_id,
+                'borrow_date': date.today(), 'return_date': date.today() + timedelta(days=7),
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def assertCounters(self, total, available):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_copies, self.book.available_copies), (total, available))
+
+    def test_counters_follow_copies_and_borrows(self):
+        first = self.add_copy()
+        second = self.add_copy()
+        self.assertCounters(2, 2)
+
+        borrow_id = self.borrow(first)
+        self.assertCounters(2, 1)
+        self.assertTrue(AvailableBook.objects.get(pk=first).is_checked_out)
+
+        response = self.client.patch(
+            f'/api/books/{self.book.id}/available-books/{first}/borrows/{borrow_id}',
+            {'date_returned': date.today()},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertCounters(2, 2)
+        self.assertFalse(AvailableBook.objects.get(pk=first).is_checked_out)
+
+        self.borrow(second)
+        self.client.delete(f'/api/books/{self.book.id}/available-books/{second}')
+        self.assertCounters(1, 1)
+
+    def test_book_update_does_not_overwrite_counters(self):
+        copy_id = self.add_copy()
+        stale = Book.objects.get(pk=self.book.pk)
+        self.borrow(copy_id)
+        stale.title = 'Dune Messiah'
+        stale.save()
+        self.assertCounters(1, 0)
+
+    def test_rebuild_counters_command(self):
+        copy_id = self.add_copy()
+        self.borrow(copy_id)
+        AvailableBook.objects.update(is_checked_out=False)
+        Book.objects.update(total_copies=0, available_copies=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--verify', stdout=StringIO())
+
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCounters(1, 0)
+        call_command('rebuild_counters', '--verify', stdout=StringIO())
+
+
+class PaginationAndSparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        create_books(25, copies=1)
+
+    def test_cursor_pagination_walks_every_book_once(self):
+        seen = []
+        url = '/api/books?page_size=10'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, list(Book.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_fields_param_limits_serialized_fields(self):
+        response = self.client.get('/api/books', {'fields': 'id,title,is_available'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'is_available'})
+
+        response = self.client.get('/api/available-books', {'fields': 'id,location'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'location'})
+
+    def test_fields_param_is_ignored_on_writes(self):
+        staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.client.force_authenticate(staff)
+        response = self.client.post('/api/books?fields=id', {'title': 'Emma', 'author': 'Austen'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['title'], 'Emma')
+
+
+class NestedSerializerQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='reader', password='pw')
+        self.client.force_authenticate(self.user)
+        self.books, self.copies = create_books(100, copies=10)
+        Borrow.objects.bulk_create(
+            Borrow(user=self.user, available_book=copy, return_date=date.today(), date_returned=date.today())
+            for copy in self.copies
+        )
+        Review.objects.bulk_create(Review(user=self.user, book=book, rating=4) for book in self.books)
+
+    def test_borrow_lists_use_constant_queries(self):
+        book, copy = self.copies[0].book, self.copies[0]
+        for url in (
+            '/api/borrows?page_size=1000',
+            '/api/borrows?user=me&page_size=1000',
+            f'/api/books/{book.id}/available-books/{copy.id}/borrows',
+        ):
+            with self.subTest(url=url), self.assertNumQueries(1):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.client.get('/api/borrows?page_size=1000').data['results']), 1000)
+
+    def test_review_lists_use_constant_queries(self):
+        for url in (
+            '/api/reviews?page_size=1000',
+            '/api/reviews?user=me&page_size=1000',
+            f'/api/books/{self.books[0].id}/reviews',
+        ):
+            with self.subTest(url=url), self.assertNumQueries(1):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_expand_controls_nesting(self):
+        nested = self.client.get('/api/reviews').data['results'][0]
+        self.assertEqual(nested['book']['id'], self.books[0].id)
+
+        flat = self.client.get('/api/reviews', {'expand': ''}).data['results'][0]
+        self.assertEqual((flat['user'], flat['book']), (self.user.id, self.books[0].id))
+
+        partial = self.client.get('/api/borrows', {'expand': 'available_book'}).data['results'][0]
+        self.assertEqual(partial['user'], self.user.id)
+        self.assertEqual(partial['available_book']['book']['id'], self.books[0].id)
+
+
+class BookFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.books = Book.objects.bulk_create([
+            Book(title='Emma', author='Jane Austen', genre='Romance', language='English',
+                 published_date=date(1815, 12, 23), available_copies=1),
+            Book(title='Persuasion', author='Jane Austen', genre='Romance', language='English',
+                 published_date=date(1817, 12, 20)),
+            Book(title='Faust', author='Goethe', genre='Drama', language='German',
+                 published_date=date(1808, 1, 1), available_copies=2),
+        ])
+
+    def titles(self, **params):
+        response = self.client.get('/api/books', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.titles(genre='Romance'), ['Emma', 'Persuasion'])
+        self.assertEqual(self.titles(language='German'), ['Faust'])
+        self.assertEqual(self.titles(author='Jane Austen', published_after='1816-01-01'), ['Persuasion'])
+        self.assertEqual(self.titles(published_before='1815-12-31'), ['Emma', 'Faust'])
+        self.assertEqual(self.titles(is_available='true'), ['Emma', 'Faust'])
+        self.assertEqual(self.titles(is_available='false', genre='Romance'), ['Persuasion'])
+
+    def test_ordering(self):
+        self.assertEqual(self.titles(ordering='title'), ['Emma', 'Faust', 'Persuasion'])
+        self.assertEqual(self.titles(ordering='-published_date'), ['Persuasion', 'Emma', 'Faust'])
+        self.assertEqual(self.titles(ordering='author'), ['Faust', 'Emma', 'Persuasion'])
+
+    def test_cursor_pages_across_books_without_a_date(self):
+        undated = Book.objects.bulk_create(Book(title=f'Undated {n}', author='Anonymous') for n in range(3))
+        for ordering, expected in [
+            ('published_date', [*undated, self.books[2], self.books[0], self.books[1]]),
+            ('-published_date', [self.books[1], self.books[0], self.books[2], *undated]),
+        ]:
+            with self.subTest(ordering=ordering):
+                url, ids = f'/api/books?ordering={ordering}&page_size=2', []
+                while url:
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    ids += [item['id'] for item in response.data['results']]
+                    url = response.data['next']
+                self.assertEqual(ids, [book.id for book in expected])
+
+    def test_invalid_values_are_rejected(self):
+        self.assertEqual(self.client.get('/api/books', {'published_after': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/books', {'is_available': 'maybe'}).status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_filters_use_indexes(self):
+        cases = [
+            {'genre': 'Romance'},
+            {'language': 'English'},
+            {'author': 'Goethe'},
+            {'published_after': '1810-01-01', 'published_before': '1820-01-01'},
+            {'is_available': 'false'},
+            {'is_available': 'true', 'genre': 'Drama'},
+            {'genre': 'Romance', 'language': 'English', 'published_after': '1810-01-01'},
+            {'genre': 'Romance', 'published_before': '1816-01-01'},
+            {'language': 'German', 'ordering': 'published_date'},
+            {'author': 'Jane Austen', 'ordering': '-published_date'},
+            {'ordering': 'title'},
+        ]
+        for params in cases:
+            with self.subTest(params=params):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get('/api/books', params)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {queries[-1]["sql"]}')
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertTrue(any('USING INDEX' in step for step in plan), plan)
+                self.assertNotIn('SCAN library_book', plan)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    threads = 8
+    attempts_per_copy = 4
+
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+        self.copies = [AvailableBook.objects.create(book=self.book, branch=shelf(f'Shelf {n}')) for n in range(10)]
+
+    def attempt_checkout(self, copy):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        try:
+            return client.post(
+                f'/api/books/{self.book.id}/available-books/{copy.id}/borrows',
+                {
+                    'user': self.staff.id, 'available_book': copy.id,
+                    'borrow_date': date.today(), 'return_date': date.today() + timedelta(days=7),
+                },
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_checkouts_never_double_book(self):
+        attempts = [copy for copy in self.copies for _ in range(self.attempts_per_copy)]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            statuses = list(pool.map(self.attempt_checkout, attempts))
+
+        self.assertEqual(statuses.count(201), len(self.copies))
+        self.assertEqual(statuses.count(409), len(attempts) - len(self.copies))
+        for copy in self.copies:
+            self.assertEqual(copy.borrows.filter(date_returned__isnull=True).count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+    def test_conflicting_checkout_returns_409(self):
+        copy = self.copies[0]
+        self.assertEqual(self.attempt_checkout(copy), 201)
+        self.assertEqual(self.attempt_checkout(copy), 409)
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.dune = Book.objects.create(title='Dune', author='Frank Herbert', genre='Science Fiction')
+        self.hobbit = Book.objects.create(
+            title='The Hobbit', author='J. R. R. Tolkien', genre='Fantasy', description='A dragon and a dune buggy.'
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/books', {'q': query})
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranks_title_matches_above_description_matches(self):
+        self.assertEqual(self.search('dune'), [self.dune.id, self.hobbit.id])
+
+    def test_prefix_matching_for_typeahead(self):
+        self.assertEqual(self.search('tolk'), [self.hobbit.id])
+        self.assertEqual(self.search('science fic'), [self.dune.id])
+        self.assertEqual(self.search('"*)('), [])
+
+    def test_index_follows_api_writes(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.post('/api/books', {'title': 'Emma', 'author': 'Jane Austen'})
+        emma_id = response.data['id']
+        self.assertEqual(self.search('austen'), [emma_id])
+
+        self.client.patch(f'/api/books/{emma_id}', {'author': 'J. Austen', 'genre': 'Romance'})
+        self.assertEqual(self.search('romance'), [emma_id])
+
+        self.client.delete(f'/api/books/{emma_id}')
+        self.assertEqual(self.search('austen'), [])
+
+    def test_search_results_paginate_by_rank(self):
+        Book.objects.bulk_create(Book(title=f'Dune {n}', author='Herbert') for n in range(15))
+        seen, url = [], '/api/books?q=dune&page_size=4'
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 17)
+        self.assertEqual(len(set(seen)), 17)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.books, self.copies = create_books(2, copies=1)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        hits = response_cache.hits
+        first = self.client.get('/api/books')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/books')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(response_cache.hits, hits + 1)
+
+        self.client.get('/api/books', {'fields': 'id'})
+        self.assertEqual(response_cache.hits, hits + 1)
+
+    def test_writes_invalidate_only_affected_keys(self):
+        first, second = self.books
+        for book in self.books:
+            self.client.get(f'/api/books/{book.id}')
+            self.client.get(f'/api/books/{book.id}/available-books')
+
+        self.client.force_authenticate(self.staff)
+        self.client.patch(f'/api/books/{first.id}', {'title': 'Renamed'})
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get(f'/api/books/{first.id}').data['title'], 'Renamed')
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/books/{second.id}')
+            self.client.get(f'/api/books/{second.id}/available-books')
+
+        Borrow.objects.create(user=self.staff, available_book=self.copies[1], return_date=date.today())
+        response = self.client.get(f'/api/books/{second.id}/available-books')
+        self.assertFalse(response.data['results'][0]['copy_is_available'])
+
+    def test_admin_and_review_writes_invalidate(self):
+        book = self.books[0]
+        url = f'/api/books/{book.id}/reviews'
+        self.assertEqual(len(self.client.get(url).data['results']), 0)
+        Review.objects.create(user=self.staff, book=book, rating=5)
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+        self.staff.username = 'librarian'
+        self.staff.save()
+        self.assertEqual(self.client.get(url).data['results'][0]['user']['username'], 'librarian')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'library.cache.LRULocMemCache', 'LOCATION': 'lru-test', 'OPTIONS': {'MAX_ENTRIES': 4}},
+    })
+    def test_lru_bound_counts_evictions(self):
+        evictions = response_cache.backend.evictions
+        for book in self.books:
+            self.client.get(f'/api/books/{book.id}')
+            self.client.get(f'/api/books/{book.id}/available-books')
+        self.assertGreater(response_cache.backend.evictions, evictions)
+        self.assertLessEqual(len(response_cache.backend._cache), 4)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'plain-test'},
+    })
+    def test_works_with_other_cache_backends(self):
+        self.client.get('/api/books')
+        with self.assertNumQueries(0):
+            self.client.get('/api/books')
+        self.assertIsNone(response_cache.stats()['evictions'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='reader', password='pw')
+        self.books, self.copies = create_books(3, copies=2)
+        self.book = self.books[0]
+        Review.objects.create(user=self.user, book=self.book, rating=3)
+
+    def revalidate(self, url, response):
+        # Past the response cache, but keeping its scope versions, which list validators include.
+        with override_settings(LIBRARY_RESPONSE_CACHE={**settings.LIBRARY_RESPONSE_CACHE, 'ENABLED': False}):
+            with CaptureQueriesContext(connection) as queries:
+                revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        return revalidated, queries
+
+    def test_unchanged_resources_return_304_with_one_query(self):
+        for url in (
+            f'/api/books/{self.book.id}',
+            '/api/books?genre=',
+            f'/api/books/{self.book.id}/available-books',
+            f'/api/books/{self.book.id}/available-books/{self.copies[0].id}',
+            f'/api/books/{self.book.id}/reviews',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                revalidated, queries = self.revalidate(url, response)
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertLessEqual(len(queries), 1)
+                self.assertNotIn('JOIN "library_borrow"', queries[0]['sql'])
+
+    def test_cached_responses_revalidate_without_queries(self):
+        url = f'/api/books/{self.book.id}'
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_availability_change_produces_new_etag(self):
+        url = f'/api/books/{self.book.id}/available-books'
+        response = self.client.get(url)
+        Borrow.objects.create(user=self.user, available_book=self.copies[0], return_date=date.today())
+        revalidated, _ = self.revalidate(url, response)
+        self.assertEqual(revalidated.status_code, 200)
+        self.assertNotEqual(revalidated['ETag'], response['ETag'])
+
+        detail = self.client.get(f'/api/books/{self.book.id}')
+        self.book.title = 'Renamed'
+        self.book.save()
+        revalidated, _ = self.revalidate(f'/api/books/{self.book.id}', detail)
+        self.assertEqual(revalidated.status_code, 200)
+
+    def test_list_etag_tracks_deletions(self):
+        response = self.client.get('/api/books')
+        self.books[2].delete()
+        revalidated, _ = self.revalidate('/api/books', response)
+        self.assertEqual(revalidated.status_code, 200)
+
+    def test_if_modified_since(self):
+        url = f'/api/books/{self.book.id}'
+        response = self.client.get(url)
+        cache.clear()
+        revalidated = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+
+
+class RatingStatisticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        self.book, self.other = Book.objects.create(title='Emma', author='Austen'), Book.objects.create(title='Dune', author='Herbert')
+
+    def review(self, rating, user=None, book=None):
+        self.client.force_authenticate(user or self.reader)
+        book = book or self.book
+        response = self.client.post(f'/api/books/{book.id}/reviews', {'book': book.id, 'rating': rating})
+        self.assertEqual(response.status_code, 201)
+        return Review.objects.latest('id')
+
+    def stats(self, book=None):
+        data = self.client.get(f'/api/books/{(book or self.book).id}').data
+        return data['review_count'], data['average_rating'], data['rating_histogram']
+
+    def test_statistics_follow_review_writes(self):
+        five = self.review(5)
+        self.review(2, user=self.staff)
+        self.assertEqual(self.stats(), (2, 3.5, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+
+        self.client.force_authenticate(self.staff)
+        self.client.patch(f'/api/books/{self.book.id}/reviews/{five.id}', {'rating': 4})
+        self.assertEqual(self.stats(), (2, 3.0, {'1': 0, '2': 1, '3': 0, '4': 1, '5': 0}))
+
+        self.client.delete(f'/api/books/{self.book.id}/reviews/{five.id}')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.stats(), (1, 2.0, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0}))
+
+        Review.objects.all().delete()
+        self.assertEqual(self.stats()[:2], (0, 0.0))
+
+    def test_min_rating_filter_and_ordering(self):
+        self.review(3)
+        self.review(5, book=self.other)
+        self.client.force_authenticate(None)
+
+        response = self.client.get('/api/books', {'min_rating': 4})
+        self.assertEqual([item['title'] for item in response.data['results']], ['Dune'])
+
+        response = self.client.get('/api/books', {'ordering': '-average_rating'})
+        self.assertEqual([item['title'] for item in response.data['results']], ['Dune', 'Emma'])
+
+    def test_rebuild_ratings_command(self):
+        self.review(4)
+        Book.objects.update(review_count=9, average_rating=1.0, rating_4_count=0)
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertEqual(self.stats(), (1, 4.0, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0}))
+
+
+class BulkImportExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        Book.objects.create(title='Old title', author='Austen', isbn='1111111111')
+
+    def post_bulk(self, body, content_type, **params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.generic('POST', f'/api/books/bulk?{query}', body, content_type=content_type)
+
+    def test_csv_import_upserts_and_reports_row_errors(self):
+        body = (
+            'title,author,isbn,published_date,genre\n'
+            'Emma,Austen,1111111111,1815-12-23,Novel\n'
+            'Dune,Herbert,2222222222,,Science fiction\n'
+            ',Nobody,3333333333,,\n'
+            'Dune again,Herbert,2222222222,,\n'
+            'Untitled,Anonymous,,not-a-date,\n'
+        )
+        self.client.force_authenticate(self.staff)
+        self.client.get('/api/books')
+        # One ISBN lookup, one insert and one bulk update for the whole chunk, plus the savepoint pair.
+        with self.assertNumQueries(5):
+            response = self.post_bulk(body, 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 5])
+        self.assertIn('title', response.data['errors'][0]['errors'])
+        self.assertEqual(Book.objects.get(isbn='1111111111').title, 'Emma')
+        self.assertEqual(Book.objects.get(isbn='2222222222').genre, 'Science fiction')
+        self.assertEqual(self.client.get('/api/books').data['results'][0]['title'], 'Emma')
+
+    def test_partial_reimport_keeps_the_columns_it_leaves_out(self):
+        Book.objects.filter(isbn='1111111111').update(
+            description='A novel.', genre='Romance', language='English', published_date=date(1815, 12, 23),
+        )
+        body = 'title,author,isbn,genre\nEmma,Austen,1111111111,\n'
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.post_bulk(body, 'text/csv').data['updated'], 1)
+        response = self.post_bulk('{"isbn": "1111111111", "title": "Emma", "author": "Jane Austen"}\n', 'application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['updated']), (0, 1))
+        book = Book.objects.get(isbn='1111111111')
+        self.assertEqual((book.title, book.author), ('Emma', 'Jane Austen'))
+        self.assertEqual(
+            (book.description, book.genre, book.language, book.published_date),
+            ('A novel.', 'Romance', 'English', date(1815, 12, 23)),
+        )
+
+    def test_jsonl_import_can_skip_existing(self):
+        body = '{"title": "Emma", "author": "Austen", "isbn": "1111111111"}\n{"title": "Dune", "author": "Herbert"}\nnot json\n'
+        self.client.force_authenticate(self.staff)
+        response = self.post_bulk(body, 'application/x-ndjson', on_conflict='skip')
+        self.assertEqual((response.data['created'], response.data['skipped']), (1, 1))
+        self.assertEqual([error['row'] for error in response.data['errors']], [3])
+        self.assertEqual(Book.objects.get(isbn='1111111111').title, 'Old title')
+
+    def test_bulk_import_is_staff_only_and_checks_format(self):
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.post_bulk('title\nEmma\n', 'text/csv').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.post_bulk('<books/>', 'application/xml').status_code, 415)
+
+    def test_import_command_and_streaming_export(self):
+        create_books(3, copies=1)
+        path = f'{settings.BASE_DIR}/test_import.jsonl'
+        with open(path, 'w') as handle:
+            handle.write('{"title": "Emma", "author": "Austen", "isbn": "4444444444"}\n')
+        try:
+            call_command('import_books', path, stdout=StringIO(), stderr=StringIO())
+        finally:
+            os.remove(path)
+        self.assertTrue(Book.objects.filter(isbn='4444444444').exists())
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/export/books.csv')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,author,published_date,genre,isbn,description,language')
+        self.assertEqual(len(lines), Book.objects.count() + 1)
+
+        response = self.client.get('/api/export/copies.jsonl')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 3)
+        self.assertEqual({record['location'] for record in records}, {'Shelf 0'})
+        self.assertEqual(
+            {record['branch_id'] for record in records}, set(Branch.objects.filter(name='Shelf 0').values_list('id', flat=True)),
+        )
+        self.assertEqual(self.client.get('/api/export/users.csv').status_code, 404)
+
+        out = StringIO()
+        call_command('export_catalog', 'borrows', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['id,user_id,available_book_id,borrow_date,return_date,date_returned'])
+
+
+class BatchWriteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.client.force_authenticate(self.staff)
+        self.books, self.copies = create_books(2, copies=3)
+
+    def test_batch_create_copies_in_constant_queries(self):
+        book = self.books[0]
+        url = f'/api/books/{book.id}/available-books'
+        for size in (5, 50):
+            # Three resolve new branch names, one looks for waiting holds and two record the batch in the feed.
+            with self.assertNumQueries(11):
+                response = self.client.post(url, [{'location': f'Shelf {i}'} for i in range(size)], format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual([item['location'] for item in response.data], [f'Shelf {i}' for i in range(size)])
+            self.assertTrue(all(item['book'] == book.id for item in response.data))
+        book.refresh_from_db()
+        self.assertEqual((book.total_copies, book.available_copies), (58, 58))
+
+    def test_batch_create_rejects_whole_batch_with_ordered_errors(self):
+        url = f'/api/books/{self.books[0].id}/available-books'
+        response = self.client.post(url, [{'location': 'A'}, {}, {'location': 'x' * 300}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data), [1, 2])
+        self.assertIn('location', response.data[1])
+        self.assertIn('location', response.data[2])
+        self.assertEqual(AvailableBook.objects.count(), 6)
+
+    def test_bulk_return_reports_each_borrow_in_order(self):
+        borrows = [
+            Borrow.objects.create(user=self.staff, available_book=copy, return_date=date.today())
+            for copy in self.copies[:4]
+        ]
+        borrows[3].date_returned = date.today()
+        borrows[3].save()
+        self.assertEqual(self.client.get(f'/api/books/{self.books[0].id}').data['available_copies'], 0)
+
+        ids = [borrows[0].id, 999, borrows[1].id, borrows[0].id, borrows[3].id, borrows[2].id]
+        # One looks for waiting holds and two record the returns in the availability feed.
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/borrows/returns', {'borrows': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item.get('error') for item in response.data['results']],
+            [None, 'Not found.', None, 'Listed more than once.', 'Already returned.', None],
+        )
+        self.assertFalse(Borrow.objects.filter(date_returned__isnull=True).exists())
+        self.assertFalse(AvailableBook.objects.filter(is_checked_out=True).exists())
+        self.assertEqual(self.client.get(f'/api/books/{self.books[0].id}').data['available_copies'], 3)
+
+    def test_bulk_return_is_staff_only(self):
+        self.client.force_authenticate(CustomUser.objects.create_user(username='reader', password='pw'))
+        self.assertEqual(self.client.post('/api/borrows/returns', {'borrows': [1]}, format='json').status_code, 403)
+
+
+@override_settings(LIBRARY_PREVIEWS={'WORKERS': 0})
+class PreviewPipelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(username='staff', password='pw', role='staff'))
+        self.books, _ = create_books(2, copies=0)
+
+    def image(self, name='cover.png', size=(1200, 1800)):
+        output = BytesIO()
+        PILImage.new('RGB', size, 'navy').save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def upload(self, book, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/books/{book.id}', {'preview_image': image}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        return Book.objects.get(pk=book.pk)
+
+    def test_uploads_are_deduplicated_and_get_variants(self):
+        first = self.upload(self.books[0], self.image('a.png'))
+        second = self.upload(self.books[1], self.image('b.png'))
+        self.assertEqual(first.preview_image.name, second.preview_image.name)
+        self.assertTrue(first.preview_image.name.endswith(f'{first.preview_hash}.webp'))
+        with PILImage.open(first.preview_image.path) as original:
+            self.assertEqual((original.format, original.size), ('WEBP', (1200, 1800)))
+        with PILImage.open(os.path.join(self.media.name, 'book_previews', first.preview_hash[:2], f'{first.preview_hash}-list.webp')) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 300))
+
+        data = self.client.get('/api/books').data['results'][0]
+        self.assertTrue(data['preview_images']['list'].endswith(f'{first.preview_hash}-list.webp'))
+        self.assertTrue(data['preview_images']['detail'].endswith(f'{first.preview_hash}-detail.webp'))
+
+    def test_backfill_and_garbage_collection(self):
+        legacy = os.path.join(self.media.name, 'book_previews', 'legacy.png')
+        os.makedirs(os.path.dirname(legacy))
+        PILImage.new('RGB', (50, 50), 'red').save(legacy)
+        PILImage.new('RGB', (50, 50), 'red').save(legacy.replace('legacy', 'legacy_4jnpZ2L'))
+        Book.objects.filter(pk=self.books[0].pk).update(preview_image='book_previews/legacy.png')
+        self.assertTrue(self.client.get('/api/books').data['results'][0]['preview_images']['list'].endswith('legacy.png'))
+
+        call_command('process_previews', '--gc', '--min-age=0', stdout=StringIO())
+        book = Book.objects.get(pk=self.books[0].pk)
+        self.assertEqual(book.preview_image.name, f'book_previews/{book.preview_hash[:2]}/{book.preview_hash}.webp')
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.media.name, 'book_previews', book.preview_hash[:2]))),
+            sorted(f'{book.preview_hash}{suffix}.webp' for suffix in ('', '-detail', '-list')),
+        )
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.digest = 'ab' * 32
+        self.content = bytes(range(256)) * 4
+        for name in ('legacy.jpg', f'{self.digest[:2]}/{self.digest}-list.webp'):
+            path = os.path.join(self.media.name, 'book_previews', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as handle:
+                handle.write(self.content)
+        self.url = f'/media/book_previews/{self.digest[:2]}/{self.digest}-list.webp'
+
+    def test_content_addressed_files_are_immutable_and_conditional(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        legacy = self.client.get('/media/book_previews/legacy.jpg')
+        self.assertEqual(legacy['Cache-Control'], 'public, max-age=3600')
+        response = self.client.get('/media/book_previews/legacy.jpg', HTTP_IF_MODIFIED_SINCE=legacy['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=5000-').status_code, 416)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_preview_files_are_served(self):
+        with open(os.path.join(self.media.name, 'secret.txt'), 'w') as handle:
+            handle.write('secret')
+        self.assertEqual(self.client.get('/media/secret.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/book_previews/../secret.txt').status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    @override_settings(LIBRARY_MEDIA={'OFFLOAD': 'x-accel-redirect'})
+    def test_proxy_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/book_previews/{self.digest[:2]}/{self.digest}-list.webp')
+        self.assertEqual(response.content, b'')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.token = Token.objects.create(user=self.staff)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        create_books(1)
+
+    def test_cached_credentials_skip_the_token_query(self):
+        self.client.get('/api/books')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/users/me').data['username'], 'staff')
+
+    def test_revoked_token_stops_working_immediately(self):
+        self.assertEqual(self.client.get('/api/users/me').status_code, 200)
+        self.assertEqual(self.client.delete('/api/auth/sessions').status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me').status_code, 401)
+
+    def test_role_and_active_changes_apply_immediately(self):
+        book_url = f'/api/books/{Book.objects.get().id}'
+        self.assertEqual(self.client.patch(book_url, {'title': 'Renamed'}).status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/users/{self.staff.id}', {'role': 'user'}).status_code, 200)
+        self.assertEqual(self.client.patch(book_url, {'title': 'Again'}).status_code, 403)
+
+        self.staff.is_active = False
+        self.staff.save()
+        self.assertEqual(self.client.get('/api/books').status_code, 401)
+
+
+@override_settings(ROOT_URLCONF='Backend.urls_asgi')
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        self.token = Token.objects.create(user=self.reader)
+        self.books, self.copies = create_books(3, copies=2)
+        Borrow.objects.create(user=self.reader, available_book=self.copies[0], return_date=date.today())
+        Review.objects.create(user=self.reader, book=self.books[0], rating=4)
+        self.urls = [
+            '/api/books?page_size=2',
+            '/api/books?q=book&ordering=title',
+            f'/api/books/{self.books[0].id}',
+            f'/api/books/{self.books[0].id}/available-books',
+            f'/api/books/{self.books[0].id}/reviews',
+            '/api/borrows?user=me',
+        ]
+
+    async def test_async_reads_match_sync_views(self):
+        headers = {'Authorization': f'Token {self.token.key}'}
+        for url in self.urls:
+            with self.subTest(url=url):
+                with override_settings(ROOT_URLCONF='Backend.urls'):
+                    expected = await sync_to_async(self.client.get)(url, headers=headers)
+                await sync_to_async(cache.clear)()
+                response = await self.async_client.get(url, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+                self.assertTrue(response.has_header('ETag'))
+                not_modified = await self.async_client.get(url, headers={**headers, 'If-None-Match': response['ETag']})
+                self.assertEqual(not_modified.status_code, 304)
+
+    async def test_next_page_links_and_errors(self):
+        response = await self.async_client.get('/api/books?page_size=2')
+        following = await self.async_client.get(response.json()['next'])
+        self.assertEqual([book['id'] for book in following.json()['results']], [self.books[2].id])
+        self.assertEqual((await self.async_client.get('/api/books/999999')).status_code, 404)
+        invalid = await self.async_client.get('/api/books', headers={'Authorization': 'Token nope'})
+        self.assertEqual(invalid.status_code, 401)
+
+    async def test_writes_fall_back_to_sync_views(self):
+        staff = await CustomUser.objects.acreate(username='staff', role='staff')
+        token = await Token.objects.acreate(user=staff)
+        response = await self.async_client.patch(
+            f'/api/books/{self.books[0].id}', {'title': 'Renamed'},
+            content_type='application/json', headers={'Authorization': f'Token {token.key}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(f'/api/books/{self.books[0].id}')
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+
+class DatabaseConfigurationTests(TestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite connection tuning')
+    def test_sqlite_connections_use_wal_and_a_busy_timeout(self):
+        with connection.cursor() as cursor:
+            pragmas = {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'synchronous', 'busy_timeout')
+            }
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000})
+
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        with override_settings(LIBRARY_DB_REPLICAS=['replica_0']):
+            self.assertEqual(ReplicaRouter().db_for_read(Book), 'default')
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def test_routes_reads_to_replicas_and_writes_to_the_primary(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Book), 'default')
+        with override_settings(LIBRARY_DB_REPLICAS=['replica_0', 'replica_1']):
+            self.assertIn(router.db_for_read(Book), ['replica_0', 'replica_1'])
+            self.assertEqual(router.db_for_write(Book), 'default')
+            self.assertFalse(router.allow_migrate('replica_0', 'library'))
+            self.assertIsNone(router.allow_migrate('default', 'library'))
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        books, copies = create_books(2)
+        today = date.today()
+        Borrow.objects.bulk_create([
+            Borrow(user=self.reader, available_book=copies[0], borrow_date=today - timedelta(days=20),
+                   return_date=today - timedelta(days=6)),
+            Borrow(user=self.reader, available_book=copies[1], borrow_date=today - timedelta(days=40),
+                   return_date=today - timedelta(days=26), date_returned=today - timedelta(days=20)),
+            Borrow(user=self.staff, available_book=copies[2], borrow_date=today - timedelta(days=3),
+                   return_date=today + timedelta(days=11)),
+            Borrow(user=self.staff, available_book=copies[0], borrow_date=today - timedelta(days=60),
+                   return_date=today - timedelta(days=46), date_returned=today - timedelta(days=50)),
+        ])
+        AvailableBook.objects.filter(id__in=[copies[0].id, copies[2].id]).update(is_checked_out=True)
+        self.copies = copies
+
+    def get_report(self, path, **params):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(f'/api/reports/{path}', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_reports_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/reports/overdue').status_code, 401)
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.client.get('/api/reports/overdue').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get('/api/reports/unknown').status_code, 404)
+        self.assertEqual(self.client.get('/api/reports/overdue.xml').status_code, 404)
+        self.assertEqual(self.client.get('/api/reports/overdue', {'since': '2024-02-01', 'until': '2024-01-01'}).status_code, 400)
+
+    def test_overdue_lists_open_loans_past_due(self):
+        results = json.loads(self.get_report('overdue'))['results']
+        self.assertEqual([(row['user__username'], row['days_overdue']) for row in results], [('reader', 6)])
+        as_of = (date.today() + timedelta(days=12)).isoformat()
+        results = json.loads(self.get_report('overdue', as_of=as_of))['results']
+        self.assertEqual([row['days_overdue'] for row in results], [18, 1])
+
+    def test_loans_per_user_and_most_borrowed(self):
+        results = json.loads(self.get_report('loans-per-user'))['results']
+        self.assertEqual(
+            [(row['user__username'], row['loans'], row['open_loans'], row['overdue_loans'], row['returned_late'])
+             for row in results],
+            [('staff', 2, 1, 0, 0), ('reader', 2, 1, 1, 1)],
+        )
+        refresh_snapshots()
+        since = (date.today() - timedelta(days=45)).isoformat()
+        results = json.loads(self.get_report('most-borrowed', since=since, limit=1))['results']
+        self.assertEqual(results, [{'book_id': self.copies[0].book_id, 'title': 'Book 0', 'author': 'Author 0', 'loans': 2}])
+
+    def test_utilization_streams_csv(self):
+        lines = self.get_report('utilization.csv').splitlines()
+        self.assertEqual(lines, [
+            'location,copies,checked_out,loans,checked_out_ratio',
+            'Shelf 0,2,2,3,1.0',
+            'Shelf 1,2,0,1,0.0',
+        ])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_overdue_uses_the_reporting_index(self):
+        self.client.force_authenticate(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.client.get('/api/reports/overdue').streaming_content)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queries[-1]["sql"]}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(any('borrow_returned_due_idx' in step for step in plan), plan)
+
+
+class CirculationSnapshotTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        (self.emma, self.dune), copies = create_books(2, copies=1)
+        self.emma_copy, self.dune_copy = copies
+        self.loan = Borrow.objects.create(
+            user=self.reader, available_book=self.emma_copy,
+            borrow_date=self.today - timedelta(days=3), return_date=self.today - timedelta(days=1),
+        )
+        Borrow.objects.create(
+            user=self.reader, available_book=self.dune_copy, borrow_date=self.today - timedelta(days=10),
+            return_date=self.today - timedelta(days=5), date_returned=self.today - timedelta(days=8),
+        )
+
+    def snapshots(self, book):
+        return list(
+            DailyCirculation.objects.filter(book=book).order_by('day')
+            .values_list('day', 'checkouts', 'returns', 'open_loans', 'overdue')
+        )
+
+    def test_full_refresh_has_one_row_per_book_per_active_day(self):
+        call_command('refresh_circulation', stdout=StringIO())
+        day = lambda n: self.today - timedelta(days=n)
+        self.assertEqual(self.snapshots(self.emma), [
+            (day(3), 1, 0, 1, 0), (day(2), 0, 0, 1, 0), (day(1), 0, 0, 1, 0), (day(0), 0, 0, 1, 1),
+        ])
+        self.assertEqual(self.snapshots(self.dune), [(day(10), 1, 0, 1, 0), (day(9), 0, 0, 1, 0), (day(8), 0, 1, 0, 0)])
+        call_command('check_circulation', stdout=StringIO(), stderr=StringIO())
+
+    def test_incremental_refresh_only_recomputes_changed_books(self):
+        refresh_snapshots(through=self.today - timedelta(days=1))
+        DailyCirculation.objects.filter(book=self.dune).update(checkouts=7)
+        self.loan.date_returned = self.today - timedelta(days=1)
+        self.loan.save()
+
+        # Watermark, change detection and stale markers, one pass for the changed book's history and one
+        # for the new day.
+        with self.assertNumQueries(13):
+            refresh_snapshots()
+        self.assertEqual(self.snapshots(self.emma)[-1], (self.today - timedelta(days=1), 0, 1, 0, 0))
+        self.assertEqual(set(DailyCirculation.objects.filter(book=self.dune).values_list('checkouts', flat=True)), {7})
+
+        stderr = StringIO()
+        with self.assertRaisesMessage(CommandError, '3 snapshot rows'):
+            call_command('check_circulation', stdout=StringIO(), stderr=stderr)
+        self.assertIn(f'book {self.dune.id}', stderr.getvalue())
+        call_command('refresh_circulation', since=self.today - timedelta(days=30), stdout=StringIO())
+        call_command('check_circulation', stdout=StringIO(), stderr=StringIO())
+
+    def test_incremental_refresh_recounts_books_and_days_a_loan_left(self):
+        refresh_snapshots()
+        self.loan.available_book = self.dune_copy
+        self.loan.borrow_date = self.today - timedelta(days=2)
+        self.loan.save()
+        refresh_snapshots()
+        call_command('check_circulation', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.snapshots(self.emma), [])
+
+        self.dune_copy.book = self.emma
+        self.dune_copy.save()
+        refresh_snapshots()
+        call_command('check_circulation', stdout=StringIO(), stderr=StringIO())
+
+        self.loan.delete()
+        refresh_snapshots()
+        call_command('check_circulation', stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(StaleCirculation.objects.exists())
+
+    def test_daily_circulation_report_reads_the_snapshots(self):
+        staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        refresh_snapshots()
+        client = APIClient()
+        client.force_authenticate(staff)
+        response = client.get('/api/reports/daily-circulation', {'since': self.today - timedelta(days=1)})
+        results = json.loads(b''.join(response.streaming_content))['results']
+        self.assertEqual(results, [
+            {'day': str(self.today - timedelta(days=1)), 'checkouts': 0, 'returns': 0, 'open_loans': 1, 'overdue': 0},
+            {'day': str(self.today), 'checkouts': 0, 'returns': 0, 'open_loans': 1, 'overdue': 1},
+        ])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics_registry.reset()
+        self.client = APIClient()
+        self.books, _ = create_books(6)
+
+    def test_server_timing_reports_queries_and_serializer_time(self):
+        response = self.client.get(f'/api/books/{self.books[0].id}')
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'db', 'serializer', 'total'})
+        self.assertRegex(timing['db'], r'dur=[\d.]+;desc="[1-9]\d* queries"')
+
+        response = self.client.get(f'/api/books/{self.books[0].id}')
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+        with override_settings(LIBRARY_INSTRUMENTATION={'ENABLED': False}):
+            self.assertNotIn('Server-Timing', self.client.get('/api/books'))
+
+    @override_settings(ROOT_URLCONF='Backend.urls_asgi')
+    async def test_async_views_are_measured(self):
+        response = await self.async_client.get(f'/api/books/{self.books[0].id}')
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries", serializer;dur=[\d.]+')
+
+    def test_logs_one_structured_line_per_request(self):
+        with self.assertLogs('library.instrumentation', 'INFO') as logs:
+            self.client.get('/api/books')
+        self.assertEqual(len(logs.records), 1)
+        fields = logs.records[0].request_metrics
+        self.assertEqual((fields['method'], fields['route'], fields['status']), ('GET', 'api/books', 200))
+        self.assertGreater(fields['bytes'], 0)
+
+    def test_flags_repeated_query_templates(self):
+        with measure() as metrics:
+            for book in self.books:
+                Book.objects.get(pk=book.pk)
+            Book.objects.count()
+        (sql, count), = metrics.repeated_queries(5)
+        self.assertEqual(count, 6)
+        self.assertIn('WHERE "library_book"."id" = %s', sql)
+        self.assertEqual(metrics.queries, 7)
+
+    def test_metrics_endpoint_renders_per_route_histograms(self):
+        self.client.get('/api/books')
+        self.client.get('/api/books')
+        with override_settings(LIBRARY_INSTRUMENTATION={'METRICS_ALLOWED_IPS': ('127.0.0.1',)}):
+            self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='10.0.0.8').status_code, 401)
+            response = self.client.get('/api/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('library_http_request_duration_seconds_bucket{method="GET",route="api/books",le="+Inf"} 2', body)
+        self.assertIn('library_http_request_queries_count{method="GET",route="api/books"} 2', body)
+        self.assertIn('library_http_responses_total{method="GET",route="api/books",status="200"} 2', body)
+
+    def test_metrics_require_staff_by_default(self):
+        self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='127.0.0.1').status_code, 401)
+        self.client.force_authenticate(CustomUser.objects.create_user(username='reader', password='pw'))
+        self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.client.force_authenticate(CustomUser.objects.create_user(username='staff', password='pw', role='staff'))
+        self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('seed_library', books=30, copies=2, borrows=300, reviews=100, users=20, stdout=StringIO())
+
+    def test_seed_is_consistent_and_skewed(self):
+        self.assertEqual((Book.objects.count(), AvailableBook.objects.count()), (30, 60))
+        self.assertEqual((Borrow.objects.count(), Review.objects.count()), (300, 100))
+        self.assertEqual(Token.objects.filter(user__username__startswith='bench-').count(), 21)
+        call_command('rebuild_counters', verify=True, stdout=StringIO())
+        busiest = Borrow.objects.values('available_book__book').annotate(n=Count('id')).order_by('-n')[0]['n']
+        self.assertGreater(busiest, 3 * 300 / 30)
+        with self.assertRaises(CommandError):
+            call_command('seed_library', stdout=StringIO())
+
+    def test_in_process_run_writes_a_baseline_and_detects_regressions(self):
+        # Every request takes exactly one tick of a fake clock, so only the query counts can regress.
+        clock = mock.Mock(perf_counter=count(0, 0.5).__next__)
+        with tempfile.TemporaryDirectory() as directory, mock.patch('library.benchmarking.time', clock):
+            path = os.path.join(directory, 'baseline.json')
+            out = StringIO()
+            call_command('benchmark', iterations=4, save_baseline=path, stdout=out)
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+            endpoints = baseline['endpoints']
+            self.assertIn('borrow-return: PATCH borrows/<id> (return)', endpoints)
+            self.assertEqual({row['errors'] for row in endpoints.values()}, {0})
+            self.assertTrue(all(row['queries'] is not None for row in endpoints.values()))
+            self.assertEqual(endpoints['my-borrows: GET /api/borrows?user=me']['requests'], 4)
+
+            self.assertEqual({(row['p50_ms'], row['p95_ms']) for row in endpoints.values()}, {(500.0, 500.0)})
+
+            call_command('benchmark', workload=['my-borrows'], iterations=4, baseline=path, stdout=StringIO())
+            # A baseline no real run can meet: fewer queries than the view needs.
+            endpoints['my-borrows: GET /api/borrows?user=me']['queries'] = 0
+            with open(path, 'w') as baseline_file:
+                json.dump(baseline, baseline_file)
+            stderr = StringIO()
+            with self.assertRaisesMessage(CommandError, '1 regressions'):
+                call_command('benchmark', workload=['my-borrows'], iterations=4, baseline=path, stdout=StringIO(), stderr=stderr)
+            self.assertIn('queries per request, baseline 0', stderr.getvalue())
+
+
+class AccountSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = date.today()
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw', email='reader@example.com')
+        self.other = CustomUser.objects.create_user(username='other', password='pw')
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.books, copies = create_books(4, copies=4)
+        self.open_loans = [
+            Borrow.objects.create(user=self.reader, available_book=copies[0], borrow_date=self.today - timedelta(days=20),
+                                  return_date=self.today - timedelta(days=6)),
+            Borrow.objects.create(user=self.reader, available_book=copies[4], return_date=self.today + timedelta(days=7)),
+        ]
+        for n in range(12):
+            day = self.today - timedelta(days=60 - n)
+            Borrow.objects.create(user=self.reader, available_book=copies[8 + n % 4], borrow_date=day,
+                                  return_date=day + timedelta(days=14), date_returned=day + timedelta(days=3))
+        Borrow.objects.create(user=self.other, available_book=copies[1], return_date=self.today - timedelta(days=1))
+        Review.objects.create(user=self.reader, book=self.books[2], rating=5, comment='Great')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.reader).key}')
+
+    def test_summary_is_built_from_a_fixed_number_of_queries(self):
+        self.client.get('/api/books')
+        # Open loans, recent loans and reviews, plus the email the cached credentials leave deferred.
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/me/summary')
+        data = response.data
+        self.assertEqual(data['user'], {'id': self.reader.id, 'username': 'reader', 'email': 'reader@example.com', 'role': 'user'})
+        self.assertEqual([loan['id'] for loan in data['open_loans']], [loan.id for loan in self.open_loans])
+        self.assertEqual([loan['is_overdue'] for loan in data['open_loans']], [True, False])
+        self.assertEqual(data['overdue_count'], 1)
+        self.assertEqual(data['open_loans'][0]['book'], {'id': self.books[0].id, 'title': 'Book 0', 'author': 'Author 0'})
+        self.assertEqual(len(data['recent_loans']), 10)
+        self.assertEqual([review['book']['id'] for review in data['reviews']], [self.books[2].id])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/users/me/summary').data, data)
+
+    def test_cached_per_user_and_dropped_on_that_users_writes(self):
+        self.client.get('/api/users/me/summary')
+        other = APIClient()
+        other.force_authenticate(self.other)
+        self.assertEqual(other.get('/api/users/me/summary').data['user']['username'], 'other')
+
+        loan = self.open_loans[0]
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        staff.post('/api/borrows/returns', {'borrows': [loan.id]}, format='json')
+        self.assertEqual(self.client.get('/api/users/me/summary').data['overdue_count'], 0)
+
+        self.client.post(f'/api/books/{self.books[3].id}/reviews', {'book': self.books[3].id, 'rating': 2})
+        self.assertEqual(len(self.client.get('/api/users/me/summary').data['reviews']), 2)
+        self.assertEqual(other.get('/api/users/me/summary').data['overdue_count'], 1)
+
+    def test_only_staff_can_read_other_users_summaries(self):
+        self.assertEqual(self.client.get(f'/api/users/{self.other.id}/summary').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/users/{self.reader.id}/summary').status_code, 200)
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        self.assertEqual(staff.get(f'/api/users/{self.other.id}/summary').data['user']['username'], 'other')
+        self.assertEqual(APIClient().get('/api/users/me/summary').status_code, 403)
+
+
+class AvailabilityFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.books, self.copies = create_books(2, copies=2)
+        # The fixtures are bulk-created, so an event here moves the cursor off zero.
+        self.borrow(self.copies[0]).delete()
+        self.after = AvailabilityEvent.objects.latest('pk').pk
+
+    def events(self):
+        return list(
+            AvailabilityEvent.objects.filter(pk__gt=self.after).order_by('pk')
+            .values_list('kind', 'copy_id', 'copy_is_available', 'available_copies')
+        )
+
+    def borrow(self, copy):
+        return Borrow.objects.create(user=self.staff, available_book=copy, return_date=date.today())
+
+    async def read(self, stream):
+        return await asyncio.wait_for(anext(stream), 1)
+
+    def test_writes_append_events_with_current_availability(self):
+        book, (first, second) = self.books[0], self.copies[:2]
+        url = f'/api/books/{book.id}/available-books'
+        response = self.client.post(
+            f'{url}/{first.id}/borrows',
+            {'user': self.staff.id, 'available_book': first.id, 'borrow_date': date.today(), 'return_date': date.today()},
+        )
+        self.client.patch(f"{url}/{first.id}/borrows/{response.data['id']}", {'date_returned': date.today()})
+        loans = [self.borrow(first), self.borrow(second)]
+        self.client.post('/api/borrows/returns', {'borrows': [loan.id for loan in loans]}, format='json')
+        added = self.client.post(url, [{'location': 'Annex'}], format='json').data[0]['id']
+        self.client.delete(f'{url}/{second.id}')
+        self.assertEqual(self.events(), [
+            ('borrowed', first.id, False, 1),
+            ('returned', first.id, True, 2),
+            ('borrowed', first.id, False, 1),
+            ('borrowed', second.id, False, 0),
+            ('returned', first.id, True, 2),
+            ('returned', second.id, True, 2),
+            ('copy_added', added, True, 3),
+            ('copy_removed', second.id, False, 2),
+        ])
+
+    async def test_copies_released_by_holds_are_announced(self):
+        book, (first, second) = self.books[0], self.copies[:2]
+        loans = [await sync_to_async(self.borrow)(copy) for copy in (first, second)]
+        readers = [await sync_to_async(CustomUser.objects.create_user)(username=f'reader{n}') for n in range(2)]
+        holds = [await Hold.objects.acreate(book=book, user=reader) for reader in readers]
+        for loan in loans:
+            loan.date_returned = date.today()
+            await loan.asave()
+        await sync_to_async(cancel_hold)(holds[0].pk)
+        await sync_to_async(readers[1].delete)()
+
+        stream = event_stream(EventFilter(books={book.id}), self.after)
+        try:
+            await self.read(stream)
+            payloads = [json.loads((await self.read(stream)).split('data: ')[1]) for _ in range(6)]
+        finally:
+            await stream.aclose()
+        self.assertEqual(
+            [(payload['type'], payload['copy'], payload['copy_is_available']) for payload in payloads[-2:]],
+            [('returned', first.id, True), ('returned', second.id, True)],
+        )
+        self.assertEqual(payloads[-1]['available_copies'], 2)
+
+    def test_location_filter_matches_normalized_branch_names(self):
+        event_filter = EventFilter.from_query(QueryDict('location= Shelf   0 ,&location=&book=1'))
+        self.assertEqual((event_filter.locations, event_filter.books), ({'Shelf 0'}, {1}))
+
+    async def test_resumes_from_last_event_id_with_filters(self):
+        other_book_copy = self.copies[2]
+        await sync_to_async(self.borrow)(self.copies[0])
+        await sync_to_async(self.borrow)(other_book_copy)
+        await sync_to_async(self.borrow)(self.copies[1])
+
+        stream = event_stream(EventFilter(books={self.books[0].id}), self.after)
+        try:
+            self.assertEqual(await self.read(stream), 'retry: 3000\n\n')
+            events = [await self.read(stream), await self.read(stream)]
+        finally:
+            await stream.aclose()
+        payloads = [json.loads(event.split('data: ')[1]) for event in events]
+        self.assertEqual([payload['copy'] for payload in payloads], [self.copies[0].id, self.copies[1].id])
+        self.assertTrue(events[1].startswith(f"id: {payloads[1]['id']}\nevent: availability\n"))
+
+        stream = event_stream(EventFilter(locations={'Shelf 0'}), self.after)
+        try:
+            await self.read(stream)
+            locations = [json.loads((await self.read(stream)).split('data: ')[1])['location'] for _ in range(2)]
+        finally:
+            await stream.aclose()
+        self.assertEqual(locations, ['Shelf 0', 'Shelf 0'])
+
+    async def test_too_far_behind_or_stale_cursors_reset(self):
+        for copy in self.copies[:3]:
+            await sync_to_async(self.borrow)(copy)
+        latest = await AvailabilityEvent.objects.order_by('-pk').values_list('pk', flat=True).afirst()
+        with override_settings(LIBRARY_AVAILABILITY_FEED={'CATCH_UP_LIMIT': 2}):
+            stream = event_stream(EventFilter(), self.after)
+            try:
+                await self.read(stream)
+                self.assertEqual(await self.read(stream), f'id: {latest}\nevent: reset\ndata: {{}}\n\n')
+            finally:
+                await stream.aclose()
+        await AvailabilityEvent.objects.filter(pk__lte=self.after).adelete()
+        for cursor in (self.after - 1, latest + 50):
+            stream = event_stream(EventFilter(), cursor)
+            try:
+                await self.read(stream)
+                self.assertEqual(await self.read(stream), f'id: {latest}\nevent: reset\ndata: {{}}\n\n')
+            finally:
+                await stream.aclose()
+
+    async def test_new_events_fan_out_to_matching_subscribers(self):
+        streams = [event_stream(EventFilter(books={book.id})) for book in self.books]
+        try:
+            for stream in streams:
+                self.assertEqual(await self.read(stream), f'retry: 3000\nid: {self.after}\n\n')
+
+            def borrow_and_commit():
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.borrow(self.copies[3])
+
+            reading = asyncio.ensure_future(self.read(streams[1]))
+            await sync_to_async(borrow_and_commit)()
+            payload = json.loads((await reading).split('data: ')[1])
+            self.assertEqual(
+                (payload['type'], payload['book'], payload['copy'], payload['available_copies']),
+                ('borrowed', self.books[1].id, self.copies[3].id, 1),
+            )
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(anext(streams[0]), 0.2)
+        finally:
+            for stream in streams:
+                await stream.aclose()
+
+    @override_settings(ROOT_URLCONF='Backend.urls_asgi')
+    async def test_endpoint_streams_event_source_responses(self):
+        response = await self.async_client.get(
+            f'/api/availability/events?book={self.books[0].id},{self.books[1].id}',
+            headers={'Last-Event-ID': str(self.after)},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        chunks = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await asyncio.wait_for(anext(chunks), 1), b'retry: 3000\n\n')
+        finally:
+            await chunks.aclose()
+        invalid = await self.async_client.get('/api/availability/events', headers={'Last-Event-ID': 'soon'})
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_prune_command_drops_old_events(self):
+        AvailabilityEvent.objects.update(created_at=timezone.now() - timedelta(days=40))
+        self.borrow(self.copies[0])
+        out = StringIO()
+        call_command('prune_availability_events', '--days', '30', stdout=out)
+        self.assertIn('Deleted 2 availability events', out.getvalue())
+        self.assertEqual(AvailabilityEvent.objects.count(), 1)
+
+
+class HoldQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.readers = [CustomUser.objects.create_user(username=f'reader{n}', password='pw') for n in range(3)]
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+        self.copies = [AvailableBook.objects.create(book=self.book, branch=shelf(f'Shelf {n}')) for n in range(2)]
+        self.loans = [
+            Borrow.objects.create(user=self.staff, available_book=copy, return_date=date.today()) for copy in self.copies
+        ]
+        self.url = f'/api/books/{self.book.id}/holds'
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def place_holds(self):
+        holds = []
+        for reader in self.readers:
+            response = self.client_for(reader).post(self.url, {})
+            self.assertEqual(response.status_code, 201)
+            holds.append(response.data['id'])
+        return holds
+
+    def hold(self, pk):
+        return Hold.objects.get(pk=pk)
+
+    def borrow(self, user, copy):
+        return self.client_for(self.staff).post(
+            f'/api/books/{self.book.id}/available-books/{copy.id}/borrows',
+            {'user': user.id, 'available_book': copy.id, 'borrow_date': date.today(), 'return_date': date.today()},
+        )
+
+    def test_holds_are_listed_per_user_and_one_active_hold_per_book(self):
+        holds = self.place_holds()
+        reader = self.client_for(self.readers[0])
+        self.assertEqual(reader.post(self.url, {}).status_code, 409)
+        self.assertEqual([hold['id'] for hold in reader.get(self.url).data['results']], holds[:1])
+        self.assertEqual([hold['id'] for hold in self.client_for(self.staff).get(self.url).data['results']], holds)
+        self.assertEqual(APIClient().get(self.url).status_code, 401)
+        self.assertEqual(reader.get(f'{self.url}/{holds[1]}').status_code, 404)
+        self.assertEqual(reader.patch(f'{self.url}/{holds[0]}', {'status': 'ready'}).status_code, 405)
+        past = reader.post(f'/api/books/{self.book.id}/holds', {'expires_at': '2001-01-01T00:00:00Z'})
+        self.assertEqual(past.status_code, 400)
+
+    def test_returned_copy_goes_to_the_oldest_waiting_hold(self):
+        holds = self.place_holds()
+        staff = self.client_for(self.staff)
+        loan_url = f'/api/books/{self.book.id}/available-books/{self.copies[0].id}/borrows/{self.loans[0].id}'
+        self.assertEqual(staff.patch(loan_url, {'date_returned': date.today()}).status_code, 200)
+        first = self.hold(holds[0])
+        self.assertEqual((first.status, first.assigned_copy_id), (Hold.READY, self.copies[0].id))
+        self.assertGreater(first.expires_at, timezone.now())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+        self.assertEqual(self.borrow(self.readers[1], self.copies[0]).status_code, 409)
+        self.assertEqual(self.borrow(self.readers[0], self.copies[0]).status_code, 201)
+        self.assertEqual(self.hold(holds[0]).status, Hold.FULFILLED)
+
+        staff.post('/api/borrows/returns', {'borrows': [self.loans[1].id]}, format='json')
+        second = self.hold(holds[1])
+        self.assertEqual((second.status, second.assigned_copy_id), (Hold.READY, self.copies[1].id))
+        self.assertEqual(self.hold(holds[2]).status, Hold.WAITING)
+        call_command('rebuild_counters', '--verify', stdout=StringIO())
+
+    def test_cancelling_a_ready_hold_passes_the_copy_down_the_line(self):
+        holds = self.place_holds()
+        self.loans[0].date_returned = date.today()
+        self.loans[0].save()
+        reader = self.client_for(self.readers[0])
+        self.assertEqual(reader.delete(f'{self.url}/{holds[0]}').status_code, 204)
+        self.assertEqual(reader.delete(f'{self.url}/{holds[0]}').status_code, 409)
+        self.assertEqual(self.hold(holds[0]).status, Hold.CANCELLED)
+        self.assertEqual(self.hold(holds[1]).assigned_copy_id, self.copies[0].id)
+
+        self.client_for(self.readers[2]).delete(f'{self.url}/{holds[2]}')
+        self.client_for(self.readers[1]).delete(f'{self.url}/{holds[1]}')
+        self.assertFalse(AvailableBook.objects.get(pk=self.copies[0].id).is_checked_out)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_hold_on_a_book_with_a_free_copy_is_ready_at_once(self):
+        self.loans[1].delete()
+        response = self.client_for(self.readers[0]).post(self.url, {})
+        self.assertEqual((response.data['status'], response.data['assigned_copy']), (Hold.READY, self.copies[1].id))
+        self.assertEqual(self.client_for(self.readers[0]).get(f'/api/books/{self.book.id}').data['available_copies'], 0)
+
+    def test_added_copies_and_deleted_loans_feed_the_queue(self):
+        holds = self.place_holds()
+        copy = AvailableBook.objects.create(book=self.book, branch=shelf('Annex'))
+        self.assertEqual(self.hold(holds[0]).assigned_copy_id, copy.id)
+        self.loans[0].delete()
+        self.assertEqual(self.hold(holds[1]).assigned_copy_id, self.copies[0].id)
+        copy.delete()
+        self.assertEqual((self.hold(holds[0]).status, self.hold(holds[0]).assigned_copy_id), (Hold.WAITING, None))
+
+        self.loans[1].date_returned = date.today()
+        self.loans[1].save()
+        self.assertEqual(self.hold(holds[0]).assigned_copy_id, self.copies[1].id)
+        Borrow.objects.filter(pk=self.loans[1].pk).delete()
+        self.assertEqual(self.borrow(self.readers[2], self.copies[1]).status_code, 409)
+
+    def test_sweep_expires_stale_holds_and_reassigns_their_copies(self):
+        holds = self.place_holds()
+        self.loans[0].date_returned = date.today()
+        self.loans[0].save()
+        past = timezone.now() - timedelta(days=1)
+        Hold.objects.filter(pk=holds[0]).update(expires_at=past)
+        Hold.objects.filter(pk=holds[1]).update(expires_at=past)
+        out = StringIO()
+        call_command('expire_holds', '--batch-size', '1', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Expired 2 holds.')
+        self.assertEqual([self.hold(pk).status for pk in holds], [Hold.EXPIRED, Hold.EXPIRED, Hold.READY])
+        self.assertEqual(self.hold(holds[2]).assigned_copy_id, self.copies[0].id)
+
+    def test_holds_past_their_wanted_until_date_are_passed_over(self):
+        holds = self.place_holds()
+        Hold.objects.filter(pk=holds[0]).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.loans[0].date_returned = date.today()
+        self.loans[0].save()
+        self.assertEqual((self.hold(holds[0]).status, self.hold(holds[0]).assigned_copy_id), (Hold.WAITING, None))
+        self.assertEqual(self.hold(holds[1]).assigned_copy_id, self.copies[0].id)
+
+    def test_ready_holds_removed_outside_the_queue_release_their_copy(self):
+        holds = self.place_holds()
+        for loan in self.loans:
+            loan.date_returned = date.today()
+            loan.save()
+        self.readers[0].delete()
+        self.assertEqual(self.hold(holds[2]).assigned_copy_id, self.copies[0].id)
+
+        hold = self.hold(holds[1])
+        hold.status = Hold.CANCELLED
+        hold.save()
+        self.hold(holds[2]).delete()
+        self.assertFalse(AvailableBook.objects.filter(is_checked_out=True).exists())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+        call_command('rebuild_counters', verify=True, stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_queue_head_is_an_index_seek(self):
+        head = Hold.objects.filter(book_id=self.book.id).queue().values_list('id', 'user_id')[:1]
+        sql, params = head.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('hold_queue_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ConcurrentHoldAssignmentTests(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.book = Book.objects.create(title='Dune', author='Herbert')
+        self.copies = [AvailableBook.objects.create(book=self.book, branch=shelf(f'Shelf {n}')) for n in range(10)]
+        self.loans = [
+            Borrow.objects.create(user=self.staff, available_book=copy, return_date=date.today()) for copy in self.copies
+        ]
+        self.readers = [CustomUser.objects.create_user(username=f'reader{n}') for n in range(15)]
+        self.holds = [Hold.objects.create(book=self.book, user=reader) for reader in self.readers]
+
+    def act(self, step):
+        kind, target = step
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        try:
+            if kind == 'return':
+                return client.patch(
+                    f'/api/books/{self.book.id}/available-books/{target.available_book_id}/borrows/{target.id}',
+                    {'date_returned': date.today()},
+                ).status_code
+            if kind == 'bulk-return':
+                return client.post('/api/borrows/returns', {'borrows': [target.id]}, format='json').status_code
+            return client.post(
+                f'/api/books/{self.book.id}/available-books/{target.id}/borrows',
+                {'user': self.staff.id, 'available_book': target.id, 'return_date': date.today(), 'borrow_date': date.today()},
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_every_returned_copy_goes_to_exactly_one_holder(self):
+        steps = []
+        for n, loan in enumerate(self.loans):
+            copy = loan.available_book
+            steps += [('return' if n % 2 else 'bulk-return', loan), ('snatch', copy), ('snatch', copy)]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            statuses = list(pool.map(self.act, steps))
+
+        self.assertEqual([status for (kind, _), status in zip(steps, statuses) if kind != 'snatch'], [200] * 10)
+        # Copies are claimed for a holder in the same transaction that returns them, so nobody else gets one.
+        self.assertEqual({status for (kind, _), status in zip(steps, statuses) if kind == 'snatch'}, {409})
+        ready = Hold.objects.filter(status=Hold.READY)
+        self.assertEqual(sorted(ready.values_list('assigned_copy_id', flat=True)), [copy.id for copy in self.copies])
+        self.assertEqual(set(ready.values_list('pk', flat=True)), {hold.pk for hold in self.holds[:10]})
+        self.assertEqual(Hold.objects.filter(status=Hold.WAITING).count(), 5)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+        call_command('rebuild_counters', '--verify', stdout=StringIO())
+
+
+class BranchInventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create_user(username='staff', password='pw', role='staff')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.books, _ = create_books(3, copies=0)
+        self.main, self.north = shelf('Main'), shelf('North')
+        self.copies = [
+            AvailableBook.objects.create(book=book, branch=branch)
+            for book in self.books for branch in (self.main, self.main, self.north)
+        ]
+        Borrow.objects.create(user=self.staff, available_book=self.copies[0], return_date=date.today())
+        Borrow.objects.create(user=self.staff, available_book=self.copies[5], return_date=date.today())
+
+    def ids(self, url, params):
+        return sorted(copy['id'] for copy in self.client.get(url, params).data['results'])
+
+    def test_copies_filter_by_location_and_availability(self):
+        url = f'/api/books/{self.books[0].id}/available-books'
+        self.assertEqual(self.ids(url, {'location': ' Main'}), [copy.id for copy in self.copies[:2]])
+        self.assertEqual(self.ids(url, {'location': 'Main', 'available': 'true'}), [self.copies[1].id])
+        self.assertEqual(self.ids(url, {'branch': self.north.id}), [self.copies[2].id])
+        self.assertEqual(self.ids(url, {'location': 'Nowhere'}), [])
+        self.assertEqual(
+            self.ids('/api/available-books', {'location': 'North,Main', 'available': 'false'}),
+            [self.copies[0].id, self.copies[5].id],
+        )
+        self.assertEqual(self.client.get(url, {'available': 'maybe'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'branch': 'main'}).status_code, 400)
+        response = self.client.get(url, {'location': 'Main'})
+        self.assertEqual(response.data['results'][0]['location'], 'Main')
+        self.assertEqual(response.data['results'][0]['branch'], self.main.id)
+
+    def test_writes_take_location_names_and_reuse_branches(self):
+        url = f'/api/books/{self.books[0].id}/available-books'
+        response = self.client.post(url, {'book': self.books[0].id, 'location': '  North '})
+        self.assertEqual((response.data['branch'], response.data['location']), (self.north.id, 'North'))
+        response = self.client.patch(f"{url}/{response.data['id']}", {'location': 'Annex'})
+        self.assertEqual(response.data['location'], 'Annex')
+        self.assertEqual(Branch.objects.count(), 3)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_copy_lookup_uses_the_book_branch_index(self):
+        copies = AvailableBook.objects.filter(
+            book_id=self.books[0].id, branch__in=Branch.objects.filter(name__in=['Main']).values('pk'),
+        )
+        sql, params = copies.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('copy_book_branch_idx', plan)
+
+    def test_inventory_counts_copies_per_book_in_one_query(self):
+        url = f'/api/branches/{self.main.id}/inventory'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(
+            [(row['book'], row['title'], row['copies'], row['available_copies']) for row in response.data['results']],
+            [(book.id, book.title, 2, 1 if n == 0 else 2) for n, book in enumerate(self.books)],
+        )
+        self.assertEqual([row['book'] for row in self.client.get(url, {'available': 'false'}).data['results']], [])
+        north = self.client.get(f'/api/branches/{self.north.id}/inventory', {'available': 'false'}).data['results']
+        self.assertEqual([row['book'] for row in north], [self.books[1].id])
+
+        seen, page = [], f'{url}?page_size=2'
+        while page:
+            response = self.client.get(page)
+            seen += [row['book'] for row in response.data['results']]
+            page = response.data['next']
+        self.assertEqual(seen, [book.id for book in self.books])
+        self.assertEqual(self.client.get('/api/branches/999/inventory').status_code, 404)
+
+    def test_branches_are_managed_by_staff(self):
+        response = self.client.get('/api/branches')
+        self.assertEqual(
+            [(row['name'], row['total_copies'], row['available_copies']) for row in response.data['results']],
+            [('Main', 6, 5), ('North', 3, 2)],
+        )
+        self.assertEqual(self.client.post('/api/branches', {'name': ' East   Wing '}).data['name'], 'East Wing')
+        self.assertEqual(self.client.post('/api/branches', {'name': 'North '}).status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/branches/{self.north.id}').status_code, 409)
+        reader = APIClient()
+        reader.force_authenticate(CustomUser.objects.create_user(username='reader', password='pw'))
+        self.assertEqual(reader.post('/api/branches', {'name': 'Attic'}).status_code, 403)
+
+    def test_renaming_a_branch_changes_copy_and_loan_validators(self):
+        urls = [f'/api/books/{self.books[0].id}/available-books', '/api/borrows']
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.client.patch(f'/api/branches/{self.main.id}', {'name': 'Central'})
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+class BranchMigrationTests(TransactionTestCase):
+    before = [('library', '0014_holds')]
+    after = [('library', '0015_branches')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_location_strings_become_branches(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        book = apps.get_model('library', 'Book').objects.create(title='Dune', author='Herbert')
+        OldCopy = apps.get_model('library', 'AvailableBook')
+        for location in ('Main', ' Main ', 'North  Wing', ''):
+            OldCopy.objects.create(book=book, location=location)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        copies = apps.get_model('library', 'AvailableBook').objects.order_by('pk').values_list('branch__name', flat=True)
+        self.assertEqual(list(copies), ['Main', 'Main', 'North Wing', 'Unassigned'])
+        self.assertEqual(apps.get_model('library', 'Branch').objects.count(), 3)
+
+
+
+class UniqueOpenBorrowMigrationTests(TransactionTestCase):
+    before = [('library', '0004_availability_counters')]
+    after = [('library', '0005_unique_open_borrow')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicate_open_borrows_keep_the_earliest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('library', 'CustomUser').objects.create(username='reader')
+        book = apps.get_model('library', 'Book').objects.create(title='Dune', author='Herbert')
+        copy = apps.get_model('library', 'AvailableBook').objects.create(book=book, location='Main')
+        OldBorrow = apps.get_model('library', 'Borrow')
+        today = date.today()
+        later = OldBorrow.objects.create(
+            user=user, available_book=copy, borrow_date=today, return_date=today + timedelta(days=7),
+        )
+        earliest = OldBorrow.objects.create(
+            user=user, available_book=copy, borrow_date=today - timedelta(days=2), return_date=today,
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        Borrow = executor.loader.project_state(self.after).apps.get_model('library', 'Borrow')
+        self.assertIsNone(Borrow.objects.get(pk=earliest.pk).date_returned)
+        self.assertEqual(Borrow.objects.get(pk=later.pk).date_returned, today)
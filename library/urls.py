@@ -6,6 +6,11 @@ from .views import (
     AvailableBookViewSet,
     BorrowViewSet,
     ReviewViewSet,
+    HoldViewSet,
+    BranchViewSet,
+    CatalogExportView,
+    ReportView,
+    MetricsView,
     RegisterView,
     UserViewSet,
     SessionView
@@ -17,6 +22,7 @@ router.register(r'books', BookViewSet, basename='book')
 router.register(r'available-books', AvailableBookViewSet, basename='available-book-flat')
 router.register(r'borrows', BorrowViewSet, basename='borrow-flat')
 router.register(r'reviews', ReviewViewSet, basename='review-flat')
+router.register(r'branches', BranchViewSet, basename='branch')
 
 
 books_router = routers.NestedDefaultRouter(router, r'books', lookup='book')
@@ -28,6 +34,7 @@ availablebooks_router.register(r'borrows', BorrowViewSet, basename='borrow')
 
 
 books_router.register(r'reviews', ReviewViewSet, basename='review')
+books_router.register(r'holds', HoldViewSet, basename='hold')
 
 
 router.register(r'users', UserViewSet)
@@ -35,6 +42,10 @@ urlpatterns = [
     path('', include(router.urls)),
     path('', include(books_router.urls)),
     path('', include(availablebooks_router.urls)),
+    path('export/<str:dataset>.<str:extension>', CatalogExportView.as_view()),
+    path('reports/<str:report>.<str:extension>', ReportView.as_view()),
+    path('reports/<str:report>', ReportView.as_view()),
+    path('metrics', MetricsView.as_view()),
     path('auth/users', RegisterView.as_view()),
     path('auth/sessions', SessionView.as_view()),
 ]
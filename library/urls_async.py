@@ -0,0 +1,18 @@
+from django.urls import path
+
+from .async_views import async_read_view
+from .feed import availability_events
+from .views import AvailableBookViewSet, BookViewSet, BorrowViewSet, ReviewViewSet
+
+LIST_ACTIONS = {'get': 'list', 'post': 'create'}
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+
+# Served ahead of library.urls by the ASGI deployment; anything not listed here falls through to the router.
+urlpatterns = [
+    path('books', async_read_view(BookViewSet, LIST_ACTIONS)),
+    path('books/<int:pk>', async_read_view(BookViewSet, DETAIL_ACTIONS)),
+    path('books/<int:book_pk>/available-books', async_read_view(AvailableBookViewSet, LIST_ACTIONS)),
+    path('books/<int:book_pk>/reviews', async_read_view(ReviewViewSet, LIST_ACTIONS)),
+    path('borrows', async_read_view(BorrowViewSet, LIST_ACTIONS)),
+    path('availability/events', availability_events),
+]
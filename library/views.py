@@ -1,12 +1,28 @@
+from django.db.models import Count, F, ProtectedError, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, UnsupportedMediaType, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from .models import Book, AvailableBook, Borrow, Review, CustomUser
+from .models import Book, AvailableBook, Borrow, Branch, Hold, Review, CustomUser
 from .serializers import BookSerializer, AvailableBookReadSerializer, AvailableBookWriteSerializer, ReviewReadSerializer, ReviewWriteSerializer, \
-    BorrowReadSerializer, BorrowWriteSerializer, UserRegisterSerializer, CustomUserSerializer
-from .permissions import IsStaffOrReadOnly, IsStaffOrReadOnlyExceptReviewPost
+    BorrowReadSerializer, BorrowWriteSerializer, UserRegisterSerializer, CustomUserSerializer, AvailableBookBatchWriteSerializer, \
+    BorrowReturnSerializer, ReportParamsSerializer, AccountSummarySerializer, HoldSerializer, BranchSerializer, \
+    BranchInventorySerializer
+from .bulk import EXPORT_DATASETS, IMPORT_FORMATS, detect_format, export_rows, import_books, read_records, serialize_rows
+from .cache import CachedResponseMixin, entry_from_response, response_cache, response_from_entry
+from .conditional import ConditionalGetMixin
+from .exceptions import Conflict
+from .filters import BookFilter, BookOrderingFilter, BookSearchFilter, CopyFilter, boolean_param
+from .holds import cancel_hold
+from .instrumentation import TimedSerializerMixin, metrics_registry
+from .pagination import BookCursorPagination
+from .permissions import CanScrapeMetrics, IsStaff, IsStaffOrReadOnly, IsStaffOrReadOnlyExceptReviewPost
+from .reports import REPORTS
 
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
@@ -25,72 +41,136 @@ class SessionView(APIView):
         if self.request.method == 'DELETE':
             return [IsAuthenticated()]
         return []
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CachedResponseMixin, ConditionalGetMixin, TimedSerializerMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [IsStaffOrReadOnly]
+    filter_backends = [BookSearchFilter, BookFilter, BookOrderingFilter]
+    ordering_fields = ['title', 'author', 'published_date', 'average_rating', 'review_count']
+    ordering = ['id']
 
-class AvailableBookViewSet(viewsets.ModelViewSet):
+    def get_cache_scopes(self):
+        if self.action == 'retrieve':
+            return [f"book:{self.kwargs['pk']}"]
+        return ['books']
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        on_conflict = request.query_params.get('on_conflict', 'update')
+        if on_conflict not in ('update', 'skip'):
+            raise ValidationError({'on_conflict': ["Expected 'update' or 'skip'."]})
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({'file': ['This field is required.']})
+            file_format = detect_format(upload.name, upload.content_type)
+            stream = upload
+        else:
+            file_format = detect_format(content_type=request.content_type)
+            stream = request.stream or []
+        if file_format is None:
+            raise UnsupportedMediaType(request.content_type)
+        result = import_books(read_records(stream, file_format), update_existing=on_conflict == 'update')
+        return Response(result)
+
+class AvailableBookViewSet(CachedResponseMixin, ConditionalGetMixin, TimedSerializerMixin, viewsets.ModelViewSet):
     permission_classes = [IsStaffOrReadOnly]
+    filter_backends = [CopyFilter]
+    version_fields = ('updated_at', 'book__updated_at', 'branch__updated_at')
+
+    def get_cache_scopes(self):
+        book_pk = self.kwargs.get('book_pk')
+        if book_pk:
+            return [f'book:{book_pk}']
+        return None
 
     def get_queryset(self):
+        queryset = AvailableBook.objects.select_related('book', 'branch')
         book_pk = self.kwargs.get('book_pk')
         if book_pk:
-            return AvailableBook.objects.filter(book_id=book_pk)
-        return AvailableBook.objects.all()
+            return queryset.filter(book_id=book_pk)
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return AvailableBookReadSerializer
         return AvailableBookWriteSerializer
 
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        book = get_object_or_404(Book, pk=self.kwargs['book_pk'])
+        serializer = AvailableBookBatchWriteSerializer(data=request.data, many=True, max_length=1000)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(book=book)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy'] and not self.kwargs.get('book_pk'):
             raise PermissionDenied("You are not allowed to perform this action on the flat URI.")
         return super().get_permissions()
 
-class BorrowViewSet(viewsets.ModelViewSet):
+class BorrowViewSet(ConditionalGetMixin, TimedSerializerMixin, viewsets.ModelViewSet):
     permission_classes = [IsStaffOrReadOnly]
+    version_fields = (
+        'updated_at', 'available_book__updated_at', 'available_book__book__updated_at',
+        'available_book__branch__updated_at',
+    )
 
     def get_queryset(self):
+        queryset = Borrow.objects.select_related('user', 'available_book__book', 'available_book__branch')
         user_param = self.request.query_params.get('user')
         if user_param == 'me' and self.request.user.is_authenticated:
-            return Borrow.objects.filter(user=self.request.user)
+            return queryset.filter(user=self.request.user)
         book_pk = self.kwargs.get('book_pk')
         availablebook_pk = self.kwargs.get('availablebook_pk')
         if book_pk and availablebook_pk:
-            return Borrow.objects.filter(available_book__book_id=book_pk, available_book_id=availablebook_pk)
+            return queryset.filter(available_book__book_id=book_pk, available_book_id=availablebook_pk)
         if availablebook_pk:
-            return Borrow.objects.filter(available_book_id=availablebook_pk)
-        return Borrow.objects.all()
+            return queryset.filter(available_book_id=availablebook_pk)
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save()
 
+    @action(detail=False, methods=['post'], url_path='returns')
+    def returns(self, request, *args, **kwargs):
+        serializer = BorrowReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': serializer.save()})
+
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return BorrowReadSerializer
         return BorrowWriteSerializer
 
     def get_permissions(self):
-        if self.action not in ['list', 'retrieve'] and not self.kwargs.get('book_pk'):
+        if self.action not in ['list', 'retrieve', 'returns'] and not self.kwargs.get('book_pk'):
             raise PermissionDenied("You are not allowed to perform this action on the flat URI.")
         return super().get_permissions()
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(CachedResponseMixin, ConditionalGetMixin, TimedSerializerMixin, viewsets.ModelViewSet):
     permission_classes = [IsStaffOrReadOnlyExceptReviewPost]
+    version_fields = ('updated_at', 'book__updated_at')
+
+    def get_cache_scopes(self):
+        book_pk = self.kwargs.get('book_pk')
+        if book_pk and 'user' not in self.request.query_params:
+            return [f'book:{book_pk}', f'book:{book_pk}:reviews', 'users']
+        return None
 
     def get_queryset(self):
+        queryset = Review.objects.select_related('user', 'book')
         user_param = self.request.query_params.get('user')
         if user_param == 'me' and self.request.user.is_authenticated:
-            return Review.objects.filter(user=self.request.user)
+            return queryset.filter(user=self.request.user)
 
         book_pk = self.kwargs.get('book_pk')
         if book_pk:
-            return Review.objects.filter(book_id=book_pk)
+            return queryset.filter(book_id=book_pk)
 
-        return Review.objects.all()
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -106,6 +186,101 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return ReviewWriteSerializer
 
 
+class HoldViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
+    serializer_class = HoldSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        # Staff see the whole queue for a book; everyone else only their own holds.
+        queryset = Hold.objects.filter(book_id=self.kwargs['book_pk']).order_by('created_at', 'id')
+        status_param = self.request.query_params.get('status')
+        if status_param == 'active':
+            queryset = queryset.filter(status__in=Hold.ACTIVE)
+        elif status_param:
+            queryset = queryset.filter(status=status_param)
+        if self.request.user.role != 'staff':
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def perform_create(self, serializer):
+        book = get_object_or_404(Book, pk=self.kwargs['book_pk'])
+        serializer.save(book=book, user=self.request.user)
+
+    def perform_destroy(self, instance):
+        # Cancelled rather than deleted, so the queue keeps its history.
+        if not cancel_hold(instance.pk):
+            raise Conflict('This hold is no longer active.')
+
+
+class BranchViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
+    serializer_class = BranchSerializer
+    permission_classes = [IsStaffOrReadOnly]
+
+    def get_queryset(self):
+        return Branch.objects.annotate(
+            total_copies=Count('copies'), available_copies=Count('copies', filter=Q(copies__is_checked_out=False)),
+        )
+
+    def perform_destroy(self, instance):
+        try:
+            instance.delete()
+        except ProtectedError:
+            raise Conflict('Move or remove the copies at this branch first.')
+
+    @action(detail=True, methods=['get'], url_path='inventory')
+    def inventory(self, request, *args, **kwargs):
+        # One grouped query per page over copy_branch_inventory_idx.
+        branch = get_object_or_404(Branch, pk=kwargs['pk'])
+        rows = (
+            AvailableBook.objects.filter(branch=branch)
+            .values('book')
+            .annotate(
+                title=F('book__title'), author=F('book__author'),
+                copies=Count('id'), available_copies=Count('id', filter=Q(is_checked_out=False)),
+            )
+        )
+        if 'available' in request.query_params:
+            available = boolean_param(request.query_params, 'available')
+            rows = rows.filter(available_copies__gt=0) if available else rows.filter(available_copies=0)
+        paginator = BookCursorPagination()
+        page = paginator.paginate_queryset(rows, request, self)
+        return paginator.get_paginated_response(BranchInventorySerializer(page, many=True).data)
+
+
+STREAM_CONTENT_TYPES = {'json': 'application/json', 'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+class CatalogExportView(APIView):
+    permission_classes = [IsStaff]
+
+    def get(self, request, dataset, extension):
+        if dataset not in EXPORT_DATASETS or extension not in IMPORT_FORMATS:
+            raise Http404
+        response = StreamingHttpResponse(export_rows(dataset, extension), content_type=STREAM_CONTENT_TYPES[extension])
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{extension}"'
+        return response
+
+
+class ReportView(APIView):
+    permission_classes = [IsStaff]
+
+    def get(self, request, report, extension='json'):
+        if report not in REPORTS or extension not in STREAM_CONTENT_TYPES:
+            raise Http404
+        params = ReportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        fields, rows = REPORTS[report](params.validated_data)
+        return StreamingHttpResponse(serialize_rows(fields, rows, extension), content_type=STREAM_CONTENT_TYPES[extension])
+
+
+class MetricsView(APIView):
+    permission_classes = [CanScrapeMetrics]
+
+    def get(self, request):
+        return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class RegisterView(APIView):
     def post(self, request):
         serializer = UserRegisterSerializer(data=request.data)
@@ -115,7 +290,7 @@ class RegisterView(APIView):
             return Response({'token': token.key}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsStaffOrReadOnly]
@@ -125,4 +300,50 @@ class UserViewSet(viewsets.ModelViewSet):
             if not request.user.is_authenticated:
                 raise PermissionDenied("You must be authenticated to access your own data.")
             return Response(self.get_serializer(request.user).data)
-        return super().retrieve(request, *args, **kwargs)
\ No newline at end of file
+        return super().retrieve(request, *args, **kwargs)
+
+    summary_recent_loans = 10
+    summary_reviews = 50
+
+    @action(detail=True, methods=['get'], url_path='summary')
+    def summary(self, request, *args, **kwargs):
+        if kwargs.get('pk') == 'me':
+            if not request.user.is_authenticated:
+                raise PermissionDenied("You must be authenticated to access your own data.")
+            user = request.user
+        else:
+            user = self.get_object()
+            if user.pk != request.user.pk and not IsStaff().has_permission(request, self):
+                raise PermissionDenied("You can only view your own summary.")
+
+        # One entry per user, dropped by that user's borrow and review writes. Book titles are
+        # not tracked, so a rename shows up once the entry times out.
+        use_cache = response_cache.config.get('ENABLED', True)
+        if use_cache:
+            key = response_cache.key([f'user:{user.pk}'], f'{request.build_absolute_uri()}#user={user.pk}')
+            entry = response_cache.get(key)
+            if entry is not None:
+                return response_from_entry(request, entry)
+        response = Response(self.account_summary(user))
+        if use_cache:
+            response_cache.set(key, entry_from_response(response))
+        return response
+
+    def account_summary(self, user):
+        today = timezone.localdate()
+        loans = Borrow.objects.filter(user=user).select_related('available_book__book', 'available_book__branch').only(
+            'borrow_date', 'return_date', 'date_returned', 'available_book__branch__name',
+            'available_book__book__title', 'available_book__book__author',
+        )
+        open_loans = list(loans.filter(date_returned__isnull=True).order_by('return_date', 'id'))
+        recent_loans = loans.filter(date_returned__isnull=False).order_by('-date_returned', '-id')
+        reviews = Review.objects.filter(user=user).select_related('book').only(
+            'rating', 'comment', 'updated_at', 'book__title', 'book__author',
+        ).order_by('-updated_at', '-id')
+        return AccountSummarySerializer({
+            'user': user,
+            'open_loans': open_loans,
+            'overdue_count': sum(loan.return_date < today for loan in open_loans),
+            'recent_loans': recent_loans[:self.summary_recent_loans],
+            'reviews': reviews[:self.summary_reviews],
+        }, context={'request': self.request, 'today': today}).data
\ No newline at end of file